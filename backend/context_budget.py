@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Token budgeting for the timeline prompt (populate_blanks.make_new_timeline).
+News history, Wikipedia and DDG material are cut into chunks, each chunk scored (recency / relevance),
+and the best chunks kept - in their original order - until the source's share of the budget is used.
+All local, so no LLM shrink round-trips; those (shrink_news_items etc.) only run when local fitting
+would throw away most of a source (more than llm_shrink_ratio times its budget).
+
+Token counts use Mistral's own tokenizer (mistral-common, v1 = open-mixtral-8x7b) when installed,
+otherwise the old 1 token ≈ 4 characters estimate.
+"""
+
+import logging
+import re
+
+try:
+    from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
+    tokenizer = MistralTokenizer.v1().instruct_tokenizer.tokenizer
+except ImportError:
+    tokenizer = None
+    logging.warning('mistral-common not installed, token counts estimated as characters / 4')
+
+timeline_budget = 6000 # tokens for news + wikipedia + DDG together; the template itself adds ~700
+budget_shares = {'news': 0.45, 'wikipedia': 0.30, 'ddg': 0.25} # unused share rolls over to the others
+llm_shrink_ratio = 4 # LLM shrink only if a source is over this many times its budget; None to never
+max_chunk_tokens = 200 # longer paragraphs are split into sentences
+recency_half_life = 365 # days; news item weight halves every this many days back
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    if tokenizer:
+        return len(tokenizer.encode(text, bos=False, eos=False))
+    return int(len(text) / 4) # A rough estimate for English text: 1 token ≈ 4 characters
+
+
+def allocate(needs, total=timeline_budget, shares=budget_shares):
+    """ per-source token budgets: each gets up to its share, then leftover goes to whoever still needs more, in shares order """
+    budgets = {name: min(needs.get(name, 0), int(total * share)) for name, share in shares.items()}
+    leftover = total - sum(budgets.values())
+    for name in shares:
+        extra = min(leftover, needs.get(name, 0) - budgets[name])
+        budgets[name] += extra
+        leftover -= extra
+    return budgets
+
+
+def fit_chunks(chunks, budget, sep=' '):
+    """
+    chunks - list of (score, text); keeps highest scores first while they fit, returns kept text in original order.
+    Returns (text, tokens kept).
+    """
+    sized = [(score, order, text, count_tokens(text)) for order, (score, text) in enumerate(chunks)]
+    kept = []
+    used = 0
+    for score, order, text, tokens in sorted(sized, key=lambda chunk: (-chunk[0], chunk[1])):
+        if used + tokens <= budget:
+            kept.append((order, text))
+            used += tokens
+    return sep.join(text for order, text in sorted(kept)), used
+
+
+def text_chunks(text, entity_name):
+    """
+    Split search / wikipedia text into paragraphs (sentences if long) scored for timeline relevance:
+    earlier is better (wikipedia leads with the overview), mentions of the entity and of years are better.
+    """
+    pieces = []
+    for para in re.split(r'\n\s*\n|\n(?=Page: )', text or ''):
+        para = para.strip()
+        if not para:
+            continue
+        if count_tokens(para) > max_chunk_tokens:
+            pieces.extend(sentence for sentence in re.split(r'(?<=[.!?])\s+', para) if sentence)
+        else:
+            pieces.append(para)
+    name = entity_name.lower()
+    chunks = []
+    for position, piece in enumerate(pieces):
+        score = 1 / (1 + 0.05 * position)
+        score += 0.5 * min(piece.lower().count(name), 3)
+        score += 0.3 * min(len(re.findall(r'\b(?:19|20)\d\d\b', piece)), 3)
+        chunks.append((score, piece))
+    return chunks
+
+
+def news_chunks(entries, today):
+    """
+    entries - list of dicts (date, stage, text) in date order; score by recency,
+    boosted where the stage moved from the previous entry, for foundational items, and for ones with actual news text.
+    """
+    chunks = []
+    prev_stage = None
+    for entry in entries:
+        score = 1.0
+        if entry['date']:
+            age = max((today - entry['date']).days, 0)
+            score += 0.5 ** (age / recency_half_life)
+        if prev_stage is not None and entry['stage'] != prev_stage:
+            score += 1.0
+        if entry.get('foundational'):
+            score += 1.0
+        if entry.get('has_news'):
+            score += 0.5
+        prev_stage = entry['stage']
+        chunks.append((score, entry['text']))
+    return chunks
+
+
+def fit_source(source, text, chunks, budget, entity_name, shrink=None, sep=' '):
+    """
+    One source (news / wikipedia / ddg) cut down to budget tokens.
+    Local chunk selection normally; if the source is more than llm_shrink_ratio times over, the best
+    llm_shrink_ratio x budget worth goes through shrink (the LLM condense call) first, then is fitted locally as a hard cap.
+    """
+    need = count_tokens(text)
+    if need <= budget:
+        return text
+    if shrink and llm_shrink_ratio and need > budget * llm_shrink_ratio:
+        text, used = fit_chunks(chunks, budget * llm_shrink_ratio, sep)
+        text = shrink(text)
+        logging.info(f'==> Shrunk! (LLM, last resort) {source} from {need} tokens: {text}')
+        if count_tokens(text) <= budget:
+            return text
+        chunks = text_chunks(text, entity_name)
+    text, used = fit_chunks(chunks, budget, sep)
+    logging.info(f'==> {source} fitted locally to budget: kept {used} of {need} tokens')
+    return text
@@ -30,7 +30,8 @@ from email.policy import default
 from email.utils import parsedate_to_datetime
 from langchain_core.output_parsers.json import JsonOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_mistralai.chat_models import ChatMistralAI
+from llm_cache import response_cache
+from llm_client import large_lang_model
 import re
 import smtplib
 import socket
@@ -50,9 +51,7 @@ SENT_BOX_NAME = os.getenv('SENT_BOX_NAME') # "Sent" or "[Gmail]/Sent Mail" or "I
 JUNK_BOX_NAME = os.getenv('JUNK_BOX_NAME')
 HITL_BOX_NAME = os.getenv('HITL_BOX_NAME')
 
-# LLM stuff
-llm_api_key = os.getenv('MISTRAL_API_KEY')
-llm_temp = 0.25
+# LLM stuff - model, limits and cache are in llm_client.py / llm_cache.py
 
 
 def fetch_unseen_imap():
@@ -223,14 +222,6 @@ def move_email(email_from, email_uid, email_to):
             mail.expunge() # Permanently remove deleted emails
 
 
-def large_lang_model(query):
-    large_lang_model = ChatMistralAI(model_name = 'open-mixtral-8x7b', 
-                                     mistral_api_key = llm_api_key, 
-                                     temperature = llm_temp, 
-                                     verbose = True )
-    return large_lang_model
-
-
 EMAIL_REPLY_ACTION_TEMPLATE = '''
 Can you compose a reasonable reply end-user's email?
 
@@ -411,6 +402,7 @@ def main():
         move_email(email_from = INBOX_NAME, email_uid = email_uid, email_to = HITL_BOX_NAME)
         logging.warning(f'Email moved to HITL folder; no idea what to do with email from {from_header} sent {date_sent} with subject {subject} - please check it out.')
     ### should implement some check on mailbox size used, delete older Junk and read emails in Inbox and read emails in HITL
+    logging.info(response_cache.stats_report())
     logging.info(f'Ended email automations run')
 
 
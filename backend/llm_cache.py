@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""
+Disk-backed response cache for the LangChain chains in semantics.py, populate_blanks.py, process_notifications.py and email_automation.py.
+Plugged into the shared client in llm_client.py as ChatMistralAI(cache = response_cache).
+LangChain hands lookup/update the rendered prompt (template + inputs, serialized messages) and the llm_string (model name, temperature, etc.),
+so the key - sha256 of the two - changes whenever the model, temperature, template or any input changes.
+Entries expire after cache_ttl and the least recently used are evicted past cache_max_entries.
+Lookups only read: hit times (last_used, for eviction order) and the hit / miss / eviction counts are kept in memory
+and written together every flush_every lookups, on each update, on stats_report and at exit - not one commit per hit.
+Set LLM_CACHE=off in .env to bypass (ex: when a fresh judgment is wanted for identical text).
+
+python3 llm_cache.py          # hit-rate / size report
+python3 llm_cache.py --clear  # drop all entries
+"""
+
+import os
+import sys
+import logging
+import sqlite3
+import hashlib
+import threading
+import time
+import json
+import atexit
+from collections import Counter
+from datetime import timedelta
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+cache_path = os.getenv('LLM_CACHE_PATH', os.path.join(script_directory, 'llm_cache.db'))
+cache_enabled = os.getenv('LLM_CACHE', 'on').lower() != 'off'
+cache_ttl = timedelta(days=14)
+cache_max_entries = 5000
+flush_every = 50 # lookups between writes of buffered hit times / counts
+
+
+class DiskLLMCache(BaseCache):
+    """ SQLite file cache; one connection shared by threads (guarded), async lookups run it in the default executor """
+
+    def __init__(self, path, ttl=cache_ttl, max_entries=cache_max_entries, enabled=True):
+        self.path = path
+        self.ttl = ttl.total_seconds()
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.conn = None
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'writes': 0, 'evicted': 0}
+        self.touched = {} # key -> last_used, not yet written
+        self.unreadable = set() # keys to drop at next flush
+        self.unsaved = Counter() # totals not yet written
+        self.lookups = 0
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30) # file shared by concurrent cron scripts
+            self.conn.execute('PRAGMA journal_mode = WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, llm_string TEXT, value TEXT, created REAL, last_used REAL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS ix_responses_last_used ON responses (last_used)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, count INTEGER)') # across runs, for the report
+        return self.conn
+
+    def key(self, prompt, llm_string):
+        return hashlib.sha256(f'{llm_string}\x00{prompt}'.encode()).hexdigest()
+
+    def count(self, name, amount=1):
+        self.stats[name] += amount
+        self.unsaved[name] += amount
+
+    def flush(self, commit=True):
+        """ write buffered hit times, unreadable entry drops and totals; caller holds lock """
+        if not (self.touched or self.unreadable or self.unsaved):
+            return
+        conn = self.connect()
+        conn.executemany('UPDATE responses SET last_used = ? WHERE key = ?', [(used, key) for key, used in self.touched.items()])
+        conn.executemany('DELETE FROM responses WHERE key = ?', [(key,) for key in self.unreadable])
+        conn.executemany('INSERT INTO totals (name, count) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET count = count + excluded.count',
+                         list(self.unsaved.items()))
+        self.touched.clear()
+        self.unreadable.clear()
+        self.unsaved.clear()
+        self.lookups = 0
+        if commit:
+            conn.commit()
+
+    def save(self):
+        """ flush now (stats_report, exit) """
+        if self.conn is None:
+            return
+        with self.lock:
+            self.flush()
+
+    def lookup(self, prompt, llm_string):
+        if not self.enabled:
+            return None
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        with self.lock:
+            row = self.connect().execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+            generations = None
+            if row and now - row[1] > self.ttl:
+                self.count('expired') # row itself is deleted by the next update
+            elif row:
+                try:
+                    generations = [loads(gen) for gen in json.loads(row[0])]
+                except Exception as e:
+                    logging.warning(f'==> LLM cache entry unreadable, dropping: {e}')
+                    self.unreadable.add(key)
+            if generations is None:
+                self.count('misses')
+            else:
+                self.touched[key] = now
+                self.count('hits')
+            self.lookups += 1
+            if self.lookups >= flush_every:
+                self.flush()
+        return generations
+
+    def update(self, prompt, llm_string, return_val):
+        if not self.enabled:
+            return
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        value = json.dumps([dumps(gen) for gen in return_val])
+        with self.lock:
+            conn = self.connect()
+            conn.execute('INSERT OR REPLACE INTO responses (key, llm_string, value, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                         (key, llm_string, value, now, now))
+            self.count('writes')
+            conn.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+            self.flush(commit=False) # hit times first, so eviction below sees recent use
+            over = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self.max_entries
+            if over > 0:
+                conn.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)', (over,))
+                self.count('evicted', over)
+                self.flush(commit=False)
+            conn.commit()
+
+    def clear(self, **kwargs):
+        with self.lock:
+            conn = self.connect()
+            conn.execute('DELETE FROM responses')
+            conn.execute('DELETE FROM totals')
+            conn.commit()
+            self.touched.clear()
+            self.unreadable.clear()
+            self.unsaved.clear()
+
+    def stats_report(self):
+        """ one line for the logs: this run's hit rate, plus all-time totals and size """
+        looked = self.stats['hits'] + self.stats['misses']
+        rate = f'{100 * self.stats["hits"] / looked:.1f}%' if looked else 'n/a'
+        report = (f'LLM cache this run: {self.stats["hits"]} hits / {looked} lookups ({rate}), '
+                  f'{self.stats["expired"]} expired, {self.stats["writes"]} writes, {self.stats["evicted"]} evicted')
+        if not self.enabled:
+            return report + ' (disabled)'
+        with self.lock:
+            self.flush()
+            conn = self.connect()
+            totals = dict(conn.execute('SELECT name, count FROM totals').fetchall())
+            entries = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        looked = totals.get('hits', 0) + totals.get('misses', 0)
+        rate = f'{100 * totals.get("hits", 0) / looked:.1f}%' if looked else 'n/a'
+        report += (f'; all time: {totals.get("hits", 0)} hits / {looked} lookups ({rate}), {totals.get("evicted", 0)} evicted; '
+                   f'{entries} entries in {self.path}')
+        return report
+
+
+response_cache = DiskLLMCache(cache_path, enabled=cache_enabled)
+atexit.register(response_cache.save)
+
+
+if __name__ == "__main__":
+    if '--clear' in sys.argv:
+        response_cache.clear()
+        print(f'Cleared {cache_path}')
+    print(response_cache.stats_report())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+One process-wide LLM client for semantics.py, populate_blanks.py, process_notifications.py and email_automation.py.
+Chains keep the same shape - ( prompt | large_lang_model | parser ) - but large_lang_model now hands back the shared client
+instead of building a new ChatMistralAI (and new HTTP connections / TLS sessions) on every call.
+
+- ChatMistralAI built once (sync), and once per asyncio event loop (async; httpx async connections can't outlive their loop)
+- at most llm_concurrency calls in flight per process (sync and per loop)
+- token bucket (LangChain InMemoryRateLimiter) at llm_requests_per_second with bursts up to llm_burst, shared by all of the above;
+  only cache misses draw tokens, hits from llm_cache.py never reach the provider
+Tune with LLM_CONCURRENCY, LLM_REQUESTS_PER_SECOND and LLM_BURST in .env to match the Mistral plan's limits.
+
+Backend picked by LLM_BACKEND in .env, from backends below:
+mistral - default, api.mistral.ai
+ollama  - local Ollama server (model 'mistral')
+fake    - llm_fake.py, deterministic canned answers with configurable latency; no network
+"""
+
+import os
+import asyncio
+import threading
+import weakref
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_core.runnables import RunnableLambda
+from langchain_mistralai.chat_models import ChatMistralAI
+from llm_cache import response_cache
+
+llm_backend = os.getenv('LLM_BACKEND', 'mistral').lower()
+llm_model = 'open-mixtral-8x7b'
+llm_temp = 0.25
+llm_concurrency = int(os.getenv('LLM_CONCURRENCY', '4'))
+llm_requests_per_second = float(os.getenv('LLM_REQUESTS_PER_SECOND', '1'))
+llm_burst = int(os.getenv('LLM_BURST', '4'))
+
+rate_limiter = InMemoryRateLimiter(requests_per_second = llm_requests_per_second,
+                                   check_every_n_seconds = 0.1,
+                                   max_bucket_size = llm_burst)
+
+client = {'model': None}
+client_lock = threading.Lock()
+sync_slots = threading.BoundedSemaphore(llm_concurrency)
+loop_clients = weakref.WeakKeyDictionary() # event loop -> (model, semaphore)
+
+
+def build_mistral():
+    return ChatMistralAI(model_name = llm_model,
+                         mistral_api_key = os.getenv('MISTRAL_API_KEY'), # read on first use, after the scripts' load_dotenv
+                         temperature = llm_temp,
+                         cache = response_cache,
+                         rate_limiter = rate_limiter,
+                         max_concurrent_requests = llm_concurrency,
+                         verbose = True )
+
+
+def build_ollama():
+    from langchain_community.chat_models import ChatOllama
+    return ChatOllama(model = 'mistral',
+                      temperature = llm_temp,
+                      cache = response_cache,
+                      rate_limiter = rate_limiter,
+                      verbose = True )
+
+
+def build_fake():
+    from llm_fake import FakeChatModel
+    return FakeChatModel(cache = response_cache,
+                         rate_limiter = rate_limiter)
+
+
+# LangChain chat model factories by name; add an entry to plug in another backend
+backends = {'mistral': build_mistral, 'ollama': build_ollama, 'fake': build_fake}
+
+
+def build_chat_model():
+    if llm_backend not in backends:
+        raise ValueError(f'Unknown LLM_BACKEND "{llm_backend}", expected one of {", ".join(backends)}')
+    return backends[llm_backend]()
+
+
+def chat_model():
+    """ the process-wide sync client """
+    with client_lock:
+        if client['model'] is None:
+            client['model'] = build_chat_model()
+        return client['model']
+
+
+def loop_client():
+    """ (client, semaphore) for the running event loop """
+    loop = asyncio.get_running_loop()
+    with client_lock:
+        if loop not in loop_clients:
+            loop_clients[loop] = (build_chat_model(), asyncio.Semaphore(llm_concurrency))
+        return loop_clients[loop]
+
+
+def invoke_limited(prompt_value, config):
+    with sync_slots:
+        return chat_model().invoke(prompt_value, config)
+
+
+async def ainvoke_limited(prompt_value, config):
+    model, slots = loop_client()
+    async with slots:
+        return await model.ainvoke(prompt_value, config)
+
+
+shared_llm = RunnableLambda(invoke_limited, afunc = ainvoke_limited, name = 'large_lang_model')
+
+
+def large_lang_model(query):
+    """ used in chains as ( prompt | large_lang_model | parser ); the returned runnable is what gets the prompt """
+    return shared_llm
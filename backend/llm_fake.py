@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+Deterministic local stand-in for the Mistral chat model, for load testing and profiling with no network.
+Selected with LLM_BACKEND=fake in .env (see llm_client.py); answers every prompt the backend scripts send
+in the shape their parsers expect - stage judgments, summaries, entity JSON, timelines, shrinks, email subjects, email replies.
+Same prompt always gets the same answer and the same latency (both seeded from a hash of the prompt).
+
+Latency, per call:
+LLM_FAKE_LATENCY_DIST   - fixed, uniform, or lognormal (default fixed)
+LLM_FAKE_LATENCY_MS     - fixed value / uniform mean / lognormal median (default 0)
+LLM_FAKE_LATENCY_SPREAD - uniform: +/- fraction of mean; lognormal: sigma (default 0.5)
+"""
+
+import os
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+fake_latency_dist = os.getenv('LLM_FAKE_LATENCY_DIST', 'fixed').lower()
+fake_latency_ms = float(os.getenv('LLM_FAKE_LATENCY_MS', '0'))
+fake_latency_spread = float(os.getenv('LLM_FAKE_LATENCY_SPREAD', '0.5'))
+
+
+class FakeChatModel(BaseChatModel):
+    latency_dist: str = fake_latency_dist
+    latency_ms: float = fake_latency_ms
+    latency_spread: float = fake_latency_spread
+
+    @property
+    def _llm_type(self):
+        return 'enshittification-fake'
+
+    @property
+    def _identifying_params(self):
+        return {'latency_dist': self.latency_dist, 'latency_ms': self.latency_ms, 'latency_spread': self.latency_spread}
+
+    def latency(self, rng):
+        """ seconds to stall for this call """
+        if self.latency_ms <= 0:
+            return 0
+        if self.latency_dist == 'uniform':
+            return max(0, rng.uniform(1 - self.latency_spread, 1 + self.latency_spread) * self.latency_ms / 1000)
+        if self.latency_dist == 'lognormal':
+            return rng.lognormvariate(0, self.latency_spread) * self.latency_ms / 1000
+        return self.latency_ms / 1000
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt, rng = prompt_and_rng(messages)
+        time.sleep(self.latency(rng))
+        return chat_result(fake_response(prompt, rng))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt, rng = prompt_and_rng(messages)
+        await asyncio.sleep(self.latency(rng))
+        return chat_result(fake_response(prompt, rng))
+
+
+def prompt_and_rng(messages):
+    prompt = '\n'.join(str(message.content) for message in messages)
+    return prompt, random.Random(hashlib.sha256(prompt.encode()).hexdigest())
+
+
+def chat_result(content):
+    return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def quoted(prompt, pattern, default='the entity'):
+    """ first capture of pattern in prompt, ex: the entity name out of 'Entity is "{entity}"' """
+    match = re.search(pattern, prompt)
+    return match.group(1) if match else default
+
+
+def fake_response(prompt, rng):
+    """ canned / templated answer keyed off each template's distinctive wording """
+    if 'Judge the enshittification stage' in prompt:
+        stage = rng.choice(['None', 'Stage 1', 'Stage 2', 'Stage 2', 'Stage 3', 'Stage 3', 'Stage 4'])
+        return f'{stage} - fake judgment for offline runs.'
+    if 'brief one or two sentence summary' in prompt:
+        text = prompt.split('Text to summarize follows.', 1)[-1].strip()
+        return f'Fake summary: {text[:120]}'
+    if 'return summary, date_started, date_ended' in prompt:
+        entity = quoted(prompt, r'Entity is: "(.*?)"')
+        return json.dumps({'summary': f'{entity} is a fake entity summary for offline runs.',
+                           'date_started': f'{rng.randint(1995, 2020)} {rng.choice(["JAN", "APR", "JUL", "OCT"])} {rng.randint(1, 28):02d}',
+                           'date_ended': 'None',
+                           'corp_fam': 'None',
+                           'category': rng.choice(['social', 'cloud', 'B2B', 'B2C', 'C2C', 'tech platform', 'P2P']),
+                           'ent_url': 'UNK'}, indent=2)
+    if 'return ent_url in JSON format' in prompt:
+        return json.dumps({'ent_url': 'UNK'}, indent=2)
+    if 'Need to shrink down' in prompt:
+        return prompt[-rng.randint(200, 600):] # tail of the prompt stands in for the condensed list
+    if 'we need to write up its timeline' in prompt or 'merge existing old timeline' in prompt:
+        entity = quoted(prompt, r'Entity is "(.*?)"', quoted(prompt, r'timeline for "(.*?)"'))
+        years = sorted(rng.sample(range(2000, 2025), 4))
+        return '\n'.join(f'* {year}-JAN-01 - {entity} fake event, stage {stage}' for stage, year in enumerate(years, start=1))
+    if 'email subject line' in prompt:
+        return f'"Fake enshittification alert #{rng.randint(1, 999)}"'
+    if 'compose a reasonable reply' in prompt:
+        return '```json\n' + json.dumps({'replyable': False, 'disable_alerts': False, 'reply': 'NA',
+                                         'notes': 'Fake LLM backend; no reply composed.'}, indent=2) + '\n```'
+    return 'Fake response.'
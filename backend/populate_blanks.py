@@ -1,19 +1,13 @@
 #!/usr/bin/env python
 
 """
-Finds all entities with blank summaries and tries to create content for them.
-Queries Wikipedia and DDG.
-Queries LLM for "summary", "date_started", "date_ended", "corp_fam", "category", "ent_url".
-Limited to a max number of summaries, count_max_sm.
-
-Finds all entities with blank timeline and tries to create content for them.
-Limited to a max number of timelines, count_max_tl.
-
-Finds all entities with no data map and tries to create content for them.
-Limited to a max number of data maps, count_max_dm.
-
-Finds all entities with no URL and tries to create content for them.
-Limited to a max number of URLs, count_max_ur.
+Partial-index queries for entities with blank fields build a work plan of (entity, missing fields), then runs it on a thread pool (max_workers),
+with the main thread as single writer committing results in batches. Limited overall by run_budget (see step_cost).
+Per entity, in order:
+Blank summary - queries Wikipedia and DDG; queries LLM for "summary", "date_started", "date_ended", "corp_fam", "category", "ent_url".
+Blank timeline (needs summary) - creates timeline.
+No URL (if in steps_enabled) - creates ent_url.
+No data map, or anything above changed - creates data map.
 
 Code also run against entities with new news items linked to them.
 Create / update timeline(s) for entities.
@@ -47,39 +41,39 @@ logging.basicConfig(level=logging.INFO,
                     filemode = 'a',
                     format='%(asctime)s -%(levelname)s - %(message)s')
 from app import app, db
-from app.models import Entity, News
+from app.models import Entity, News, stage_hist_date, entity_blank_sql, entity_list, entity_full
+import sqlalchemy as sa
+from sqlalchemy.orm.exc import StaleDataError
 from dotenv import load_dotenv
-# pipenv install duckduckgo-search langchain-community
-   
-from langchain_community.tools import DuckDuckGoSearchRun
+# pipenv install duckduckgo-search langchain-community wikipedia
 ### langchain_community/utilities/duckduckgo_search.py:64: UserWarning: 'api' backend is deprecated, using backend='auto'
-
 # from langchain_community.tools import DuckDuckGoSearchResults
 # from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
-# pipenv install wikipedia
-from langchain_community.tools import WikipediaQueryRun
-from langchain_community.utilities import WikipediaAPIWrapper
+from search_cache import wikipedia_search, ddg_search, search_cache # WikipediaQueryRun / DuckDuckGoSearchRun, cached and rate limited
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.output_parsers.json import JsonOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_mistralai.chat_models import ChatMistralAI
+from llm_cache import response_cache
+from llm_client import large_lang_model
+from context_budget import count_tokens, allocate, fit_source, news_chunks, text_chunks
 import html5lib
 import json
 from json import JSONDecodeError
 import requests
 from httpx import HTTPStatusError
 # import graphviz # sudo apt install graphviz (for local display!?) # pipenv install graphviz (this is in Pipfile)
-from datetime import datetime
+from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import dateparser
 
-llm_api_key = os.getenv('MISTRAL_API_KEY')
-llm_temp = 0.25
 
 # this script should end up being run daily
-count_max_sm = 7 # max how many summaries to do
-count_max_tl = 2 # max how many timelines to do - keep low as many tokens used
-count_max_dm = 28 # max how many data maps to do - can be big as just DB and text process, no LLM calls
-count_max_ur = 0 # max how many URLs to do
+run_budget = 15 # LLM call units per run, all steps together (was 7 summaries + 2 timelines)
+step_cost = {'summary': 1, 'timeline': 4, 'ent_url': 1, 'data_map': 0} # rough LLM calls per step; data map is just DB and text process
+steps_enabled = ('summary', 'timeline', 'data_map') # also add 'ent_url' to look up missing / UNK URLs (was off, count_max_ur = 0)
+max_workers = int(os.getenv('POPULATE_WORKERS', '4')) # entities in flight; LLM calls are further limited in llm_client.py, searches in search_cache.py
+write_batch = 10 # entities per commit
+save_attempts = 3 # writes retried this many times if an entity changed underneath (Entity.row_version)
 
 
 CREATE_SUMMARY_CONTENT_TEMPLATE = """
@@ -282,20 +276,11 @@ def create_summary_content(name):
     corp_fam = None
     category = None
 
-    wikipedia_page_results = ''
-    wikipedia = WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper(top_k_results=1))
-    wikipedia_page_results = wikipedia.run(f'about {name} corp')
+    wikipedia_page_results = wikipedia_search(f'about {name} corp')
     logging.info(f'==> wikipedia_page_results results for {name}: {wikipedia_page_results}.')
 
-    ddg_results = ''
-    try:
-        search = DuckDuckGoSearchRun()
-        ddg_results = search.run(f'about {name} corp')
-        logging.info(f'==> ddg_results results for {name}: {ddg_results}.')
-    except Exception as e:
-        logging.error(f'==> ddg search returned {e}.')
-        # raise RatelimitException(f"{resp.url} {resp.status_code} Ratelimit")
-        # duckduckgo_search.exceptions.RatelimitException: https://duckduckgo.com/ 202 Ratelimit
+    ddg_results = ddg_search(f'about {name} corp') # RatelimitException backoff / stale fallback handled in search_cache.py
+    logging.info(f'==> ddg_results results for {name}: {ddg_results}.')
 
     content_prompt = ChatPromptTemplate.from_template(CREATE_SUMMARY_CONTENT_TEMPLATE)
     chain = ( content_prompt
@@ -355,13 +340,8 @@ def create_ent_url_content(entity):
     """ web search and LLM call to find entity URL """
     name = entity.name
     ent_url = None
-    ddg_results = ''
-    try:
-        search = DuckDuckGoSearchRun()
-        ddg_results = search.run(f'official website for "{name}"')
-        logging.info(f'==> ddg_results results for {name}: {ddg_results}.')
-    except Exception as e:
-        logging.error(f'==> ddg search errored: {e}')
+    ddg_results = ddg_search(f'official website for "{name}"')
+    logging.info(f'==> ddg_results results for {name}: {ddg_results}.')
     content_prompt = ChatPromptTemplate.from_template(CREATE_URL_CONTENT_TEMPLATE)
     chain = ( content_prompt
             | large_lang_model 
@@ -487,60 +467,53 @@ def make_new_timeline(entity):
     logging.info(f'==> +++++++++ create_timeline_content +++++++++++')
     name = entity.name
 
-    news_items = ""
-    for item in entity.stage_history: # each list item should be date and stage value, with hopefully a third, news item id
-        num_fields = len(item)
-        news_items += f"date: {item[0]}; " ### wanna sort by this, do in later pass, add temp var, sort, pass to LLM less confusing
-        news_items += f"stage value: {item[1]}; "
-        if num_fields == 2:
-            news_items += f"no news id; "
-        if num_fields == 3:
-            target_item_id = item[2]
-            news_items += f"news id #{target_item_id}; "
-            target = db.session.get(News, target_item_id)
-            # was: target = News.query.get(target_item_id) # 2025DEC26 which throws this line:
-            # LegacyAPIWarning: The Query.get() method is considered legacy as of the 1.x series of SQLAlchemy and becomes a legacy construct in 2.0. 
-            # The method is now available as Session.get() (deprecated since: 2.0) (Background on SQLAlchemy 2.0 at: https://sqlalche.me/e/b8d9)
-            news_items += f"text: {target.text}; "
-            news_items += f"summary: {target.summary}; "
-        ### news_items += "\n" # removed this line as LLM spit these back out and unescaped newline characters break json parsing in json.loads later
-    ### this might be too long for LLM, 18000 characters for Meta 2024-12-21 01:20:21,879
-    news_tokens = int( len(news_items) / 4 ) # A rough estimate for English text: 1 token ≈ 4 characters
-    logging.info(f'==> {news_tokens} token count news_items for {name}: {news_items}')
-
-    wikipedia = WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper(top_k_results=1))
-    wikipedia_page_results = wikipedia.run(f'timeline about {name} corp')
-    wikip_tokens = int( len(wikipedia_page_results) / 4 )
-    logging.info(f'==> {wikip_tokens} token count for wikipedia_page_results results for {name}: {wikipedia_page_results}.')
-
-    ddg_results = ""
-    try:
-        search = DuckDuckGoSearchRun()
-        ddg_results = search.run(f'timeline about {name} corp')
-        logging.info(f'==> ddg_results for {name}: {ddg_results}.')
-    except Exception as e:
-        logging.error(f'==> ddg search returned {e}.')
-        # raise RatelimitException(f"{resp.url} {resp.status_code} Ratelimit")
-        # duckduckgo_search.exceptions.RatelimitException: https://duckduckgo.com/ 202 Ratelimit
-    ddg_tokens = int( len(ddg_results) / 4 )
-    logging.info(f'==> {ddg_tokens} token count for DDG results for {name}.')
-
-    token_thresh = 2500 # set token thresh-hold over which to shrink content (1 token ≈ 4 characters)
-
-    if news_tokens > token_thresh:
-        news_items = shrink_news_items(news_items = news_items,
-                                       entity = entity)
-        logging.info(f'==> Shrunk! news_items: {news_items}')
-
-    if wikip_tokens > token_thresh:
-        wikipedia_page_results = shrink_wikip_results(wikipedia_page_results = wikipedia_page_results,
-                                                      entity = entity)
-        logging.info(f'==> Shrunk! wikipedia_page_results: {wikipedia_page_results}.')
-
-    if ddg_tokens > token_thresh:
-        ddg_results = shrink_ddg_results(ddg_results = ddg_results,
-                                         entity = entity)
-        logging.info(f'==> Shrunk! ddg_results: {ddg_results}.')
+    """ news history as scored entries, oldest first; linked News rows fetched in one query """
+    history = []
+    for item in entity.stage_history or []: # each list item should be date and stage value, with hopefully a third, news item id
+        if isinstance(item, dict): # as saved by the manual entity forms
+            item = [item.get('date'), item.get('stage')]
+        if item:
+            history.append(item)
+    news_ids = [item[2] for item in history if len(item) > 2 and item[2] is not None]
+    news_by_id = {news.id: news for news in db.session.scalars(sa.select(News).where(News.id.in_(news_ids)))} if news_ids else {}
+    entries = []
+    for item in history:
+        entry_text = f"date: {item[0]}; "
+        entry_text += f"stage value: {item[1]}; "
+        target = None
+        if len(item) == 2 or item[2] is None:
+            entry_text += "no news id; "
+        else: # [2] is news id, [3] (if there) is day number, or 'foundational' / 'mundane' on older items
+            entry_text += f"news id #{item[2]}; "
+            target = news_by_id.get(item[2])
+            if target:
+                entry_text += f"text: {target.text}; "
+                entry_text += f"summary: {target.summary}; "
+        ### no "\n" between items as LLM spit these back out and unescaped newline characters break json parsing in json.loads later
+        entries.append({'date': stage_hist_date(item[0]), 
+                        'stage': item[1], 
+                        'text': entry_text, 
+                        'has_news': target is not None, 
+                        'foundational': len(item) > 3 and item[3] == 'foundational'})
+    entries.sort(key=lambda entry: entry['date'] or date.min)
+    news_items = " ".join(entry['text'] for entry in entries)
+
+    wikipedia_page_results = wikipedia_search(f'timeline about {name} corp')
+    ddg_results = ddg_search(f'timeline about {name} corp')
+
+    """ fit news / wikipedia / DDG to the prompt's token budget; ranked local truncation, LLM shrink only as last resort """
+    needs = {'news': count_tokens(news_items), 'wikipedia': count_tokens(wikipedia_page_results), 'ddg': count_tokens(ddg_results)}
+    budgets = allocate(needs)
+    logging.info(f'==> token counts for {name}: {needs}; budgets: {budgets}')
+    news_items = fit_source('news_items', news_items, news_chunks(entries, date.today()), budgets['news'], name, 
+                            shrink = lambda text: shrink_news_items(news_items = text, entity = entity))
+    wikipedia_page_results = fit_source('wikipedia_page_results', wikipedia_page_results, text_chunks(wikipedia_page_results, name), budgets['wikipedia'], name, 
+                                        shrink = lambda text: shrink_wikip_results(wikipedia_page_results = text, entity = entity), sep = "\n\n")
+    ddg_results = fit_source('ddg_results', ddg_results, text_chunks(ddg_results, name), budgets['ddg'], name, 
+                             shrink = lambda text: shrink_ddg_results(ddg_results = text, entity = entity))
+    logging.info(f'==> news_items for {name}: {news_items}')
+    logging.info(f'==> wikipedia_page_results for {name}: {wikipedia_page_results}.')
+    logging.info(f'==> ddg_results for {name}: {ddg_results}.')
 
     content_prompt = ChatPromptTemplate.from_template(CREATE_TIMELINE_CONTENT_TEMPLATE)
     chain = ( content_prompt
@@ -697,146 +670,207 @@ def create_data_map_content(entity):
     return map_data
 
 
-def large_lang_model(query):
-    large_lang_model = ChatMistralAI(model_name = 'open-mixtral-8x7b', 
-                                     mistral_api_key = llm_api_key, 
-                                     temperature = llm_temp, 
-                                     verbose = True )
-    return large_lang_model
+def summary_values(entity, summary, date_started, date_ended, corp_fam, category, ent_url):
+    """ fields to set from create_summary_content results; doesn't overwrite existing corp_fam / category / URL """
+    values = {'summary': summary, 
+              'date_started': dt_parse(date_started), 
+              'date_ended': dt_parse(date_ended)}
+    if not entity.corp_fam:
+        values['corp_fam'] = corp_fam
+    if not entity.category:
+        values['category'] = category
+    if (not entity.ent_url) or (entity.ent_url == "UNK"):
+        values['ent_url'] = ent_url
+    return values
+
+
+def missing_steps(row):
+    """ steps that apply to an entity row (id, name, summary, timeline, data_map, ent_url), in step order """
+    steps = []
+    if not row.summary:
+        steps.append('summary')
+    if not row.timeline:
+        steps.append('timeline') # needs a summary - planned only if there is or will be one
+    if not row.data_map:
+        steps.append('data_map')
+    if (not row.ent_url) or (row.ent_url == "UNK"):
+        steps.append('ent_url')
+    return steps
+
+
+def blank_rows(fields=steps_enabled):
+    """
+    Entity rows (id, name, summary, timeline, data_map, ent_url) needing any of fields, in id order.
+    One query per field, each served by its partial index (entity_blank_sql), so complete entities are never read.
+    """
+    rows = {}
+    for field in fields:
+        query = (sa.select(Entity.id, Entity.name, Entity.summary, Entity.timeline, Entity.data_map, Entity.ent_url)
+                   .where(sa.text(entity_blank_sql[field])))
+        for row in db.session.execute(query):
+            rows[row.id] = row
+    return [rows[row_id] for row_id in sorted(rows)]
 
 
-def parse_for_blank_summary(count_max_sm):
+def plan_work(rows, budget=run_budget, enabled=steps_enabled):
     """
-    Pulls all entities from DB; skips disabled; if summary None (blank) then call create_content.
-    If create_content returns summary None then logs and continues, otherwise sets values for summary etc and commits.
+    One scan's worth of entity rows to a work plan: list of (entity id, name, steps), in scan order.
+    Budget is spent step type by step type (all summaries first, then timelines, ...) as the old one-pass-per-field runs did.
+    Returns (plan, count of steps skipped for lack of budget).
     """
-    count_summeried = 0
-    count_skipped = 0
-    logging.info(f'==> +++++++++ parse_for_blank_summary +++++++++++')
-    with app.app_context():
-        entities = Entity.query.all()
-        for entity in entities:
-            if count_summeried >= count_max_sm:
-                count_skipped += 1
+    wanted = {row.id: (row, missing_steps(row)) for row in rows}
+    planned = {row_id: [] for row_id in wanted}
+    skipped = 0
+    for step in enabled:
+        for row_id, (row, steps) in wanted.items():
+            if step not in steps:
                 continue
-            if entity.status != 'disabled':
-                if entity.summary:
-                    continue
-                # if entity is not disabled, and has a blank summary, then try to fill in blanks
-                summary, date_started, date_ended, corp_fam, category, ent_url = create_summary_content(name = entity.name)
-                if not summary:
-                    # if summary comes back None, then go to next entity
-                    logging.info(f'==> Tried, but unable to get content for {entity.name}. ')
-                    continue
-                entity.summary = summary
-                entity.date_started = dt_parse(date_started)
-                entity.date_ended = dt_parse(date_ended)
-                # don't overwrite existing content for these
-                if not entity.corp_fam:
-                    entity.corp_fam = corp_fam
-                if not entity.category:
-                    entity.category = category
-                if (not entity.ent_url) or (entity.ent_url == "UNK"):
-                    entity.ent_url = ent_url
-                db.session.commit()
-                logging.info(f'==> Populated blanks for {entity.name}:\n summary = {summary}\n date_started = {date_started}\n date_ended = {date_ended}\n corp_fam = {corp_fam}\n category = {category}')
-                count_summeried += 1
-    logging.info(f'==> Summary populated a total of {count_summeried} entities; skipped {count_skipped}')
-    return None
+            if step == 'timeline' and not (row.summary or 'summary' in planned[row_id]):
+                continue
+            if step_cost[step] > budget:
+                skipped += 1
+                continue
+            budget -= step_cost[step]
+            planned[row_id].append(step)
+    plan = [(row_id, wanted[row_id][0].name, steps) for row_id, steps in planned.items() if steps]
+    return plan, skipped
 
 
-def parse_for_blank_timeline(count_max_tl):
+def run_unit(entity_id, name, steps):
     """
-    Pulls all entities from DB; skips disabled; if timeline None (blank) then call create_content.
-    If create_content returns timeline None then logs and continues, otherwise sets value for timeline and commits.
+    External I/O (Wikipedia, DDG, LLM) for one entity's steps, on a worker thread.
+    Reads only - results are applied to a local copy so later steps see them (ex: timeline sees new summary),
+    then handed back as {field: value} for the writer; the worker's session is rolled back, never committed.
     """
-    count_timelined = 0
-    count_skipped = 0
-    logging.info(f'==> ++++++++++ parse_for_blank_timeline +++++++++++')
+    results = {}
     with app.app_context():
-        entities = Entity.query.all()
-        for entity in entities:
-            if count_timelined >= count_max_tl:
-                count_skipped += 1
-                continue
-            if entity.status != 'disabled':
-                if entity.timeline:
-                    continue
-                if entity.summary == None:
-                    continue
-                # if entity is not disabled, and has a blank timeline, but has a summary already, then try to fill in the timeline
-                timeline = create_timeline_content(entity)
-                if not timeline:
-                    # if timeline comes back None, then go to next entity
-                    logging.info(f'==> Tried, but unable to get timeline for {entity.name}. ')
-                    continue
-                entity.timeline = timeline
-                db.session.commit()
-                logging.info(f'==> Populated timeline for {entity.name}:\n timeline = {timeline}')
-                count_timelined += 1
-    logging.info(f'==> Timeline populated a total of {count_timelined} entities; skipped {count_skipped}')
-    return None
+        entity = db.session.get(Entity, entity_id)
+        if entity is None:
+            return entity_id, name, results
+        with db.session.no_autoflush:
+            try:
+                for step in steps:
+                    values = {}
+                    try:
+                        if step == 'summary':
+                            summary, date_started, date_ended, corp_fam, category, ent_url = create_summary_content(name = name)
+                            if summary:
+                                values = summary_values(entity, summary, date_started, date_ended, corp_fam, category, ent_url)
+                            else:
+                                logging.info(f'==> Tried, but unable to get content for {name}. ')
+                        elif step == 'timeline':
+                            if not entity.summary:
+                                continue # summary failed this run
+                            timeline = create_timeline_content(entity)
+                            if timeline:
+                                values = {'timeline': timeline}
+                            else:
+                                logging.info(f'==> Tried, but unable to get timeline for {name}. ')
+                        elif step == 'ent_url':
+                            if entity.ent_url and (entity.ent_url != "UNK"):
+                                continue # filled in by summary step
+                            ent_url = create_ent_url_content(entity)
+                            if ent_url:
+                                values = {'ent_url': ent_url}
+                            else:
+                                logging.info(f'==> Tried, but unable to get URL for {name}. ')
+                    except Exception as e:
+                        logging.error(f'==> {step} for {name} errored: {e}')
+                    for field, value in values.items():
+                        setattr(entity, field, value)
+                    results.update(values)
+                """ data map last, and again if anything it shows changed """
+                if 'data_map' in steps or results:
+                    data_map = create_data_map_content(entity)
+                    if data_map:
+                        results['data_map'] = data_map
+                    else:
+                        logging.info(f'==> Tried, but unable to get data_map for {name}. ')
+            finally:
+                db.session.rollback()
+    return entity_id, name, results
+
+
+def write_results(pending):
+    """ (entity id, {field: value}) list in one short transaction - nothing is held open while workers wait on LLM / searches """
+    if not pending:
+        return
+    for attempt in range(1, save_attempts + 1):
+        entities = {entity.id: entity for entity in db.session.scalars(entity_full().where(Entity.id.in_([entity_id for entity_id, results in pending])))}
+        for entity_id, results in pending:
+            if entity_id in entities:
+                entity = entities[entity_id]
+                for field, value in results.items():
+                    setattr(entity, field, value)
+                if 'data_map' in results: # worker's map came from its snapshot; rebuild from this row (stage etc. may have moved since)
+                    entity.data_map = create_data_map_content(entity) or results['data_map']
+        try:
+            db.session.commit()
+            return
+        except StaleDataError as e: # a judgment / web edit got in between the load and the commit; reload and reapply
+            db.session.rollback()
+            logging.warning(f'==> populate_blanks write conflicted (attempt {attempt}): {e}')
+            if attempt == save_attempts:
+                raise
 
 
-def parse_for_blank_data_map(count_max_dm):
+def save_entity(entity_id, values, with_data_map=False):
     """
-    Pulls all entities from DB; skips disabled; if data_map None (blank) then call create_content.
-    If create_content returns None then logs and continues, otherwise sets value for timeline and commits.
+    Write values ({field: value}) - results of slow LLM / search work - onto a freshly loaded entity in its own short
+    transaction, so whatever was loaded before the slow work (and may have changed since) isn't what gets committed.
+    with_data_map - also rebuild data_map from the fresh row. Returns the entity, or None if it was deleted meanwhile.
     """
-    count_mapped = 0
-    count_skipped = 0
-    logging.info(f'==> ++++++++++ parse_for_blank_data_map +++++++++++')
-    with app.app_context():
-        entities = Entity.query.all()
-        for entity in entities:
-            if count_mapped >= count_max_dm:
-                count_skipped += 1
-                continue
-            if entity.status != 'disabled':
-                if entity.data_map:
-                    continue
-                # if entity is not disabled, and has a blank data_map, then try to fill in the data_map
-                data_map = create_data_map_content(entity)
-                if not data_map:
-                    # if data_map comes back None, then go to next entity
-                    logging.info(f'==> Tried, but unable to get data_map for {entity.name}. ')
-                    continue
-                entity.data_map = data_map
-                db.session.commit()
-                logging.info(f'==> Populated data map for {entity.name}! (len = {len(data_map)})')
-                count_mapped += 1
-    logging.info(f'==> Data map populated a total of {count_mapped} entities; skipped {count_skipped}')
-    return None
+    for attempt in range(1, save_attempts + 1):
+        db.session.rollback() # end the read held open across the slow work
+        entity = db.session.get(Entity, entity_id)
+        if entity is None:
+            return None
+        for field, value in values.items():
+            setattr(entity, field, value)
+        if with_data_map:
+            entity.data_map = create_data_map_content(entity)
+        try:
+            db.session.commit()
+            return entity
+        except StaleDataError as e:
+            db.session.rollback()
+            logging.warning(f'==> saving {", ".join(values)} for entity #{entity_id} conflicted (attempt {attempt}): {e}')
+            if attempt == save_attempts:
+                raise
 
 
-def parse_for_blank_url(count_max_ur):
+def populate_blanks(budget=run_budget, workers=max_workers):
     """
-    Pulls all entities from DB; skips disabled; if ent_url None (blank) or "UNK" then call create_content.
-    If create_content returns None then logs and continues, otherwise sets value for ent_url and commits.
+    Indexed lookup of entities with blank summary / timeline / data map (/ URL), then each entity's steps run on a thread pool
+    while this thread - the only writer - collects finished results and writes them every write_batch entities.
     """
-    count_mapped = 0
-    count_skipped = 0
-    logging.info(f'==> ++++++++++ parse_for_blank_URL +++++++++++')
+    logging.info('==> ++++++++++ populate_blanks +++++++++++')
     with app.app_context():
-        entities = Entity.query.all()
-        for entity in entities:
-            if count_mapped >= count_max_ur:
-                count_skipped += 1
-                continue
-            if entity.status != 'disabled':
-                if entity.ent_url and (entity.ent_url != "UNK"):
+        plan, skipped = plan_work(blank_rows(), budget)
+        db.session.commit()
+        logging.info(f'==> Work plan: {len(plan)} entities, {sum(len(steps) for entity_id, name, steps in plan)} steps; {skipped} skipped over budget')
+        counts = {field: 0 for field in ('summary', 'timeline', 'data_map', 'ent_url')}
+        pending = []
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            futures = [pool.submit(run_unit, entity_id, name, steps) for entity_id, name, steps in plan]
+            for future in as_completed(futures):
+                try:
+                    entity_id, name, results = future.result()
+                except Exception as e:
+                    logging.error(f'==> populate_blanks work unit errored: {e}')
                     continue
-                # if entity is not disabled, and has a blank or "UNK" ent_url, then try to fill in the ent_url
-                ent_url = create_ent_url_content(entity)
-                if not ent_url:
-                    # if ent_url comes back None, then go to next entity
-                    logging.info(f'==> Tried, but unable to get URL for {entity.name}. ')
+                if not results:
                     continue
-                entity.ent_url = ent_url
-                db.session.commit()
-                logging.info(f'==> Populated URL for {entity.name}! {ent_url}')
-                count_mapped += 1
-    logging.info(f'==> URL populated for a total of {count_mapped} entities; skipped {count_skipped}')
+                for field in counts: # results also carries the summary step's date_started, corp_fam, ...
+                    if field in results:
+                        counts[field] += 1
+                logging.info(f'==> Populated {", ".join(results)} for {name}')
+                pending.append((entity_id, results))
+                if len(pending) >= write_batch:
+                    write_results(pending)
+                    pending = []
+        write_results(pending)
+    logging.info(f'==> Populated summaries {counts["summary"]}, timelines {counts["timeline"]}, data maps {counts["data_map"]}, URLs {counts["ent_url"]}')
     return None
 
 
@@ -847,9 +881,8 @@ def create_data_map_for_entity(entity_name_str):
         data_map = create_data_map_content(entity)
         if not data_map:
             logging.info(f'==> Tried, but unable to get data_map for {entity.name}. ')
-        entity.data_map = data_map
-        db.session.commit()
-        logging.info(f'==> Populated data map for {entity.name}:\n data_map = {data_map}')
+        save_entity(entity.id, {'data_map': data_map})
+        logging.info(f'==> Populated data map for {entity_name_str}:\n data_map = {data_map}')
 
 
 def create_timeline_for_entity(entity_name_str):
@@ -857,7 +890,7 @@ def create_timeline_for_entity(entity_name_str):
     Click in GUI utility submits name of entity selected to run a timeline creation on.
     Also useful in testing from CLI.
     Pulls entity object from Entities, passes to create_timeline_content.
-    Saves new timeline
+    Saves new timeline (save_entity - fresh row, as the LLM calls take a while)
     """
     with app.app_context():
         entity = Entity.query.filter_by(name=entity_name_str).first()
@@ -867,34 +900,23 @@ def create_timeline_for_entity(entity_name_str):
                 logging.info(f'==> Tried, but unable to get content for {entity.name}. ')
                 logging.info(f'==> Summary needed for timeline, exited before timeline creation. ')
                 return None
-            entity.summary = summary
-            entity.date_started = dt_parse(date_started)
-            # if something came back, use it
-            if date_ended:
-                entity.date_ended = dt_parse(date_ended)
-            if corp_fam:
-                entity.corp_fam = corp_fam
-            if category:
-                entity.category = category
-            if ent_url:
-                entity.ent_url = ent_url
-            db.session.commit()
+            entity = save_entity(entity.id, summary_values(entity, summary, date_started, date_ended, corp_fam, category, ent_url))
+            if entity is None:
+                return None
             logging.info(f'==> Populated blanks for {entity.name}:\n summary = {summary}\n date_started = {date_started}\n date_ended = {date_ended}\n corp_fam = {corp_fam}\n category = {category}')
         timeline = create_timeline_content(entity)
         if not timeline:
-            logging.info(f'==> Tried, but unable to get timeline for {entity.name}. ')
+            logging.info(f'==> Tried, but unable to get timeline for {entity_name_str}. ')
         else:
-            entity.timeline = timeline
-            db.session.commit()
-            logging.info(f'==> Populated timeline for {entity.name}: {timeline}')
+            save_entity(entity.id, {'timeline': timeline})
+            logging.info(f'==> Populated timeline for {entity_name_str}: {timeline}')
     return None
 
 
 def main():
-    parse_for_blank_summary(count_max_sm)
-    parse_for_blank_timeline(count_max_tl)
-    parse_for_blank_data_map(count_max_dm)
-    parse_for_blank_url(count_max_ur)
+    populate_blanks()
+    logging.info(response_cache.stats_report())
+    logging.info(search_cache.stats_report())
     logging.info(f'==> ++++++++++ filling blanks done +++++++++++\n')
 
 if __name__ == "__main__":
@@ -22,20 +22,27 @@ logging.basicConfig(level=logging.INFO,
                     filemode = 'a',
                     format='%(asctime)s -%(levelname)s - %(message)s')
 from app import app, db
-from app.models import Entity, News, Art, References, User
+from app.models import Entity, News, Art, References, User, EntityNews, UserFollow
+from app.metrics import instrument
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from flask_mail import Mail, Message
 from sqlalchemy import or_, asc, desc, func
 import sqlalchemy as sa
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_mistralai.chat_models import ChatMistralAI
+from llm_cache import response_cache
+from llm_client import large_lang_model
 from langchain_core.output_parsers import StrOutputParser
-import dateparser
 import re
+from bisect import bisect_right
+import asyncio
+import smtplib
+import time
 
-llm_api_key = os.getenv('MISTRAL_API_KEY')
-llm_temp = 0.25
+subject_concurrency = 4 # snappy subject LLM calls in flight at once
+send_attempts = 3       # per message rejected by the server; also SMTP connection failures in a row before giving up on the run
+send_backoff = 5        # seconds; doubles each retry
+commit_every = 25       # last_sent commits batched every this many sent reports
 
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY') # secure Flask session management
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
@@ -48,16 +55,60 @@ app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 mail = Mail(app)
 
 
-def create_report(user):
+def load_report_data(users):
+    """
+    Everything the alert run's reports draw on, loaded once for all due users from the earliest last_sent on.
+    Each user's report is then cut from these shared, date-sorted indexes (bisect at the user's own last_sent),
+    so the run costs users + items, not users x items.
+    """
+    since = min(user.last_sent for user in users)
+    data = {}
+    """ art and reference items, date_pub ascending; keys are date_pub strs, compared as SQLite would against last_sent """
+    for name, model in (('art', Art), ('references', References)):
+        rows = db.session.execute(sa.select(model.date_pub, model.text, model.url)
+                                  .where(model.date_pub > since).order_by(asc(model.date_pub))).all()
+        data[name] = ([row.date_pub for row in rows], rows)
+    """ entities, and category -> entity ids (category is a comma separated str) """
+    entities = db.session.execute(sa.select(Entity.id, Entity.name, Entity.category, Entity.stage_current)
+                                  .where(Entity.status != 'disabled').order_by(Entity.id)).all()
+    data['entities'] = {ent.id: ent for ent in entities}
+    data['ents_by_cat'] = {}
+    for ent in entities:
+        for cat in (ent.category or '').split(", "):
+            data['ents_by_cat'].setdefault(cat, set()).add(ent.id)
+    """ followed entity ids per user """
+    data['follows'] = {}
+    user_ids = [user.id for user in users]
+    for user_id, entity_id in db.session.execute(sa.select(UserFollow.user_id, UserFollow.entity_id).where(UserFollow.user_id.in_(user_ids))):
+        data['follows'].setdefault(user_id, set()).add(entity_id)
+    """ per entity, its stage points (and linked news item, if any) since the earliest last_sent, date ascending """
+    query = (sa.select(EntityNews.entity_id, EntityNews.date_pub, EntityNews.stage_value,
+                       News.id.label('news_id'), News.date_pub.label('news_date_pub'), News.text, News.url)
+             .outerjoin(News, EntityNews.news_id == News.id)
+             .where(EntityNews.date_pub > since.date())
+             .order_by(EntityNews.date_pub, EntityNews.id))
+    data['points'] = {}
+    for row in db.session.execute(query):
+        dates, rows = data['points'].setdefault(row.entity_id, ([], []))
+        dates.append(row.date_pub)
+        rows.append(row)
+    logging.info(f'==> ++++++++++ report data loaded since {since}: {len(data["art"][1])} art, {len(data["references"][1])} references, '
+                 f'{len(entities)} entities, {sum(len(rows) for dates, rows in data["points"].values())} stage points +++++++++++')
+    return data
+
+
+def create_report(user, data=None):
     logging.info(f'==> ++++++++++ creating report for {user.username} with last_sent value of {user.last_sent} +++++++++++')
+    if data is None:
+        data = load_report_data([user])
     report = ""
+    since_str = user.last_sent.strftime('%Y-%m-%d %H:%M:%S.%f') # how SQLite stores DateTime; date_pub strs compare against this
+    since_date = user.last_sent.date() # EntityNews.date_pub is a date; day after last_sent's day is later than last_sent
     """ report on art items since last_sent """
     if user.alert_on_art_item:
         report_art = ""
-        query = Art.query
-        query = query.filter(Art.date_pub > user.last_sent).order_by(asc(Art.date_pub))
-        art_objs = query.all()
-        for art in art_objs:
+        dates, art_objs = data['art']
+        for art in art_objs[bisect_right(dates, since_str):]:
             report_art += f'*  On {art.date_pub} indexed "{art.text}" at {art.url}\n\n'
         if report_art:
             report += "alert_on_art_items:\n\n"
@@ -66,10 +117,8 @@ def create_report(user):
     """ report on reference items since last_sent """
     if user.alert_on_reference_item:
         report_ref = ""
-        query = References.query
-        query = query.filter(References.date_pub > user.last_sent).order_by(asc(References.date_pub))
-        ref_objs = query.all()
-        for ref in ref_objs:
+        dates, ref_objs = data['references']
+        for ref in ref_objs[bisect_right(dates, since_str):]:
             report_ref += f'*  On {ref.date_pub} indexed "{ref.text}" at {ref.url}\n\n'
         if report_ref:
             report += "alert_on_reference_item:\n\n"
@@ -77,34 +126,29 @@ def create_report(user):
             logging.info(f'==> ++++++++++ {len(report_ref)} characters on references +++++++++++')
     """ report on entities and/or categories followed """
     if user.alert_on_news_item or user.alert_on_stage_change:
-        query = Entity.query
-        query = query.filter(Entity.status != 'disabled')
-        entities_objs = query.all()
-        for ent in entities_objs: # tried to define entities_objs at top of script in inti area but didn't work, maybe due to lack of with app.app_context()
-            ent_hit = False
+        """ followed entities: UserFollow rows plus any entity in a followed category """
+        ent_ids = set(data['follows'].get(user.id, set()))
+        for cat in user.categories_following or []:
+            ent_ids |= data['ents_by_cat'].get(cat, set())
+        followed = [data['entities'][ent_id] for ent_id in sorted(ent_ids) if ent_id in data['entities']]
+        for ent in followed:
             report_news = ""
             report_stage = ""
-            if ent.name in user.entities_following: ent_hit = True
-            words = ent.category.split(", ") # string so need to comma separate
-            for cat in words:
-                if cat in user.categories_following: ent_hit = True
-            if not ent_hit: continue
             logging.info(f'==> Checking {ent.name}') # might comment this logging line as too chatty, or summarize somehow
-            """ report news items listed in stage_history for this entity in time since last_sent """
+            dates, points = data['points'].get(ent.id, ([], []))
+            points = points[bisect_right(dates, since_date):]
+            """ report news items linked to this entity in time since last_sent """
             if user.alert_on_news_item:
-                for item in ent.stage_history:
-                    if dateparser.parse(str(item[0])) > user.last_sent: # news item date # last_sent is defined/stored as datetime already
-                        if item[2]: # news item id
-                            query = News.query.filter(News.id == item[2])
-                            news_item = query.first() # Returns a single User object or None, not a list
-                            report_news += f'*  {ent.name} {news_item.date_pub} (stage {ent.stage_current} event) "{news_item.text}"; at {news_item.url}\n\n'
-                            logging.info(f'==> bullet for news item ID #{news_item.id}')
+                for point in points:
+                    if point.news_id:
+                        report_news += f'*  {ent.name} {point.news_date_pub} (stage {ent.stage_current} event) "{point.text}"; at {point.url}\n\n'
+                        logging.info(f'==> bullet for news item ID #{point.news_id}')
             """ report stage value changes for this entity in time since last_sent """
             if user.alert_on_stage_change:
                 stage_values = str(ent.stage_current)
-                for item in ent.stage_history:
-                    if dateparser.parse(str(item[0])) > user.last_sent: # news item date
-                        stage_values += str(item[1]) # stage value
+                for point in points:
+                    if point.stage_value is not None:
+                        stage_values += str(point.stage_value)
                 unique_chars = ''.join(set(stage_values)) # set makes, for ex., {'3', '2', '1'}, then we join it into a str, for ex. '321'
                 unique_count = len(unique_chars)
                 if unique_count == 1:
@@ -135,14 +179,6 @@ def create_report(user):
     return report
 
 
-def large_lang_model(query):
-    large_lang_model = ChatMistralAI(model_name = 'open-mixtral-8x7b', 
-                                     mistral_api_key = llm_api_key, 
-                                     temperature = llm_temp, 
-                                     verbose = True )
-    return large_lang_model
-
-
 SNAPPY_SUBJECT_TEMPLATE = """
 Summarize this report down to a nice terse email subject line. 
 Should convey some of the report content, but not be too long to wrap or go off-screen when read. 
@@ -162,15 +198,41 @@ def generate_snappy_subject(report):
         snappy_subject = chain.invoke({"report": report})
         logging.info(f'snappy_subject: "{snappy_subject}"')
     except Exception as e:
-        snappy_subject = None
         logging.error(f'==> chain.invoke Mistral LLM failed: {e}')
+        return None
+    return clean_subject(snappy_subject)
+
+
+async def generate_snappy_subject_async(report, semaphore):
+    content_prompt = ChatPromptTemplate.from_template(SNAPPY_SUBJECT_TEMPLATE)
+    chain = ( content_prompt
+            | large_lang_model 
+            | StrOutputParser() 
+            )
+    async with semaphore:
+        try:
+            snappy_subject = await chain.ainvoke({"report": report})
+            logging.info(f'snappy_subject: "{snappy_subject}"')
+        except Exception as e:
+            logging.error(f'==> chain.ainvoke Mistral LLM failed: {e}')
+            return None
+    return clean_subject(snappy_subject)
+
+
+async def generate_snappy_subjects(reports):
+    """ subjects for all reports, at most subject_concurrency LLM calls at once; None where the LLM failed """
+    semaphore = asyncio.Semaphore(subject_concurrency)
+    return await asyncio.gather(*(generate_snappy_subject_async(report, semaphore) for report in reports))
+
+
+def clean_subject(snappy_subject):
     snappy_subject = snappy_subject.replace("\n", " ") # Email headers must not contain newlines as they can be exploited for email header injection
     match = re.search(r'"(.*?)"', snappy_subject) # Extract first quoted section; not sure why LLM returned quoted content, this is not requested in prompt
     snappy_subject = match.group(1) if match else snappy_subject # Sorry LLM, if you offer multiple options I'm just taking first one
     return snappy_subject
 
 
-def send_report_to_user(report, user, now):
+def build_report_message(report, user, now, snappy_subject):
     
     default_subject_text = f"""EnshittificationMetrics.com Alert"""
     
@@ -183,10 +245,8 @@ def send_report_to_user(report, user, now):
     footer_text = """To change or stop these alerts, please use the "Alert Subscriptions Notification Settings" area in EnshittificationMetrics.com, https://www.enshittificationmetrics.com/alerts."""
     ### Eventually will add a reply with UNSUBSCRIBE or STOP feature.
     
-    logging.info(f'==> ++++++++++ sending report to {user.username} +++++++++++')
     ### need to tweak the reply-to on this email!?
     email = user.email
-    snappy_subject = generate_snappy_subject(report=report)
     if not snappy_subject:
         snappy_subject = default_subject_text
     msg = Message(snappy_subject, sender = app.config['MAIL_USERNAME'], recipients = [email])
@@ -196,8 +256,67 @@ def send_report_to_user(report, user, now):
                f"{signature_text}\n" \
                f"{footer_text}\n"
     test_print(report=report, snappy_subject=snappy_subject, un=user.username, email=email)
+    return msg
+
+
+def send_report_to_user(report, user, now):
+    """ single report, own SMTP session; alert runs use deliver_reports """
+    logging.info(f'==> ++++++++++ sending report to {user.username} +++++++++++')
+    snappy_subject = generate_snappy_subject(report=report)
+    msg = build_report_message(report=report, user=user, now=now, snappy_subject=snappy_subject)
     mail.send(msg)
-    logging.info(f'==> ++++++++++ {snappy_subject} - report sent +++++++++++')
+    logging.info(f'==> ++++++++++ {msg.subject} - report sent +++++++++++')
+
+
+def deliver_reports(batch):
+    """
+    Send (user, now, report) batch: subjects generated concurrently, then every message over one SMTP session.
+    A message the server rejects is retried up to send_attempts times, then dropped (logged) so it can't hold up the rest.
+    A lost / refused connection is reopened after a backoff; if it still fails send_attempts times in a row the server
+    is taken to be down and the run stops - the unsent users keep their last_sent, so the next run picks them up.
+    last_sent is set as each goes out and committed every commit_every sends (and at the end).
+    """
+    subjects = asyncio.run(generate_snappy_subjects([report for user, now, report in batch]))
+    pending = [[user, now, build_report_message(report=report, user=user, now=now, snappy_subject=subject), 0]
+               for (user, now, report), subject in zip(batch, subjects)]
+    sent = 0
+    dropped = 0
+    connect_failures = 0
+    while pending:
+        try:
+            with mail.connect() as conn:
+                while pending:
+                    user, now, msg, attempts = pending[0]
+                    try:
+                        conn.send(msg)
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                        pending[0][3] += 1
+                        if pending[0][3] >= send_attempts:
+                            logging.error(f'==> ++++++++++ giving up on report to {user.username} after {pending[0][3]} attempts: {e} +++++++++++')
+                            pending.pop(0)
+                            dropped += 1
+                        else:
+                            logging.warning(f'==> ++++++++++ report to {user.username} rejected (attempt {pending[0][3]}), retrying: {e} +++++++++++')
+                        continue
+                    pending.pop(0)
+                    connect_failures = 0
+                    logging.info(f'==> ++++++++++ {msg.subject} - report sent to {user.username} +++++++++++')
+                    user.last_sent = now
+                    sent += 1
+                    if sent % commit_every == 0:
+                        db.session.commit()
+        except (smtplib.SMTPException, OSError) as e:
+            connect_failures += 1
+            if connect_failures >= send_attempts:
+                logging.error(f'==> ++++++++++ SMTP connection failed {connect_failures} times in a row, stopping: {e}; '
+                              f'{len(pending)} reports skipped, left for next run +++++++++++')
+                break
+            delay = send_backoff * 2 ** (connect_failures - 1)
+            logging.warning(f'==> ++++++++++ SMTP connection error (attempt {connect_failures}), reconnecting in {delay}s: {e} +++++++++++')
+            time.sleep(delay)
+    db.session.commit()
+    logging.info(f'==> ++++++++++ {sent} of {len(batch)} reports sent, {dropped} dropped, {len(pending)} skipped +++++++++++')
+    return sent
 
 
 def test_print(report, snappy_subject, un, email):
@@ -227,7 +346,8 @@ def one_off_report_to_user(username_str):
         if testing:
             user.last_sent = now - timedelta(days=10)
             print(f'In test mode - dropped last_sent to {user.last_sent}')
-        report = create_report(user=user)
+        with instrument(f'create_report {user.username}'):
+            report = create_report(user=user)
         if report:
             send_report_to_user(report=report, user=user, now=now)
             user.last_sent = now
@@ -246,6 +366,7 @@ def create_send_alerts():
         query = User.query
         query = query.filter(User.role != 'disabled')
         all_users = query.all()
+        due = [] # (user, now) whose notification_frequency has come around
         for user in all_users:
             if (user.role == "disabled") or (user.role == "guest"):
                 continue
@@ -272,22 +393,32 @@ def create_send_alerts():
                     case "annually" : freq = 365.25
                 timechange_or_compute_delay = timedelta(hours=1.5)
                 if now - user.last_sent + timechange_or_compute_delay >= timedelta(days=freq):
-                    """ create report """
-                    report = create_report(user=user)
-                    if report:
-                        """ send report """
-                        send_report_to_user(report=report, user=user, now=now)
-                        user.last_sent = now
-                        db.session.commit()
-                    else:
-                        logging.info(f'==> ++++++++++ blank report generated, nothing to send +++++++++++')
+                    due.append((user, now))
                 else:
                     logging.info(f"Not yet time for {user.username}'s report - scheduled for {user.last_sent + timedelta(days=freq)} UTC or later")
+        if not due:
+            logging.info(f'==> ++++++++++ no reports due +++++++++++')
+        else:
+            """ load art / references / entities / stage points once for all due users, then cut each report from that """
+            data = load_report_data([user for user, now in due])
+            batch = []
+            for user, now in due:
+                """ create report """
+                with instrument(f'create_report {user.username}'):
+                    report = create_report(user=user, data=data)
+                if report:
+                    batch.append((user, now, report))
+                else:
+                    logging.info(f'==> ++++++++++ blank report generated, nothing to send +++++++++++')
+            if batch:
+                """ send reports """
+                deliver_reports(batch)
     logging.info(f'==> ++++++++++ alerts done +++++++++++\n')
 
 
 def main():
     create_send_alerts()
+    logging.info(response_cache.stats_report())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""
+Cached, paced Wikipedia and DuckDuckGo lookups for populate_blanks.py (summaries, URLs, timelines).
+Same query strings ('about {name} corp', 'timeline about {name} corp', ...) come up run after run, so results are kept
+in a SQLite file keyed on source + query and reused while younger than fresh_for.
+
+Calls to each source go through an adaptive limiter:
+- at least min_interval between calls, per source, shared by all threads
+- DDG 202 Ratelimit (RatelimitException) doubles the interval (up to max_interval) and starts a cooldown; successes ease it back down
+- during a cooldown, or when a call fails, a stale cached result (up to stale_for old) is served instead of an empty string;
+  with nothing cached, waits out the cooldown and retries, up to ratelimit_retries times, then gives up with ''
+Set SEARCH_FRESH_DAYS in .env to change the freshness window.
+
+python3 search_cache.py          # hit-rate / size report
+python3 search_cache.py --clear  # drop all entries
+"""
+
+import os
+import sys
+import logging
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+cache_path = os.getenv('SEARCH_CACHE_PATH', os.path.join(script_directory, 'search_cache.db'))
+fresh_for = timedelta(days=int(os.getenv('SEARCH_FRESH_DAYS', '7')))
+stale_for = timedelta(days=180) # older than this isn't served even when rate limited
+ratelimit_retries = 2
+
+
+class AdaptiveLimiter:
+    """ spacing between calls to one source; widens on rate limit responses, narrows back on success """
+
+    def __init__(self, name, min_interval, max_interval=300):
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_call = 0
+        self.cooldown_until = 0
+        self.lock = threading.Lock()
+
+    def cooling_down(self):
+        return time.time() < self.cooldown_until
+
+    def wait(self):
+        """ block until this caller's turn """
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_call, self.cooldown_until)
+            self.next_call = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def succeeded(self):
+        with self.lock:
+            self.interval = max(self.min_interval, self.interval * 0.8)
+
+    def rate_limited(self):
+        with self.lock:
+            self.interval = min(self.max_interval, self.interval * 2)
+            self.cooldown_until = time.time() + self.interval
+            logging.warning(f'==> {self.name} rate limited, backing off to one call per {self.interval:.0f}s')
+
+
+limiters = {'wikipedia': AdaptiveLimiter('wikipedia', min_interval=0.5),
+            'ddg': AdaptiveLimiter('ddg', min_interval=2)}
+
+
+def is_rate_limit(error):
+    """ duckduckgo_search RatelimitException ('https://duckduckgo.com/ 202 Ratelimit'), without importing duckduckgo_search here """
+    return type(error).__name__ == 'RatelimitException' or 'ratelimit' in str(error).lower()
+
+
+class SearchCache:
+    """ SQLite file of (source, query) -> text; one connection shared by threads (guarded) """
+
+    def __init__(self, path, fresh=fresh_for, stale=stale_for):
+        self.path = path
+        self.fresh = fresh.total_seconds()
+        self.stale = stale.total_seconds()
+        self.lock = threading.Lock()
+        self.conn = None
+        self.stats = {'fresh': 0, 'stale': 0, 'fetched': 0, 'rate_limited': 0, 'failed': 0}
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30) # file shared by concurrent cron scripts
+            self.conn.execute('PRAGMA journal_mode = WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS results (source TEXT, query TEXT, text TEXT, fetched REAL, PRIMARY KEY (source, query))')
+        return self.conn
+
+    def get(self, source, query):
+        """ (text, age in seconds) or (None, None) """
+        with self.lock:
+            row = self.connect().execute('SELECT text, fetched FROM results WHERE source = ? AND query = ?', (source, query)).fetchone()
+        if not row:
+            return None, None
+        return row[0], time.time() - row[1]
+
+    def put(self, source, query, text):
+        with self.lock:
+            conn = self.connect()
+            conn.execute('INSERT OR REPLACE INTO results (source, query, text, fetched) VALUES (?, ?, ?, ?)', (source, query, text, time.time()))
+            conn.commit()
+
+    def clear(self):
+        with self.lock:
+            conn = self.connect()
+            conn.execute('DELETE FROM results')
+            conn.commit()
+
+    def search(self, source, query, run):
+        """ cached text for query if fresh, else run(query) through source's limiter; stale copy if that is rate limited or fails """
+        text, age = self.get(source, query)
+        if text is not None and age < self.fresh:
+            self.stats['fresh'] += 1
+            return text
+        stale = text if text is not None and age < self.stale else None
+        limiter = limiters[source]
+        for attempt in range(ratelimit_retries + 1):
+            if stale is not None and limiter.cooling_down():
+                break
+            limiter.wait()
+            try:
+                result = run(query)
+            except Exception as e:
+                if is_rate_limit(e):
+                    self.stats['rate_limited'] += 1
+                    limiter.rate_limited()
+                    continue
+                self.stats['failed'] += 1
+                logging.error(f'==> {source} search for "{query}" errored: {e}')
+                break
+            limiter.succeeded()
+            self.stats['fetched'] += 1
+            self.put(source, query, result)
+            return result
+        if stale is not None:
+            self.stats['stale'] += 1
+            logging.info(f'==> {source} serving cached result for "{query}" ({age / 86400:.1f} days old)')
+            return stale
+        logging.error(f'==> {source} search for "{query}" got nothing (rate limited or failed, none cached)')
+        return ''
+
+    def stats_report(self):
+        looked = self.stats['fresh'] + self.stats['stale'] + self.stats['fetched']
+        rate = f'{100 * self.stats["fresh"] / looked:.1f}%' if looked else 'n/a'
+        report = (f'Search cache this run: {looked} lookups, {self.stats["fresh"]} fresh hits ({rate}), {self.stats["stale"]} stale served, '
+                  f'{self.stats["fetched"]} fetched, {self.stats["rate_limited"]} rate limited, {self.stats["failed"]} failed')
+        with self.lock:
+            entries = self.connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return report + f'; {entries} entries in {self.path}'
+
+
+search_cache = SearchCache(cache_path)
+tools = {}
+tools_lock = threading.Lock()
+
+
+def tool(source):
+    """ LangChain search tools, built once per process """
+    with tools_lock:
+        if source not in tools:
+            if source == 'wikipedia':
+                from langchain_community.tools import WikipediaQueryRun # pipenv install wikipedia
+                from langchain_community.utilities import WikipediaAPIWrapper
+                tools[source] = WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper(top_k_results=1))
+            else:
+                from langchain_community.tools import DuckDuckGoSearchRun # pipenv install duckduckgo-search langchain-community
+                tools[source] = DuckDuckGoSearchRun()
+        return tools[source]
+
+
+def wikipedia_search(query):
+    return search_cache.search('wikipedia', query, tool('wikipedia').run)
+
+
+def ddg_search(query):
+    return search_cache.search('ddg', query, tool('ddg').run)
+
+
+if __name__ == "__main__":
+    if '--clear' in sys.argv:
+        search_cache.clear()
+        print(f'Cleared {cache_path}')
+    print(search_cache.stats_report())
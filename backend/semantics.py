@@ -18,19 +18,27 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s -%(levelname)s - %(message)s')
 
 from app import app, db
-from app.models import Entity, News
+from app.models import Entity, News, entity_list
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.exc import StaleDataError
 from dotenv import load_dotenv
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableParallel, RunnablePassthrough
-from langchain_mistralai.chat_models import ChatMistralAI
-# from langchain_community.llms import Ollama
+from llm_client import large_lang_model
 import re
 import requests
 import socket
 import math
-from datetime import datetime
-from populate_blanks import create_timeline_content, create_data_map_content
+import time
+import asyncio
+from collections import deque
+from datetime import datetime, date as calendar_date
+import numpy as np
+from populate_blanks import create_data_map_content
+from timeline_worker import queue_timeline_refresh
 import dateparser
 
 hostn = socket.gethostname()
@@ -39,8 +47,8 @@ hostn = socket.gethostname()
 ntfypost = True
 alert_title = f'EM on {hostn} judgment'
 
-llm_api_key = os.getenv('MISTRAL_API_KEY')
-llm_temp = 0.25
+# write phase of record_judgment is retried this many times if an entity changed underneath it (or the DB stayed locked)
+apply_attempts = 3
 
 # Exponential decay factor
 # Controls how fast weights decay with time
@@ -79,42 +87,56 @@ Text to summarize follows.
 """
 
 
-def semantic_judgment(enshit_hit, text, entities):
-    logging.info(f'==> +++++++++ semantic_judgment +++++++++++')
+def judgment_chain():
     prompt_judgment = ChatPromptTemplate.from_template(JUDGMENT_TEMPLATE)
     chain = ( prompt_judgment
             | large_lang_model 
             | StrOutputParser() 
             )
-    stage = chain.invoke({"entities": entities, "enshit_hit": enshit_hit, "text": text})
-    # to invoke runable w/ >1 var pass as dict
-    return stage
+    return chain
 
 
-def write_summary(text):
-    logging.info(f'==> +++++++++ write_summary +++++++++++')
+def summary_chain():
     prompt_summary = ChatPromptTemplate.from_template(SUMMARY_TEMPLATE)
     chain = ( prompt_summary 
             | large_lang_model 
             | StrOutputParser() 
             )
-    summary = chain.invoke(text)
+    return chain
+
+
+def semantic_judgment(enshit_hit, text, entities):
+    logging.info(f'==> +++++++++ semantic_judgment +++++++++++')
+    stage = judgment_chain().invoke({"entities": entities, "enshit_hit": enshit_hit, "text": text})
+    # to invoke runable w/ >1 var pass as dict
+    return stage
+
+
+def write_summary(text):
+    logging.info(f'==> +++++++++ write_summary +++++++++++')
+    summary = summary_chain().invoke(text)
     return summary
 
 
-def large_lang_model(query):
-    large_lang_model = ChatMistralAI(model_name = 'open-mixtral-8x7b', 
-                                     mistral_api_key = llm_api_key, 
-                                     temperature = llm_temp, 
-                                     verbose = True )
-    # large_lang_model = Ollama(model = 'mistral', 
-    #                           temperature = llm_temp, 
-    #                           verbose = True )
-    return large_lang_model
+async def semantic_judgment_async(enshit_hit, text, entities):
+    logging.info(f'==> +++++++++ semantic_judgment_async +++++++++++')
+    stage = await judgment_chain().ainvoke({"entities": entities, "enshit_hit": enshit_hit, "text": text})
+    return stage
 
 
-def semantic_processing(title, url, date, content):
-    logging.info(f'==> +++++++++ semantic_processing +++++++++++')
+async def write_summary_async(text):
+    logging.info(f'==> +++++++++ write_summary_async +++++++++++')
+    summary = await summary_chain().ainvoke(text)
+    return summary
+
+
+def judged_stage(stage):
+    """ 'stage N' match in LLM judgment, or None if judged irrelevant """
+    return re.search(r'(stage 1|stage 2|stage 3|stage 4)', stage, re.IGNORECASE)
+
+
+def find_post_entities(title, content):
+    """ look for enshit* and entity names in post; returns judgment note, text, enshit_hit, and entities hit (empty if none) """
     judgment = ''
     """ look for enshit* in text """
     enshit_hit = False
@@ -124,73 +146,144 @@ def semantic_processing(title, url, date, content):
     if matches:
         enshit_hit = True
         judgment += f'Got hit for enshit* term! '
-    """ pull entity names from DB, look for them in text """
-    with app.app_context():
-        entities = Entity.query.all()
-        items = []
-        for result in entities:
-            if result.status != 'disabled':
-                items.append(result.name)
-        # items = [result.name for result in entities] # orig line before weeding out disableds
-    escaped_items = [re.escape(item) for item in items]
-    pattern = '|'.join(escaped_items)
-    logging.info(f'==> Entities searching for in post text: {pattern}') # Comment this logging if all works and it clutters up scrape.log too much
-    matches = re.findall(pattern, text, re.IGNORECASE)
+    """ look for (cached, prebuilt) entity names in text """
+    matches = match_entities(get_entity_matcher(), text)
     if not matches:
         """ if no relevant entity listed, do nothing """
         judgment += f'No relevant entity listed. '
-        return judgment
+        return judgment, text, enshit_hit, []
     entities = remove_duplicates(input_list = matches)
     judgment += f'Got hit(s) for {str(entities)}. '
+    return judgment, text, enshit_hit, entities
+
+
+def semantic_processing(title, url, date, content):
+    logging.info(f'==> +++++++++ semantic_processing +++++++++++')
+    judgment, text, enshit_hit, entities = find_post_entities(title, content)
+    if not entities:
+        return judgment
     """ send text to LLM for semantic judgment """
     stage = semantic_judgment(enshit_hit = enshit_hit,
                               text = text, 
                               entities = entities)
-    pattern = r'(stage 1|stage 2|stage 3|stage 4)'
-    matches = re.search(pattern, stage, re.IGNORECASE)
+    return record_judgment(judgment = judgment, 
+                           title = title, 
+                           url = url, 
+                           date = date, 
+                           text = text, 
+                           entities = entities, 
+                           stage = stage)
+
+
+async def semantic_processing_async(title, url, date, content, semaphore):
+    """
+    LLM half of semantic_processing for concurrent use; summary is started alongside the judgment and cancelled if the
+    judgment comes back irrelevant. Entity matcher (DB read) runs on a thread so the event loop isn't held up.
+    Returns judgment note and, if entities hit, LLM results for record_judgment.
+    """
+    logging.info(f'==> +++++++++ semantic_processing_async +++++++++++')
+    judgment, text, enshit_hit, entities = await asyncio.to_thread(find_post_entities, title, content)
+    if not entities:
+        return judgment, None
+    async with semaphore:
+        summary_task = asyncio.create_task(write_summary_async(text))
+        try:
+            stage = await semantic_judgment_async(enshit_hit = enshit_hit, 
+                                                  text = text, 
+                                                  entities = entities)
+        except BaseException:
+            summary_task.cancel()
+            raise
+        if judged_stage(stage):
+            summary = await summary_task
+        else:
+            summary_task.cancel()
+            summary = None
+    return judgment, {"text": text, "entities": entities, "stage": stage, "summary": summary}
+
+
+def record_judgment(judgment, title, url, date, text, entities, stage, summary=None):
+    """
+    DB half of semantic_processing; adds news item and updates each entity hit, in order.
+    If summary not already written (sync path) it is only written once stage is judged relevant.
+    Two phases: anything external (summary LLM call) first with no session open, then apply_judgment does every write
+    in one short transaction, retried on a version conflict; ntfy posts go out after the commit.
+    """
+    matches = judged_stage(stage)
     if not matches:
         judgment += f'Judged irrelevant to enshittification: {stage}. '
         return judgment
     ### want to do something more if enshit_hit is True yet judgment returns None - like create a news item and make an entity set as potential.
     judgment += f'judgment rendered: {stage}. '
     """ write up a summary """
-    summary = write_summary(text)
+    if summary is None:
+        summary = write_summary(text)
     stage_str_from_llm = matches[0] ### moved here
     stage_int_value = int(stage_str_from_llm[-1]) # convert from str 'stage 1' to int '1' ### moved here
-    """ add news item to DB """
+    for attempt in range(1, apply_attempts + 1):
+        try:
+            notes, alerts = apply_judgment(judgment, title, url, date, entities, summary, stage_int_value)
+            break
+        except (StaleDataError, OperationalError) as e:
+            logging.warning(f'==> recording judgment for "{title}" conflicted (attempt {attempt}): {e}')
+            if attempt == apply_attempts:
+                raise
+            time.sleep(attempt)
+    judgment += notes
+    if ntfypost:
+        for alert_data in alerts:
+            try: # already committed - a failed alert mustn't make the caller think the judgment wasn't recorded
+                requests.post('https://ntfy.sh/000ntfy000EM000', 
+                    headers={'Title' : alert_title}, data=(alert_data))
+            except requests.RequestException as e:
+                logging.error(f'==> ntfy alert failed: {e}')
+    return judgment
+
+
+def apply_judgment(judgment, title, url, date, entities, summary, stage_int_value):
+    """
+    Write phase of record_judgment - news item plus every entity update, one transaction, nothing slow inside it.
+    Entity.row_version makes the entity UPDATEs conditional, so an entity edited meanwhile (web app, other script)
+    raises StaleDataError and the whole lot is rolled back for record_judgment to retry against fresh rows.
+    Returns (text to add to judgment, ntfy alerts).
+    """
+    notes = ''
+    alerts = []
     with app.app_context():
-        new_record = News(date_pub = date, 
-                          url = url, 
-                          text = title, ### is this including 'post_text' ? ### where is the title combine w/ URL in parens? (need to add a space)
-                          summary = summary, 
-                          ent_names = entities, # entities includes count of # of items
-                          judgment = judgment, # added to models.py News
-                          stage_int_value = stage_int_value) # added to models.py News
-        db.session.add(new_record)
-        db.session.commit() # created new News object (in DB)
-        """ Add news item's id to each entity's stage_history """
-        news_item_id = new_record.id
-        ### old location, moved from here # stage_str_from_llm = matches[0]
-        ### old location, moved from here # stage_int_value = int(stage_str_from_llm[-1]) # convert from str 'stage 1' to int '1'
-        for entity in entities:
-            record = Entity.query.filter_by(name=entity).first()
-            if record:
+        try:
+            """ add news item to DB """
+            new_record = News(date_pub = date, 
+                              url = url, 
+                              text = title, ### is this including 'post_text' ? ### where is the title combine w/ URL in parens? (need to add a space)
+                              summary = summary, 
+                              ent_names = entities, # entities includes count of # of items
+                              judgment = judgment, # added to models.py News
+                              stage_int_value = stage_int_value) # added to models.py News
+            db.session.add(new_record)
+            db.session.flush() # for news item id
+            """ Add news item's id to each entity's stage_history """
+            news_item_id = new_record.id
+            records = {record.name: record for record in db.session.scalars(sa.select(Entity)
+                                                                              .options(so.undefer_group('history'), so.undefer_group('text'))
+                                                                              .where(Entity.name.in_(list(entities))))}
+            for entity in entities:
+                record = records.get(entity)
+                if not record:
+                    continue
                 # add stage to entity stage history
                 logging.info(f'Processing "{entity}" to add stage to entity stage_history and update stage_current.')
                 if record.stage_history is None:
-                    record.history = []
-                record.stage_history.append([date, stage_int_value, news_item_id]) 
-                """ set entity stage """
-                record.stage_current = weighted_avg_stage_hist(record.stage_history)
+                    record.stage_history = []
+                day = epoch_day(date)
+                record.stage_history.append([date, stage_int_value, news_item_id, day]) 
+                """ set entity stage (O(1) update of running weighted avg) """
+                record.stage_current = add_stage_point(record, day, stage_int_value)
                 # record.stage_current = stage_int_value # older code prior to weighted_avg_stage_hist
-                
+            
                 ### add code to from "Entity.stage_history" pop oldest stuff off list when gets too big (but don't pop foundationals)
-                
-                """update (or make for first time) entity timeline to reflect new stage_current and new linked news item"""
-                timeline = create_timeline_content(record)
-                if timeline:
-                    record.timeline = timeline
-                    logging.info(f'set timeline to: {timeline}') ### comment out if log is too busy - keep "Raw LLM content return (which should be json)" log in populate_blanks.py
+            
+                """update (or make for first time) entity timeline to reflect new stage_current and new linked news item - queued, see timeline_worker.py"""
+                queue_timeline_refresh(record.id)
                 """ if needed, transition entity from potential to live with stage population """
                 if record.status == 'potential':
                     record.status = 'live'
@@ -198,48 +291,30 @@ def semantic_processing(title, url, date, content):
                 """ generate new data_map for entity as stuff has changed """
                 record.data_map = create_data_map_content(record)
                 alert_data = f'Set {entity} to stage {record.stage_current} (weighted avg), due to new news of stage {stage_int_value}! '
-                judgment += alert_data
+                notes += alert_data
                 alert_data += f'(Per text from "{title}" referencing "{url}".) '
-                alert_data += f'New "{entity}" timeline: {timeline}'
+                alert_data += f'"{entity}" timeline refresh queued.'
                 logging.info(f'EM judgment: {alert_data}')
                 ### alert_title += f' {stage_int_value}' # doesn't work - UnboundLocalError: cannot access local variable 'alert_title' where it is not associated with a value
-                if ntfypost: requests.post('https://ntfy.sh/000ntfy000EM000', 
-                    headers={'Title' : alert_title}, data=(alert_data))
-        db.session.commit()
-    return judgment
+                alerts.append(alert_data)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return notes, alerts
 
 
 def weighted_avg_stage_hist(stage_values):
     # updated format and structure
-    #   each (mutable) list item in stage_values should be [0] date (datetime type in str type?), [1] stage value (int), [2] news item ID (int)
-    #   ex: [ ['2025-01-22 00:00:00', 2, 813], ['2025-01-28 00:00:00', 2, 853], ['2025-02-06 00:00:00', 3, 903], ] 
+    #   each (mutable) list item in stage_values should be [0] date (datetime type in str type?), [1] stage value (int), [2] news item ID (int), [3] day number (int, date.toordinal)
+    #   ex: [ ['2025-01-22 00:00:00', 2, 813, 739273], ['2025-01-28 00:00:00', 2, 853, 739279], ['2025-02-06 00:00:00', 3, 903, 739288], ] 
+    #   items written before day number was stored don't have [3] (and maybe not [2]), day is then parsed from [0]
     # original format and structure
     #   each (mutable) list item in stage_values should be date (str %Y-%b-%d) and stage value (int) pair
     #   ex: [['2024-AUG-17', 2], ['2024-AUG-18', 1], ['2024-SEP-06', 3], ['2024-SEP-06', 1], ['2024-SEP-09', 3], ['2024-SEP-11', 3]]
-    #   most_recent_date = max([datetime.strptime(entry[0], '%Y-%b-%d').date() for entry in stage_values])
-    #   time_diff = (most_recent_date - datetime.strptime(date, '%Y-%b-%d').date()).days
-    ### logging.info(f'!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
-    ### logging.info(f'check why dateparser throws TypeError: Input type must be str')
-    ### for entry in stage_values:
-    ###     logging.info(f'value: {entry[0]} - type{type(entry[0])}')
-    ### logging.info(f'!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
-    most_recent_date = max([dateparser.parse(str(entry[0])).date() for entry in stage_values]) # added str() as sometimes threw TypeError: Input type must be str
-    total_weighted_value = 0
-    total_weight = 0
-    for date, value, *rest in stage_values:
-        news_item_id = rest
-        # Calculate time difference in days
-        time_diff = (most_recent_date - dateparser.parse(str(date)).date()).days
-        # Calculate weight using exponential decay (more recent = higher weight)
-        weight = math.exp(-time_diff / decay_factor)
-        # Accumulate weighted value and weight
-        if type(value) == str:
-            value = int(value[-1]) # Catches some old entries where str "Stage 2" is instead of int "2"
-        total_weighted_value += value * weight
-        total_weight += weight
-    weighted_average = total_weighted_value / total_weight if total_weight != 0 else 0
-    # round float and keep btwn 1 and 4 (integer 1, 2, 3, or, 4)
-    stage_value = max(1, min(round(weighted_average), 4))
+    anchor_day, weight_sum, weighted_sum = stage_accumulators(stage_values)
+    weighted_average = weighted_sum / weight_sum if weight_sum != 0 else 0
+    stage_value = stage_from_avg(weighted_average)
     logging.info(f'1. Will remove these four logging lines once monitored and tuned; decay_factor: {decay_factor}')
     logging.info(f'2. stage_values: {stage_values}')
     logging.info(f'3. weighted_average: {weighted_average}')
@@ -247,9 +322,238 @@ def weighted_avg_stage_hist(stage_values):
     return stage_value
 
 
+def stage_accumulators(stage_values):
+    """
+    Exponential-decay sums over stage_values, relative to anchor day (most recent day).
+    weight of each item is exp(-(anchor - day) / decay_factor); returns anchor day, sum of weights, sum of weight * stage value.
+    """
+    if not stage_values:
+        return None, 0.0, 0.0
+    days = [history_day(item) for item in stage_values]
+    anchor_day = max(days)
+    weight_sum = 0.0
+    weighted_sum = 0.0
+    for day, item in zip(days, stage_values):
+        # Calculate weight using exponential decay (more recent = higher weight)
+        weight = math.exp((day - anchor_day) / decay_factor)
+        weight_sum += weight
+        weighted_sum += history_stage_value(item[1]) * weight
+    return anchor_day, weight_sum, weighted_sum
+
+
+def add_stage_point(record, day, value):
+    """
+    O(1) update of entity's running decay accumulators for one new stage_history point (already appended); returns new stage_current.
+    Weighted avg matches weighted_avg_stage_hist, the common factor exp(-most_recent_day / decay_factor) cancels out of the ratio; 
+    sums are kept relative to the most recent (anchor) day so exp() stays in range.
+    Accumulators are None on first use, or after stage_history is edited by hand; then do a full recompute.
+    """
+    if record.stage_anchor_day is None or not record.stage_weight_sum:
+        return recompute_stage_current(record)
+    anchor_day = record.stage_anchor_day
+    weight_sum = record.stage_weight_sum
+    weighted_sum = record.stage_weighted_sum
+    if day > anchor_day:
+        """ newer than anything so far - rescale sums to new anchor day """
+        scale = math.exp((anchor_day - day) / decay_factor)
+        weight_sum *= scale
+        weighted_sum *= scale
+        anchor_day = day
+    weight = math.exp((day - anchor_day) / decay_factor)
+    weight_sum += weight
+    weighted_sum += history_stage_value(value) * weight
+    record.stage_anchor_day = anchor_day
+    record.stage_weight_sum = weight_sum
+    record.stage_weighted_sum = weighted_sum
+    stage_value = stage_from_avg(weighted_sum / weight_sum)
+    logging.info(f'stage_current for {record.name} from running weighted avg {weighted_sum / weight_sum} is {stage_value}')
+    return stage_value
+
+
+def recompute_stage_current(record):
+    """ full pass over one entity's stage_history; resets running accumulators and returns stage_current """
+    anchor_day, weight_sum, weighted_sum = stage_accumulators(record.stage_history)
+    record.stage_anchor_day = anchor_day
+    record.stage_weight_sum = weight_sum
+    record.stage_weighted_sum = weighted_sum
+    weighted_average = weighted_sum / weight_sum if weight_sum != 0 else 0
+    return stage_from_avg(weighted_average)
+
+
+def backfill_stage_current():
+    """
+    Batch recompute stage_current and running accumulators for all entities, vectorized w/ NumPy; for backfills or after bulk history fixes.
+    Also stores day number as [3] in each stage_history item (padding [2] news id with None if missing) so dates are never parsed again.
+    """
+    logging.info(f'==> +++++++++ backfill_stage_current +++++++++++')
+    with app.app_context():
+        entities = db.session.scalars(entity_list('id', 'name', 'stage_history', 'stage_current')).all()
+        ent_index = []
+        days = []
+        values = []
+        for count, entity in enumerate(entities):
+            if not entity.stage_history:
+                continue
+            history = []
+            for item in entity.stage_history:
+                day = history_day(item)
+                news_item_id = item[2] if len(item) > 2 else None
+                history.append([item[0], history_stage_value(item[1]), news_item_id, day])
+                ent_index.append(count)
+                days.append(day)
+                values.append(history[-1][1])
+            entity.stage_history = history # reassign whole list so MutableList change is picked up
+        if not days:
+            logging.info(f'==> No stage_history to backfill')
+            return None
+        ent_index = np.array(ent_index)
+        days = np.array(days, dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        anchor_days = np.full(len(entities), np.iinfo(np.int64).min, dtype=np.int64)
+        np.maximum.at(anchor_days, ent_index, days)
+        weights = np.exp((days - anchor_days[ent_index]) / decay_factor)
+        weight_sums = np.bincount(ent_index, weights=weights, minlength=len(entities))
+        weighted_sums = np.bincount(ent_index, weights=weights * values, minlength=len(entities))
+        count_changed = 0
+        for count in np.unique(ent_index):
+            entity = entities[count]
+            entity.stage_anchor_day = int(anchor_days[count])
+            entity.stage_weight_sum = float(weight_sums[count])
+            entity.stage_weighted_sum = float(weighted_sums[count])
+            stage_value = stage_from_avg(weighted_sums[count] / weight_sums[count])
+            if stage_value != entity.stage_current:
+                logging.info(f'==> {entity.name} stage_current {entity.stage_current} -> {stage_value}')
+                entity.stage_current = stage_value
+                count_changed += 1
+        db.session.commit()
+    logging.info(f'==> Backfilled {len(np.unique(ent_index))} entities ({len(days)} history items); {count_changed} stage_current values changed')
+    return None
+
+
+def stage_from_avg(weighted_average):
+    # round float and keep btwn 1 and 4 (integer 1, 2, 3, or, 4)
+    return max(1, min(round(float(weighted_average)), 4))
+
+
+def history_stage_value(value):
+    if type(value) == str:
+        value = int(value[-1]) # Catches some old entries where str "Stage 2" is instead of int "2"
+    return value
+
+
+def history_day(item):
+    """ stage_history item's day number; stored as [3] for newer items, otherwise parsed from [0] """
+    if len(item) > 3 and isinstance(item[3], int):
+        return item[3]
+    return epoch_day(item[0])
+
+
+def epoch_day(date_in):
+    """
+    Day number (date.toordinal) of a stage_history date.
+    Cheap for date / datetime / ISO strings; dateparser (slow) only as fallback for older formats like "2024-AUG-17".
+    """
+    if isinstance(date_in, datetime):
+        return date_in.date().toordinal()
+    if isinstance(date_in, calendar_date):
+        return date_in.toordinal()
+    try:
+        return calendar_date.fromisoformat(str(date_in)[:10]).toordinal()
+    except ValueError:
+        pass
+    parsed = dateparser.parse(str(date_in)) # added str() as sometimes threw TypeError: Input type must be str
+    if parsed is None:
+        logging.warning(f'Unable to parse stage_history date "{date_in}", using today')
+        return calendar_date.today().toordinal()
+    return parsed.date().toordinal()
+
+
 def remove_duplicates(input_list):
-    unique_list = []
-    for item in input_list:
-        if item not in unique_list:
-            unique_list.append(item)
-    return unique_list
+    # dict keys keep insertion order, so this is an in-order dedupe in one pass
+    return list(dict.fromkeys(input_list))
+
+
+# entity name matcher, built once per run and rebuilt only when the (non-disabled) Entity names change
+entity_matcher = {'signature': None, 'automaton': None}
+
+
+def get_entity_matcher():
+    """
+    Returns Aho-Corasick automaton of all non-disabled entity names.
+    Only id and name are pulled from DB to check for changes; automaton is rebuilt only if they differ from last build.
+    """
+    with app.app_context():
+        rows = db.session.execute(sa.select(Entity.id, Entity.name).where(Entity.status != 'disabled').order_by(Entity.id)).all()
+    signature = hash(tuple(rows))
+    if entity_matcher['automaton'] is None or entity_matcher['signature'] != signature:
+        entity_matcher['automaton'] = build_entity_matcher([name for id, name in rows])
+        entity_matcher['signature'] = signature
+        logging.info(f'==> Built entity matcher for {len(rows)} entities')
+    return entity_matcher['automaton']
+
+
+def build_entity_matcher(names):
+    """
+    Aho-Corasick automaton over lowercased names.
+    goto[node] is dict of char to next node, fail[node] is fallback node, out[node] is list of (name, length) ending at node.
+    """
+    goto = [{}]
+    fail = [0]
+    out = [[]]
+    for name in names:
+        key = name.lower()
+        if not key:
+            continue
+        node = 0
+        for ch in key:
+            next_node = goto[node].get(ch)
+            if next_node is None:
+                next_node = len(goto)
+                goto[node][ch] = next_node
+                goto.append({})
+                fail.append(0)
+                out.append([])
+            node = next_node
+        out[node].append((name, len(key)))
+    """ breadth first to set fail links, shallower nodes always done first """
+    queue = deque(goto[0].values())
+    while queue:
+        node = queue.popleft()
+        for ch, next_node in goto[node].items():
+            queue.append(next_node)
+            f = fail[node]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            fail[next_node] = goto[f].get(ch, 0)
+            out[next_node] = out[next_node] + out[fail[next_node]]
+    return goto, fail, out
+
+
+def match_entities(automaton, text):
+    """
+    Single pass of text thru automaton, case-insensitive.
+    Returns entity names (as stored in DB) in order of first appearance; only hits on word boundaries count,
+    so for example "X" doesn't hit on every x in the text and "Meta" doesn't hit on "metadata".
+    """
+    goto, fail, out = automaton
+    lowered = text.lower()
+    last = len(lowered) - 1
+    hits = []
+    node = 0
+    for end, ch in enumerate(lowered):
+        while node and ch not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(ch, 0)
+        for name, length in out[node]:
+            start = end - length + 1
+            if start > 0 and is_word_char(lowered[start - 1]) and is_word_char(lowered[start]):
+                continue
+            if end < last and is_word_char(lowered[end + 1]) and is_word_char(lowered[end]):
+                continue
+            hits.append((start, name))
+    hits.sort(key=lambda hit: hit[0])
+    return [name for start, name in hits]
+
+
+def is_word_char(ch):
+    return ch.isalnum() or ch == '_'
@@ -1,119 +1,205 @@
 #!/usr/bin/env python
 
 import os
+import sys
 import logging
 script_directory = os.path.dirname(os.path.abspath(__file__))
 if script_directory.startswith('/home/bsea/em'):
     mode = 'prod'
+    sys.path.append('/var/www/em')
     logpath = '/home/bsea/em/scrape.log'
 else:
     mode = 'dev'
+    sys.path.append('/home/leet/EnshittificationMetrics/www/')
     logpath = './scrape.log'
 logging.basicConfig(level=logging.INFO,
                     filename = logpath,
                     filemode = 'a',
                     format='%(asctime)s -%(levelname)s - %(message)s')
 
-from bs4 import BeautifulSoup # https://www.crummy.com/software/BeautifulSoup/bs4/doc/
-from datetime import datetime
-from semantics import semantic_processing
+from app import app, db
+from app.models import SlashdotPost
+from bs4 import BeautifulSoup, SoupStrainer # https://www.crummy.com/software/BeautifulSoup/bs4/doc/
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from sqlalchemy import or_, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from semantics import semantic_processing, semantic_processing_async, record_judgment
+from llm_cache import response_cache
 import html5lib # Parses HTML like a web browser, very lenient, handles malformed HTML, slower than native ‘html.parser’ or recommended 'lxml'
 import re
 import requests
 import dateparser
+import asyncio
 
 
 site_url = 'https://slashdot.org/'
-data_file = 'slashdot_data.txt'
-max_size = 60 # each "page" is 15 items
+data_file = 'slashdot_data.txt' # old flat-file tracking, only read once to seed SlashdotPost table
+max_size = 600 # each "page" is 15 items; retention is a single indexed delete so history can be large
+max_attempts = 3 # after this many tries a post is set to 'error'
+stale_claim = timedelta(hours=2) # 'processing' claims older than this are from a crashed run and can be re-claimed
+process_mode = 'async' # 'async' fans out LLM calls for new posts concurrently, 'sync' does one post at a time
+llm_concurrency = 4 # max posts in flight with LLM at once in async mode (each post makes two calls at once)
 
 
-def parse_slashdot_posts():
-    logging.info(f'==> +++++++++ parse_slashdot_posts +++++++++++')
+def fetch_slashdot_stories():
+    """
+    Single fetch and parse of front page per scrape cycle, shared by process_slashdot_site and parse_slashdot_posts.
+    Only story containers (<article>) are parsed, with the faster stdlib parser rather than html5lib.
+    Returns note and stories as {title_id: (title, source_url, fhtime, text)}, in page order; stories None if unable to access.
+    """
+    logging.info(f'==> +++++++++ fetch_slashdot_stories +++++++++++')
     note = ''
     req = requests.get(site_url)
     if req.status_code != 200:
-        note += f'Unable to access {site_url}.\n'
-        return note
-    note += f'Processed {site_url}.\n'
-    content = req.text
-    soup = BeautifulSoup(content, 'html5lib')
-    data_list = []
-    # load ID / status file from disk
-    if os.path.exists(data_file):
-        with open(data_file, 'r') as file:
-            for line in file:
-                title_id, status = line.strip().split(maxsplit=1)
-                data_list.append((title_id, status))
-    else:
-        note += f'{data_file} does not exist.\n'
-        return note
-    # For 'new' items in list, get post and send to semantic_processing func
+        note += f'Unable to access {site_url}. '
+        return note, None
+    note += f'Fetched {site_url}. '
+    soup = BeautifulSoup(req.text, 'html.parser', parse_only=SoupStrainer('article'))
+    tags_by_id = {tag['id']: tag for tag in soup.find_all(id=True)} # one pass, rather than a soup.find per lookup
+    stories = {}
+    for title_tag in soup.find_all(class_='story-title'):
+        if not title_tag.has_attr('id'):
+            continue
+        title_id = title_tag['id']
+        post_title = title_tag.get_text(strip=True)
+        a_tag = title_tag.find('a', class_="story-sourcelnk", href=True)
+        post_source_url = a_tag['href'] if a_tag else None ### this is not full URL to story, just TLD URL
+        sd_fhtime_text = None
+        post_text = None
+        match = re.search(r'(\d+)', title_id)
+        if match:
+            number = match.group(1)
+            if f'fhtime-{number}' in tags_by_id:
+                sd_fhtime_text = tags_by_id[f'fhtime-{number}'].get_text(strip=True)
+            if f'text-{number}' in tags_by_id:
+                post_text = tags_by_id[f'text-{number}'].get_text(strip=True)
+        stories[title_id] = (post_title, post_source_url, sd_fhtime_text, post_text)
+    note += f'Found {len(stories)} stories. '
+    return note, stories
+
+
+def parse_slashdot_posts(stories):
+    logging.info(f'==> +++++++++ parse_slashdot_posts +++++++++++')
+    note = ''
+    now = datetime.now()
+    # claim 'new' items (and stale 'processing' ones) in one atomic update, so overlapping runs don't double process
+    with app.app_context():
+        claim = sa.update(SlashdotPost) \
+                  .where(or_(SlashdotPost.status == 'new', 
+                             and_(SlashdotPost.status == 'processing', SlashdotPost.last_attempt < now - stale_claim))) \
+                  .values(status = 'processing', attempts = SlashdotPost.attempts + 1, last_attempt = now) \
+                  .returning(SlashdotPost.id, SlashdotPost.title_id, SlashdotPost.attempts) \
+                  .execution_options(synchronize_session = False)
+        claimed = sorted(db.session.execute(claim).all())
+        db.session.commit()
+    # For claimed items, get post
+    results = {} # title_id: status to set once done
+    posts = []
     count = 0
-    index = -1
-    for title_id, status in data_list:
-        index += 1
-        if status == 'new':
-            match = re.search(r'(\d+)', title_id) 
-            if match: 
-                number = match.group(1) 
-            else: 
-                note += f'No number in {title_id}.\n'
-                data_list[index] = (data_list[index][0], 'error')
-                ### instead hit the load more stories link at bottom and load that content 
-                ### and look again for title_id - in case it's scrolled off the first page
-                continue
-            # get post title
-            div_with_text = soup.find(id=title_id)
-            if div_with_text:
-                post_title = div_with_text.get_text(strip=True)
-                # get post url
-                a_tag = div_with_text.find('a', class_="story-sourcelnk", href=True)
-                if a_tag:
-                    post_source_url = a_tag['href'] ### this is not full URL to story, just TLD URL
-                else:
-                    note += f'No TLD URL for {title_id}. '
-                    post_source_url = 'None'
-                div_with_text = None # reset if used
-            else:
-                note += f'No post title for {title_id}.\n'
-                data_list[index] = (data_list[index][0], 'error')
-                continue
-            # get post timestamp
-            div_id = f'fhtime-{number}'
-            div_with_text = soup.find(id=div_id)
-            if div_with_text:
-                sd_fhtime_text = div_with_text.get_text(strip=True)
-                post_timestamp = yyyy_mmm_dd_format(sd_fhtime_text)
-                post_timestamp = dateparser.parse(post_timestamp).date() # change to datetime; from "2025-FEB-07" to "2025-02-07"
-                div_with_text = None # reset if used
-            else:
-                note += f'No timestamp for {title_id}.\n'
-                post_timestamp = 'None'
-            # get post text itself
-            div_id = f'text-{number}'
-            div_with_text = soup.find(id=div_id)
-            if div_with_text:
-                post_text = div_with_text.get_text(strip=True)
-            else:
-                note += f'No text content for {title_id}.\n'
-                data_list[index] = (data_list[index][0], 'error')
-                continue
-            judgment = semantic_processing(title = post_title, 
-                                           url = post_source_url, 
-                                           date = post_timestamp, 
-                                           content = post_text)
-            note += f'/. item #{number} ({post_title}) judgment - {judgment}.\n'
-            data_list[index] = (data_list[index][0], 'processed')
-            count += 1
+    for id, title_id, attempts in claimed:
+        if attempts > max_attempts:
+            note += f'Gave up on {title_id} after {attempts - 1} attempts.\n'
+            results[title_id] = 'error'
+            continue
+        match = re.search(r'(\d+)', title_id) 
+        if match: 
+            number = match.group(1) 
+        else: 
+            note += f'No number in {title_id}.\n'
+            results[title_id] = 'error'
+            ### instead hit the load more stories link at bottom and load that content 
+            ### and look again for title_id - in case it's scrolled off the first page
+            continue
+        if title_id not in stories:
+            note += f'No post title for {title_id}.\n'
+            results[title_id] = 'error'
+            continue
+        post_title, post_source_url, sd_fhtime_text, post_text = stories[title_id]
+        if not post_source_url:
+            note += f'No TLD URL for {title_id}. '
+            post_source_url = 'None'
+        # get post timestamp
+        if sd_fhtime_text:
+            post_timestamp = yyyy_mmm_dd_format(sd_fhtime_text)
+            post_timestamp = dateparser.parse(post_timestamp).date() # change to datetime; from "2025-FEB-07" to "2025-02-07"
+        else:
+            note += f'No timestamp for {title_id}.\n'
+            post_timestamp = 'None'
+        # get post text itself
+        if not post_text:
+            note += f'No text content for {title_id}.\n'
+            results[title_id] = 'error'
+            continue
+        posts.append((title_id, number, post_title, post_source_url, post_timestamp, post_text))
+    # For gathered posts, send to semantic_processing (one at a time or concurrently)
+    if process_mode == 'async':
+        judgments = asyncio.run(process_posts_async(posts))
+    else:
+        judgments = [semantic_processing(title = post_title, 
+                                         url = post_source_url, 
+                                         date = post_timestamp, 
+                                         content = post_text) 
+                     for title_id, number, post_title, post_source_url, post_timestamp, post_text in posts]
+    for (title_id, number, post_title, *rest), judgment in zip(posts, judgments):
+        if judgment is None:
+            note += f'/. item #{number} ({post_title}) processing failed, will retry.\n'
+            results[title_id] = 'new'
+            continue
+        note += f'/. item #{number} ({post_title}) judgment - {judgment}.\n'
+        results[title_id] = 'processed'
+        count += 1
     note += f'Processed {count} posting(s).\n'
-    # save ID / status file to disk
-    with open(data_file, 'w') as file: ### add utf8 switch?
-        for title_id, status in data_list:
-            file.write(f"{title_id} {status}\n")
+    # save statuses, one update per status value
+    with app.app_context():
+        for status in set(results.values()):
+            title_ids = [title_id for title_id, value in results.items() if value == status]
+            db.session.execute(sa.update(SlashdotPost)
+                                 .where(SlashdotPost.title_id.in_(title_ids))
+                                 .values(status = status)
+                                 .execution_options(synchronize_session = False))
+        db.session.commit()
     return note
 
 
+async def process_posts_async(posts):
+    """
+    LLM calls for all posts run concurrently (bounded by llm_concurrency).
+    DB updates are applied one post at a time, in post order, off the event loop; 
+    later posts' LLM calls keep going while earlier posts are written.
+    """
+    semaphore = asyncio.Semaphore(llm_concurrency)
+    tasks = [asyncio.create_task(semantic_processing_async(title = post_title, 
+                                                           url = post_source_url, 
+                                                           date = post_timestamp, 
+                                                           content = post_text, 
+                                                           semaphore = semaphore)) 
+             for title_id, number, post_title, post_source_url, post_timestamp, post_text in posts]
+    judgments = []
+    for (title_id, number, post_title, post_source_url, post_timestamp, post_text), task in zip(posts, tasks):
+        try:
+            judgment, llm_results = await task
+        except Exception as e:
+            logging.error(f'==> LLM processing of /. item #{number} failed: {e}')
+            judgments.append(None) # left as 'new' to retry next run
+            continue
+        if llm_results:
+            try:
+                judgment = await asyncio.to_thread(record_judgment, 
+                                                   judgment = judgment, 
+                                                   title = post_title, 
+                                                   url = post_source_url, 
+                                                   date = post_timestamp, 
+                                                   **llm_results)
+            except Exception as e:
+                # record_judgment rolls its transaction back, so nothing of this post was saved - safe to retry next run
+                logging.error(f'==> Recording judgment of /. item #{number} failed: {e}')
+                judgments.append(None)
+                continue
+        judgments.append(judgment)
+    return judgments
+
+
 def yyyy_mmm_dd_format(sd_fhtime_text):
     # Slashdot dates come in looking like "on Saturday June 29, 2024 @11:34PM"
     pattern = r'\b(\w+)\s+(\d{1,2}),\s+(\d{4})'
@@ -129,48 +215,54 @@ def yyyy_mmm_dd_format(sd_fhtime_text):
     return post_timestamp
 
 
-def process_slashdot_site():
+def process_slashdot_site(stories):
     logging.info(f'==> +++++++++ process_slashdot_site +++++++++++')
     note = ''
-    req = requests.get(site_url)
-    if req.status_code != 200:
-        note += f'Unable to access {site_url}. '
-        return note
-    note += f'Processed {site_url}. '
-    content = req.text
-    soup = BeautifulSoup(content, 'html5lib')
+    now = datetime.now()
     # get story IDs
-    story_titles = soup.find_all(class_='story-title')
-    ids = [tag['id'] for tag in story_titles if tag.has_attr('id')]
-    # check if any IDs are not tracked yet and add them to list as 'new'
-    data_list = []
-    if os.path.exists(data_file):
-        with open(data_file, 'r') as file:
-            for line in file:
-                title_id, status = line.strip().split(maxsplit=1)
-                data_list.append((title_id, status))
-    else:
-        note += f'{data_file} did not exist. '
-    title_ids = {title_id for title_id, status in data_list}
-    count = 0
-    for id in ids:
-        if id not in title_ids:
-            data_list.append((id, 'new'))
-            count += 1
-    note += f'Added {count} story-title IDs. '
-    # trim list down to keep at reasonable history size
-    count = 0
-    while len(data_list) > max_size:
-        data_list.pop(0)
-        count += 1
-    note += f'Removed {count} old story-title IDs. '
-    # save ID / status file to disk
-    with open(data_file, 'w') as file: ### add utf8 switch?
-        for title_id, status in data_list:
-            file.write(f"{title_id} {status}\n")
+    ids = list(stories)
+    with app.app_context():
+        note += import_data_file()
+        # add any IDs not tracked yet as 'new'; already tracked IDs are left as is
+        count = 0
+        if ids:
+            upsert = sqlite_insert(SlashdotPost) \
+                       .values([{"title_id": id, "status": 'new', "first_seen": now, "attempts": 0} for id in ids]) \
+                       .on_conflict_do_nothing(index_elements = ['title_id'])
+            count = db.session.execute(upsert).rowcount
+        note += f'Added {count} story-title IDs. '
+        # trim table down to keep at reasonable history size
+        keep = sa.select(SlashdotPost.id) \
+                 .order_by(SlashdotPost.first_seen.desc(), SlashdotPost.id.desc()) \
+                 .limit(max_size)
+        count = db.session.execute(sa.delete(SlashdotPost)
+                                     .where(SlashdotPost.id.not_in(keep))
+                                     .execution_options(synchronize_session = False)).rowcount
+        note += f'Removed {count} old story-title IDs. '
+        db.session.commit()
     return note
 
 
+def import_data_file():
+    """ One-off seed of SlashdotPost from old slashdot_data.txt (so already processed posts aren't redone); file renamed once imported """
+    if not os.path.exists(data_file):
+        return ''
+    if db.session.scalar(sa.select(SlashdotPost.id).limit(1)) is not None:
+        return f'{data_file} ignored as SlashdotPost already populated. '
+    now = datetime.now()
+    rows = []
+    with open(data_file, 'r') as file:
+        for line in file:
+            title_id, status = line.strip().split(maxsplit=1)
+            # file is oldest first; same first_seen for all so id (insert order) keeps that order for retention
+            rows.append({"title_id": title_id, "status": status, "first_seen": now, "attempts": 0})
+    if rows:
+        db.session.execute(sqlite_insert(SlashdotPost).values(rows).on_conflict_do_nothing(index_elements = ['title_id']))
+    db.session.commit()
+    os.rename(data_file, f'{data_file}.imported')
+    return f'Imported {len(rows)} IDs from {data_file}. '
+
+
 # func for documentation reference, not actually run
 def beautiful_soup_methods():
     soup = BeautifulSoup('<html><head><title>title</title></head><body><h1>heading</h1><p>text</p></body></html>', 'html5lib') 
@@ -199,10 +291,16 @@ def beautiful_soup_methods():
 
 
 def main():
-    note = process_slashdot_site()
+    note, stories = fetch_slashdot_stories()
+    logging.info(f'{note}')
+    if stories is None:
+        logging.info(f'==> ++++++++++ scrape done +++++++++++')
+        return
+    note = process_slashdot_site(stories)
     logging.info(f'{note}')
-    note = parse_slashdot_posts()
+    note = parse_slashdot_posts(stories)
     logging.info(f'{note}')
+    logging.info(response_cache.stats_report())
     logging.info(f'==> ++++++++++ scrape done +++++++++++')
 
 
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+Timeline rebuilds, off the scrape path.
+semantics.py used to call create_timeline_content inline for every entity hit by every news item - 2 to 5 LLM calls
+plus Wikipedia and DDG per entity, and again for the same entity if a second story hit it in the same run.
+Now record_judgment only calls queue_timeline_refresh, which upserts one TimelineRefresh row per entity:
+- debounce: each new hit pushes the row's due time out to now + debounce, so a burst of stories becomes one rebuild
+- deadline: ...but never past first hit + max_wait, so a steady trickle of news can't starve an entity
+This worker (cron, or --loop) rebuilds whatever is due, oldest due first, one entity at a time.
+If more hits land while a rebuild is running, the row is kept (hits changed) and rebuilt again later with the new news.
+Failed rebuilds retry with backoff, up to max_attempts, then are dropped (logged); next news hit queues it afresh.
+
+python3 timeline_worker.py          # one pass over what's due
+python3 timeline_worker.py --loop   # keep polling every poll_seconds
+"""
+
+crontab = """*/15 * * * *     cd /home/bsea/em/ && pipenv run python3 timeline_worker.py       >> /home/bsea/em/scrape.log 2>&1""" # prod
+
+import os
+import sys
+import logging
+script_directory = os.path.dirname(os.path.abspath(__file__))
+if script_directory.startswith('/home/bsea/em'):
+    mode = 'prod'
+    sys.path.append('/var/www/em')
+    logpath = '/home/bsea/em/scrape.log'
+else:
+    mode = 'dev'
+    sys.path.append('/home/leet/EnshittificationMetrics/www/')
+    logpath = './scrape.log'
+logging.basicConfig(level=logging.INFO,
+                    filename = logpath,
+                    filemode = 'a',
+                    format='%(asctime)s -%(levelname)s - %(message)s')
+
+from app import app, db
+from app.models import Entity, TimelineRefresh
+import sqlalchemy as sa
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from llm_cache import response_cache
+from populate_blanks import create_timeline_content, save_entity
+from search_cache import search_cache
+from datetime import datetime, timedelta
+import fcntl
+import time
+
+debounce = timedelta(minutes=20) # quiet time after an entity's last hit before rebuilding
+max_wait = timedelta(hours=3) # rebuild by first hit + this, however busy the news
+max_attempts = 3
+retry_backoff = timedelta(minutes=30) # doubled each failed attempt
+batch_size = 25 # rebuilds per pass (cron run), so a pass stays well under the cron interval
+poll_seconds = 60 # --loop
+lock_path = os.path.join(script_directory, 'timeline_worker.lock')
+
+
+def queue_timeline_refresh(entity_id, now=None):
+    """ Add / push back entity's pending rebuild (see debounce / max_wait above). Caller commits. """
+    now = now or datetime.now()
+    upsert = sqlite_insert(TimelineRefresh).values(entity_id = entity_id,
+                                                   hits = 1,
+                                                   first_requested = now,
+                                                   due = min(debounce, max_wait) + now,
+                                                   deadline = now + max_wait,
+                                                   attempts = 0)
+    debounced = sa.func.min(upsert.excluded.due, TimelineRefresh.deadline)
+    upsert = upsert.on_conflict_do_update(index_elements = ['entity_id'],
+                                          set_ = {'hits': TimelineRefresh.hits + 1,
+                                                  # after a failed rebuild, new hits don't cut its retry backoff short
+                                                  'due': sa.case((TimelineRefresh.attempts > 0, sa.func.max(TimelineRefresh.due, debounced)),
+                                                                 else_ = debounced)})
+    db.session.execute(upsert)
+
+
+def due_refreshes(now, limit=batch_size):
+    """ (entity_id, hits, attempts) of rebuilds due now, oldest due first """
+    query = (sa.select(TimelineRefresh.entity_id, TimelineRefresh.hits, TimelineRefresh.attempts)
+               .where(TimelineRefresh.due <= now)
+               .order_by(TimelineRefresh.due)
+               .limit(limit))
+    return db.session.execute(query).all()
+
+
+def refresh_timeline(entity_id, hits, attempts):
+    """ rebuild one entity's timeline (and data map, which references it); True if rebuilt or nothing to rebuild """
+    entity = db.session.get(Entity, entity_id)
+    if entity is None: # deleted since queued
+        db.session.execute(sa.delete(TimelineRefresh).where(TimelineRefresh.entity_id == entity_id))
+        db.session.commit()
+        return True
+    try:
+        timeline = create_timeline_content(entity)
+    except Exception as e:
+        db.session.rollback()
+        attempts += 1
+        logging.error(f'==> timeline rebuild for entity #{entity_id} failed (attempt {attempts}): {e}')
+        if attempts >= max_attempts:
+            logging.error(f'==> giving up on timeline rebuild for entity #{entity_id} after {attempts} attempts')
+            db.session.execute(sa.delete(TimelineRefresh).where(TimelineRefresh.entity_id == entity_id))
+        else:
+            db.session.execute(sa.update(TimelineRefresh)
+                                 .where(TimelineRefresh.entity_id == entity_id)
+                                 .values(attempts = attempts,
+                                         due = datetime.now() + retry_backoff * 2 ** (attempts - 1),
+                                         last_error = str(e)[:256]))
+        db.session.commit()
+        return False
+    name = entity.name
+    if timeline:
+        # entity was loaded before the LLM calls; a news judgment may have changed it (row_version) - write onto a fresh copy
+        save_entity(entity_id, {'timeline': timeline}, with_data_map=True)
+        logging.info(f'==> rebuilt timeline for {name} ({hits} news hits coalesced): {timeline}')
+    else:
+        db.session.rollback()
+        logging.info(f'==> Tried, but unable to get timeline for {name}. ')
+    """ done unless more hits came in meanwhile - then the row stays, already pushed back to its new due time """
+    db.session.execute(sa.delete(TimelineRefresh).where(TimelineRefresh.entity_id == entity_id, TimelineRefresh.hits == hits))
+    db.session.commit()
+    return True
+
+
+def run_pass():
+    """ one pass over everything due; returns (rebuilt, failed) counts """
+    rebuilt = failed = 0
+    with app.app_context():
+        jobs = due_refreshes(datetime.now())
+        db.session.commit() # don't hold the read open across the LLM calls
+        for entity_id, hits, attempts in jobs:
+            try:
+                done = refresh_timeline(entity_id, hits, attempts)
+            except Exception as e: # one bad entity mustn't stop the pass; its row stays queued for the next one
+                db.session.rollback()
+                logging.error(f'==> timeline rebuild for entity #{entity_id} errored, left queued: {e}')
+                done = False
+            if done:
+                rebuilt += 1
+            else:
+                failed += 1
+        pending = db.session.scalar(sa.select(sa.func.count()).select_from(TimelineRefresh))
+    logging.info(f'==> timeline worker pass: {rebuilt} rebuilt, {failed} failed, {pending} still queued')
+    return rebuilt, failed
+
+
+def main():
+    with open(lock_path, 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB) # one worker at a time (cron pass overlapping a --loop, or a slow pass)
+        except BlockingIOError:
+            logging.info(f'==> timeline worker already running, skipping')
+            return
+        run_pass()
+        while '--loop' in sys.argv:
+            time.sleep(poll_seconds)
+            run_pass()
+    logging.info(response_cache.stats_report())
+    logging.info(search_cache.stats_report())
+    logging.info(f'==> ++++++++++ timeline worker done +++++++++++\n')
+
+
+if __name__ == "__main__":
+    main()
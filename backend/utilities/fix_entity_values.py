@@ -18,10 +18,11 @@ else:
     sys.path.append('/home/leet/EnshittificationMetrics/www')
 
 from app import app, db
-from app.models import Entity, News
+from app.models import News, entity_full
+from sqlalchemy.orm.attributes import flag_modified
 
 with app.app_context():
-    entities = Entity.query.all()
+    entities = db.session.scalars(entity_full()).all()
     for ent in entities:
         
         # FIX
@@ -118,4 +119,8 @@ with app.app_context():
                     for target_news_item in target_news_items:
                         print(f'--> News ID #{target_news_item.id} w/ stage {target_news_item.stage_int_value} and ent names: {target_news_item.ent_names}')
         
+        # items above were edited in place - flag so they're saved (and EntityNews rows follow)
+        flag_modified(ent, 'stage_history')
+        db.session.commit()
+        
         print()
\ No newline at end of file
@@ -1,7 +1,16 @@
 #!/usr/bin/env python
-""" list entities to add, one per line, as string item_list_string; except as duplicate, should add blank entity to DB """
+"""
+Bulk add entities (blank, status potential) from files - streamed, deduped, inserted in batches.
+- .csv - header row, 'name' column required; other columns that are Entity fields (see importable) are kept
+- .jsonl / .ndjson - one object per line, same keys as the CSV columns
+- anything else - plain list, one name per line (# lines skipped), like the old pasted item_list_string
+Names already in the DB (or repeated in the files) are skipped by INSERT ... ON CONFLICT (name) DO NOTHING,
+so each batch is one statement and one short transaction, with no per-row IntegrityError round-trip.
+--enrich runs one populate_blanks pass afterwards (summary / URL / timeline / data map, within its run_budget);
+the cron populate_blanks picks up the rest of the new blanks either way.
 
-print(f'Starting script')
+python3 populate_list.py entities.csv more.jsonl names.txt [--enrich] [--dry-run]
+"""
 
 import os
 import sys
@@ -16,140 +25,126 @@ else: # path is likely /home/leet/EnshittificationMetrics/backend/
     mode = 'dev'
     sys.path.append('/home/leet/EnshittificationMetrics/www/')
     logpath = './populate_list.log'
+sys.path.append(os.path.dirname(script_directory)) # populate_blanks, for --enrich
 
 logging.basicConfig(level = logging.INFO,
                     filename = logpath,
                     filemode = 'a',
                     format = '%(asctime)s -%(levelname)s - %(message)s')
 
-import re
+import csv
+import json
+import time
+from itertools import islice
 from app import app, db
-from app.models import Entity
-from sqlalchemy.exc import IntegrityError
+from app.models import Entity, bump_cache_version
+import sqlalchemy as sa
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+batch_size = 500 # rows per INSERT / transaction
+importable = ('name', 'status', 'ent_url', 'seed', 'stage_current', 'stage_EM4view', 'date_started', 'date_ended', 'summary', 'corp_fam', 'category')
+new_entity = {'status'        : 'potential', # same blank entity the pasted-list version added; every key in every row, so a batch is one executemany
+              'ent_url'       : None,
+              'seed'          : None,
+              'stage_current' : 2,
+              'stage_history' : [],
+              'stage_EM4view' : 2,
+              'date_started'  : '',
+              'date_ended'    : '',
+              'summary'       : '',
+              'corp_fam'      : '',
+              'category'      : ''}
+
+
+def read_rows(path):
+    """ yield one dict per entity in file, without reading it all in """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as file:
+        if extension == '.csv':
+            yield from csv.DictReader(file)
+        elif extension in ('.jsonl', '.ndjson'):
+            for line_number, line in enumerate(file, 1):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError as e:
+                        logging.error(f'==> {path} line {line_number} not JSON, skipped: {e}')
+        else:
+            for line in file:
+                if line.strip() and not line.lstrip().startswith('#'):
+                    yield {'name': line}
+
+
+def entity_values(row):
+    """ Entity column values for a file row (defaults for anything not given), or None if no name """
+    if not isinstance(row, dict):
+        return None
+    name = str(row.get('name') or '').strip()
+    if not name:
+        return None
+    values = dict(new_entity, stage_history=[])
+    for field in importable:
+        value = row.get(field)
+        if value not in (None, ''):
+            values[field] = value.strip() if isinstance(value, str) else value
+    values['name'] = name
+    return values
+
+
+def entity_rows(paths):
+    """ values for every named row across the files, first occurrence of each name only """
+    seen = set()
+    for path in paths:
+        for row in read_rows(path):
+            values = entity_values(row)
+            if values is None or values['name'] in seen:
+                continue
+            seen.add(values['name'])
+            yield values
+
+
+def insert_batch(batch, dry_run=False):
+    """ insert batch in one transaction; returns names actually added (existing names left alone) """
+    if dry_run:
+        existing = set(db.session.scalars(sa.select(Entity.name).where(Entity.name.in_([values['name'] for values in batch]))))
+        return [values['name'] for values in batch if values['name'] not in existing]
+    insert = sqlite_insert(Entity).on_conflict_do_nothing(index_elements=['name']).returning(Entity.name)
+    added = list(db.session.scalars(insert, batch))
+    if added: # bulk insert skips the before_flush hook that normally bumps it; rankings etc. cache on this version
+        bump_cache_version(db.session.connection(), 'entity')
+    db.session.commit()
+    return added
+
+
+def import_entities(paths, dry_run=False):
+    """ returns (rows read, names added) """
+    read = 0
+    added = []
+    rows = entity_rows(paths)
+    with app.app_context():
+        while batch := list(islice(rows, batch_size)):
+            read += len(batch)
+            batch_added = insert_batch(batch, dry_run)
+            added.extend(batch_added)
+            logging.info(f'{"Would add" if dry_run else "Added"} {len(batch_added)} of {len(batch)} entities: {", ".join(batch_added)}')
+    return read, added
+
+
+def main():
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not paths:
+        print(__doc__)
+        sys.exit(1)
+    dry_run = '--dry-run' in sys.argv
+    start = time.time()
+    read, added = import_entities(paths, dry_run)
+    report = f'{len(added)} of {read} distinct entities {"would be " if dry_run else ""}added ({read - len(added)} already in DB) in {time.time() - start:.1f}s'
+    logging.info(report)
+    print(report)
+    if '--enrich' in sys.argv and added and not dry_run:
+        from populate_blanks import populate_blanks
+        populate_blanks()
 
-# list entities to add, one per line, just below as string
-item_list_string = """
-"""
 
-item_list = item_list_string.splitlines()
-
-with app.app_context():
-    for item in item_list:
-        if item == '' or item =='\n':
-            continue
-        try:
-            entity = Entity(status        = 'potential', 
-                            name          = item, 
-                            stage_current = 2, 
-                            stage_history = [], 
-                            stage_EM4view = 2, 
-                            date_started  = '', 
-                            date_ended    = '', 
-                            summary       = '', 
-                            corp_fam      = '', 
-                            category      = '')
-            db.session.add(entity)
-            db.session.commit()
-            logging.info(f'Added entity: {item}')
-            print       (f'Added entity: {item}')
-        except IntegrityError as e:
-            # Catch SQLAlchemy's IntegrityError (specific error for UNIQUE constraint)
-            logging.info(f'(Likely entity "{item}" already exists in DB.) IntegrityError caught: {e.orig}')
-            print       (f'(Likely entity "{item}" already exists in DB.) IntegrityError caught: {e.orig}')
-            db.session.rollback()
-        except Exception as e:
-            logging.info(f'(For item "{item}".) An unexpected error occurred: {e}')
-            print       (f'(For item "{item}".) An unexpected error occurred: {e}')
-            db.session.rollback()
-
-print(f'Completed script')
-
-# AdBlock Plus
-# Adobe
-# AOL
-# Apple
-# Arm
-# Asus
-# Atari
-# Azure
-# Best Buy
-# Bitchute
-# BitTorrent
-# Boeing 
-# Boring Co
-# Broadcom 
-# buymeacoffee.com
-# Cara
-# Cloudflare
-# Craig's List
-# despair.com
-# Dice
-# Downdector.com
-# DuckDuckGo
-# EA
-# eBay
-# figma
-# Fitbit
-# Fiverr
-# Ghostery
-# Github
-# Grok
-# Grokster
-# Groq
-# gumloop
-# HackerNews
-# Happiest Baby
-# icanhazip.com
-# ICQ
-# Instagram
-# Intel
-# IRC
-# KaZaa
-# LG
-# LimeWire
-# LinkedIn
-# Lyft
-# medium.com
-# Meta
-# Microsoft
-# Mistral
-# Morpheus
-# MySpace
-# Napster
-# Neuralink
-# NPR
-# Nvidia 
-# Oculus
-# OGS
-# OpenAI
-# Oura
-# PayPal
-# Peloton
-# Pinterest
-# PostgreSQL
-# Procreate
-# Pwned
-# reCAPTCHA 
-# Ring
-# Roku
-# Rumble
-# Samsung
-# scamadviser.com
-# Shipt
-# Signal
-# Skype
-# Slashdot
-# Snowflake
-# Sonos
-# StackOverflow
-# Telegraph
-# TikTok
-# uBlock Origin
-# United Airlines
-# Upwork
-# Valve
-# VMWare
-# Waymo
-# WhatsApp
-# Whole Foods
-# Yahoo
+if __name__ == "__main__":
+    main()
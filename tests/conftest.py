@@ -0,0 +1,44 @@
+"""
+Shared setup for the tests: throwaway SQLite DB, fake LLM, no search / LLM cache files left behind.
+Run from the repo root:  python -m pytest -q tests
+"""
+
+import os
+import sys
+import logging
+import tempfile
+import pytest
+
+test_directory = tempfile.mkdtemp(prefix='em_tests_')
+os.environ['EM_DATABASE_URI'] = 'sqlite:///' + os.path.join(test_directory, 'em.db')
+os.environ['FLASK_SECRET_KEY'] = 'tests'
+os.environ['LLM_BACKEND'] = 'fake'
+os.environ['LLM_CACHE'] = 'off'
+os.environ['LLM_REQUESTS_PER_SECOND'] = '1000'
+os.environ['SEARCH_CACHE_PATH'] = os.path.join(test_directory, 'search_cache.db')
+
+repo_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(repo_directory, 'www'), os.path.join(repo_directory, 'backend')]
+
+# backend scripts call logging.basicConfig(filename=...) on import; with a root handler already set that's a no-op
+logging.getLogger().addHandler(logging.NullHandler())
+
+from app import app, db
+
+
+@pytest.fixture
+def app_db():
+    """ fresh empty schema per test, inside an app context """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def no_search(monkeypatch):
+    """ Wikipedia / DDG lookups answer locally """
+    import populate_blanks
+    monkeypatch.setattr(populate_blanks, 'wikipedia_search', lambda query: f'Wikipedia text about {query}, founded 2004.')
+    monkeypatch.setattr(populate_blanks, 'ddg_search', lambda query: f'Search result for {query}, 2010 launch.')
@@ -0,0 +1,37 @@
+from datetime import date, timedelta
+import context_budget
+from context_budget import allocate, count_tokens, fit_chunks, fit_source, news_chunks, text_chunks
+
+
+def test_unused_share_rolls_over():
+    assert allocate({'news': 100, 'wikipedia': 5000, 'ddg': 5000}, total=1000) == {'news': 100, 'wikipedia': 650, 'ddg': 250}
+    assert allocate({'news': 50, 'wikipedia': 50, 'ddg': 50}, total=1000) == {'news': 50, 'wikipedia': 50, 'ddg': 50}
+
+
+def test_best_chunks_kept_in_original_order():
+    chunks = [(1.0, 'first low'), (3.0, 'second best'), (2.0, 'third good')]
+    budget = count_tokens('second best') + count_tokens('third good')
+    assert fit_chunks(chunks, budget)[0] == 'second best third good'
+
+
+def test_recent_and_stage_changes_win():
+    today = date(2025, 1, 1)
+    entries = [{'date': today - timedelta(days=3000), 'stage': 2, 'text': 'old'},
+               {'date': today - timedelta(days=10), 'stage': 2, 'text': 'recent, same stage'},
+               {'date': today - timedelta(days=2000), 'stage': 3, 'text': 'older, stage moved'}]
+    scores = dict((text, score) for score, text in news_chunks(entries, today))
+    assert scores['recent, same stage'] > scores['old']
+    assert scores['older, stage moved'] > scores['recent, same stage']
+
+
+def test_llm_shrink_only_when_far_over(monkeypatch):
+    text = '\n\n'.join(f'Acme did thing {n} in {2000 + n}.' for n in range(40))
+    shrinks = []
+    shrink = lambda text: shrinks.append(text) or 'Acme, condensed.'
+    need = count_tokens(text)
+
+    fitted = fit_source('wikipedia', text, text_chunks(text, 'Acme'), need // 2, 'Acme', shrink)
+    assert shrinks == [] and 'Acme did thing 0 in 2000.' in fitted and len(fitted) < len(text) # cut locally, lead kept
+
+    assert fit_source('wikipedia', text, text_chunks(text, 'Acme'), need // (context_budget.llm_shrink_ratio + 1), 'Acme', shrink) == 'Acme, condensed.'
+    assert len(shrinks) == 1
@@ -0,0 +1,28 @@
+import sqlalchemy as sa
+from app.db_engine import busy_timeout_ms
+from app.models import Entity
+
+
+def test_connections_get_wal_and_busy_timeout(app_db):
+    with app_db.engine.connect() as connection:
+        pragma = lambda name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('busy_timeout') == busy_timeout_ms
+        assert pragma('synchronous') == 1 # NORMAL
+        assert pragma('temp_store') == 2 # MEMORY
+
+
+def test_reader_and_writer_do_not_block_each_other(app_db):
+    app_db.session.add(Entity(name='Acme', status='live'))
+    app_db.session.commit()
+    with app_db.engine.connect() as writer, app_db.engine.connect() as reader:
+        writer.exec_driver_sql('PRAGMA busy_timeout = 100') # fail fast rather than wait, if it were blocked
+        reader.exec_driver_sql('BEGIN')
+        assert reader.execute(sa.select(Entity.status)).scalar() == 'live' # page load part way through its reads
+
+        writer.execute(sa.update(Entity).values(status='potential')) # cron script writes and commits meanwhile
+        writer.commit()
+
+        assert reader.execute(sa.select(Entity.status)).scalar() == 'live' # reader keeps its snapshot
+        reader.rollback()
+        assert reader.execute(sa.select(Entity.status)).scalar() == 'potential'
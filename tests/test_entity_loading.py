@@ -0,0 +1,35 @@
+import sqlalchemy as sa
+from app.metrics import instrument
+from app.models import Entity, entity_list, entity_full
+
+heavy = {'seed', 'summary', 'timeline', 'data_map', 'stage_history'}
+
+
+def add_entities(db, count=5):
+    db.session.add_all(Entity(name=f'Entity {n}', status='live', summary='long text ' * 200, timeline='* 2020 event',
+                              data_map='map', stage_history=[['2024-05-01', 2]]) for n in range(count))
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def test_list_views_leave_heavy_columns_unread(app_db):
+    add_entities(app_db)
+    with instrument('list') as scope:
+        entities = app_db.session.scalars(entity_list()).all()
+        names = [entity.name for entity in entities]
+    assert len(names) == 5 and scope.queries == 1
+    assert all(heavy <= sa.inspect(entity).unloaded for entity in entities)
+
+    with instrument('first touch') as scope:
+        assert entities[0].summary.startswith('long text')
+        assert entities[0].timeline == '* 2020 event' # same 'text' group, already loaded
+    assert scope.queries == 1
+    assert 'stage_history' in sa.inspect(entities[0]).unloaded
+
+
+def test_full_rows_in_one_query(app_db):
+    add_entities(app_db)
+    with instrument('full') as scope:
+        entities = app_db.session.scalars(entity_full()).all()
+        assert all(entity.summary and entity.stage_history for entity in entities)
+    assert scope.queries == 1
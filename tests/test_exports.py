@@ -0,0 +1,39 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from app import app
+from app.models import Entity, News, User
+
+
+def admin_client(db):
+    db.session.add(User(username='admin', email='admin@example.com', role='administrator'))
+    db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    return client
+
+
+def test_entity_export_with_stage_history(app_db):
+    history = [[date(2025, 2, 7), 3, 1, 739289], [datetime(2024, 5, 1, 9, 30), 2, None, 739008]]
+    app_db.session.add(Entity(name='Acme', status='live', stage_history=history))
+    app_db.session.add(Entity(name='Blank', status='potential'))
+    app_db.session.add(News(text='Acme news', ent_names=['Acme'], stage_int_value=3))
+    app_db.session.commit()
+    client = admin_client(app_db)
+
+    response = client.get('/export/entities.csv')
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row['name'] for row in rows] == ['Acme', 'Blank']
+    assert json.loads(rows[0]['stage_history']) == [['2025-02-07', 3, 1, 739289], ['2024-05-01 09:30:00', 2, None, 739008]]
+
+    response = client.get('/export/entities.ndjson')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0]['stage_history'][0] == ['2025-02-07', 3, 1, 739289]
+
+    lines = client.get('/export/news.ndjson').get_data(as_text=True).splitlines()
+    assert json.loads(lines[0])['ent_names'] == ['Acme']
+    assert client.get('/export/users.csv').status_code == 404
@@ -0,0 +1,67 @@
+import json
+import sqlalchemy as sa
+from app import graph as graph_module
+from app.models import Entity, News, GraphElement
+
+
+def elements(db):
+    return {row.id: json.loads(row.data)['data'] for row in db.session.scalars(sa.select(GraphElement))}
+
+
+def judged(db, name, headline, stage):
+    """ live entity with one judged news item in its stage_history """
+    news = News(text=headline, stage_int_value=stage)
+    db.session.add(news)
+    db.session.flush()
+    entity = Entity(name=name, status='live', stage_current=stage, stage_history=[['2024-06-02', stage, news.id]])
+    db.session.add(entity)
+    db.session.commit()
+    return entity, news
+
+
+def test_news_edit_rewrites_its_node(app_db):
+    entity, news = judged(app_db, 'Acme', 'Acme adds ads', 2)
+
+    news.text = 'Acme adds ads, then a paywall'
+    news.stage_int_value = 3
+    app_db.session.commit()
+
+    graph = elements(app_db)
+    assert graph[f'news#{news.id}']['label'] == 'Acme adds ads, then a paywall'
+    assert f'news#{news.id}-stage3' in graph and f'news#{news.id}-stage2' not in graph
+    assert f'news#{news.id}-ent#{entity.id}' in graph
+
+
+def test_history_edit_drops_news_edge(app_db):
+    entity, news = judged(app_db, 'Acme', 'Acme adds ads', 2)
+    assert f'news#{news.id}-ent#{entity.id}' in elements(app_db)
+
+    entity.stage_history = [['2024-05-01', 1]] # judgment taken out by hand (entity edit form)
+    app_db.session.commit()
+
+    graph = elements(app_db)
+    assert f'news#{news.id}-ent#{entity.id}' not in graph
+    assert f'ent#{entity.id}' in graph
+
+
+def test_entity_edit_rewrites_only_that_entity(app_db):
+    acme, acme_news = judged(app_db, 'Acme', 'Acme adds ads', 2)
+    beta, beta_news = judged(app_db, 'Beta', 'Beta sells data', 3)
+    graph_module.rebuild_graph(app_db.session.connection()) # base stage / category nodes, as the migration's first fill
+    marker = json.dumps({'data': {'id': f'ent#{beta.id}', 'label': 'untouched'}})
+    app_db.session.execute(sa.update(GraphElement).where(GraphElement.id == f'ent#{beta.id}').values(data=marker))
+    app_db.session.commit()
+
+    acme.stage_current = 4
+    acme.category = 'social'
+    app_db.session.commit()
+
+    graph = elements(app_db)
+    assert graph[f'ent#{beta.id}']['label'] == 'untouched' # Beta's rows not rewritten
+    assert f'ent#{acme.id}-stage4' in graph and f'ent#{acme.id}-stage2' not in graph
+    assert graph[f'ent#{acme.id}-social']['target'] == 'social'
+
+    incremental = {key: value for key, value in graph.items() if key != f'ent#{beta.id}'}
+    graph_module.rebuild_graph(app_db.session.connection())
+    rebuilt = {key: value for key, value in elements(app_db).items() if key != f'ent#{beta.id}'}
+    assert incremental == rebuilt
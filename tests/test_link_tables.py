@@ -0,0 +1,44 @@
+from datetime import date
+import sqlalchemy as sa
+from app.models import Entity, News, User, EntityNews, UserFollow
+
+
+def links(db, entity):
+    rows = db.session.scalars(sa.select(EntityNews).where(EntityNews.entity_id == entity.id).order_by(EntityNews.date_pub))
+    return [(row.news_id, row.date_pub, row.stage_value) for row in rows]
+
+
+def test_entity_news_follows_stage_history(app_db):
+    entity = Entity(name='Acme', status='live', stage_history=[['2024-05-01', 2]])
+    app_db.session.add(entity)
+    app_db.session.commit() # new entity - no id until the flush
+    assert links(app_db, entity) == [(None, date(2024, 5, 1), 2)]
+    first_row = app_db.session.scalar(sa.select(EntityNews.id))
+
+    news = News(text='Acme adds ads', stage_int_value=3)
+    app_db.session.add(news)
+    app_db.session.flush()
+    entity.stage_history.append([date(2024, 6, 2), 3, news.id, date(2024, 6, 2).toordinal()]) # as semantics.apply_judgment does
+    app_db.session.commit()
+    assert links(app_db, entity) == [(None, date(2024, 5, 1), 2), (news.id, date(2024, 6, 2), 3)]
+    assert app_db.session.get(EntityNews, first_row) is not None # unchanged item's row kept
+
+    entity.stage_history = [['2024-05-01', '4']] # whole list reassigned, ex: edit form, backfill_stage_current
+    app_db.session.commit()
+    assert links(app_db, entity) == [(None, date(2024, 5, 1), 4)]
+
+
+def test_user_follow_follows_entities_following(app_db):
+    app_db.session.add(Entity(name='Acme', status='live'))
+    app_db.session.commit()
+    app_db.session.add(Entity(name='Beta', status='live')) # same flush as the user
+    user = User(username='reader', email='reader@example.com', entities_following=['Acme', 'Beta', 'Nobody'])
+    app_db.session.add(user)
+    app_db.session.commit()
+    names = lambda: set(app_db.session.scalars(sa.select(Entity.name).join(UserFollow, UserFollow.entity_id == Entity.id).where(UserFollow.user_id == user.id)))
+    assert names() == {'Acme', 'Beta'}
+
+    user.entities_following = ['Beta', 'Gamma']
+    app_db.session.add(Entity(name='Gamma', status='live')) # same flush as the change
+    app_db.session.commit()
+    assert names() == {'Beta', 'Gamma'}
@@ -0,0 +1,48 @@
+from datetime import timedelta
+import time
+from langchain_core.outputs import Generation
+import llm_cache
+from llm_cache import DiskLLMCache
+
+
+def answer(text):
+    return [Generation(text=text)]
+
+
+def texts(generations):
+    return [generation.text for generation in generations] if generations else None
+
+
+def test_keyed_on_prompt_and_model(tmp_path):
+    cache = DiskLLMCache(str(tmp_path / 'llm.db'))
+    cache.update('judge: Acme adds ads', 'mistral temperature=0', answer('Stage 2'))
+
+    assert texts(cache.lookup('judge: Acme adds ads', 'mistral temperature=0')) == ['Stage 2']
+    assert cache.lookup('judge: Acme adds ads', 'mistral temperature=0.7') is None
+    assert cache.lookup('judge: Acme adds paywall', 'mistral temperature=0') is None
+    assert (cache.stats['hits'], cache.stats['misses']) == (1, 2)
+
+
+def test_least_recently_used_evicted(tmp_path):
+    cache = DiskLLMCache(str(tmp_path / 'llm.db'), max_entries=2)
+    cache.update('a', 'model', answer('A'))
+    cache.update('b', 'model', answer('B'))
+    assert cache.lookup('a', 'model') # 'a' now more recently used than 'b'
+
+    cache.update('c', 'model', answer('C'))
+
+    assert cache.lookup('b', 'model') is None
+    assert texts(cache.lookup('a', 'model')) == ['A'] and texts(cache.lookup('c', 'model')) == ['C']
+    assert cache.stats['evicted'] == 1
+
+
+def test_expired_and_disabled(tmp_path, monkeypatch):
+    cache = DiskLLMCache(str(tmp_path / 'llm.db'), ttl=timedelta(days=1))
+    cache.update('a', 'model', answer('A'))
+    later = time.time() + timedelta(days=2).total_seconds()
+    monkeypatch.setattr(llm_cache.time, 'time', lambda: later)
+    assert cache.lookup('a', 'model') is None and cache.stats['expired'] == 1
+
+    off = DiskLLMCache(str(tmp_path / 'off.db'), enabled=False)
+    off.update('a', 'model', answer('A'))
+    assert off.lookup('a', 'model') is None and off.conn is None
@@ -0,0 +1,36 @@
+import asyncio
+import pytest
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+import llm_client
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """ models built by llm_client, from a clean slate """
+    built = []
+    def build_fake():
+        built.append(llm_client.build_fake())
+        return built[-1]
+    monkeypatch.setitem(llm_client.backends, 'fake', build_fake)
+    monkeypatch.setitem(llm_client.client, 'model', None)
+    return built
+
+
+def summary_chain():
+    return ChatPromptTemplate.from_template('Summarize: {text}') | llm_client.large_lang_model | StrOutputParser()
+
+
+def test_one_client_per_process_and_per_event_loop(builds):
+    for n in range(5):
+        assert summary_chain().invoke({'text': f'post {n}'})
+    assert len(builds) == 1
+
+    async def burst():
+        return await asyncio.gather(*(summary_chain().ainvoke({'text': f'post {n}'}) for n in range(6)))
+
+    assert all(asyncio.run(burst()))
+    assert len(builds) == 2 # one for that loop, shared by the six calls
+    asyncio.run(burst())
+    assert len(builds) == 3 # a new loop can't reuse the last loop's async connections
+    assert llm_client.chat_model() is builds[0]
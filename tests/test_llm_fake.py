@@ -0,0 +1,32 @@
+import json
+import random
+import pytest
+from langchain_core.messages import HumanMessage
+from llm_fake import FakeChatModel
+import semantics
+
+
+def ask(prompt):
+    return FakeChatModel().invoke([HumanMessage(content=prompt)]).content
+
+
+def test_same_prompt_same_answer():
+    prompt = semantics.JUDGMENT_TEMPLATE.format(entities=['Acme'], enshit_hit=True, text='Acme adds ads')
+    answers = {ask(prompt) for _ in range(3)}
+    assert len(answers) == 1
+    assert answers.pop().split(' - ')[0] in ('None', 'Stage 1', 'Stage 2', 'Stage 3', 'Stage 4')
+
+
+def test_answers_shaped_for_the_parsers():
+    summary = ask(semantics.SUMMARY_TEMPLATE.format(text='Acme adds ads to the paid tier.'))
+    assert summary == 'Fake summary: Acme adds ads to the paid tier.'
+    entity = json.loads(ask('Entity is: "Acme" ... return summary, date_started, date_ended, corp_fam, category, ent_url in JSON'))
+    assert entity['summary'].startswith('Acme ') and set(entity) == {'summary', 'date_started', 'date_ended', 'corp_fam', 'category', 'ent_url'}
+
+
+@pytest.mark.parametrize('dist, low, high', [('fixed', 0.2, 0.2), ('uniform', 0.1, 0.3), ('lognormal', 0.0, 10.0)])
+def test_latency_distributions(dist, low, high):
+    model = FakeChatModel(latency_dist=dist, latency_ms=200, latency_spread=0.5)
+    rng = random.Random(1)
+    assert all(low <= model.latency(rng) <= high for _ in range(200))
+    assert FakeChatModel(latency_dist=dist, latency_ms=0).latency(rng) == 0
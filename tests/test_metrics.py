@@ -0,0 +1,50 @@
+import logging
+from collections import Counter
+import pytest
+import sqlalchemy as sa
+from app import app, metrics
+from app.metrics import instrument, statement_shape
+from app.models import Entity, User
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    """ this test's traffic only """
+    for name in ('requests_total', 'sql_queries_total', 'sql_seconds_total', 'n_plus_one_total', 'template_seconds_total', 'template_renders_total'):
+        monkeypatch.setattr(metrics, name, Counter())
+    monkeypatch.setattr(metrics, 'request_seconds', metrics.Histogram(metrics.latency_buckets))
+    monkeypatch.setattr(metrics, 'request_queries', metrics.Histogram(metrics.query_buckets))
+
+
+def test_metrics_page(app_db, fresh_metrics):
+    app_db.session.add(User(username='admin', email='admin@example.com', role='administrator'))
+    app_db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+    assert client.get('/rankings').status_code == 200
+
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert 'em_requests_total{endpoint="rankings",status="200"} 1' in text
+    assert 'em_request_duration_seconds_count{endpoint="rankings"} 1' in text
+    assert 'em_template_renders_total{template="rankings.html"} 1' in text
+    assert 'em_request_sql_queries_count{endpoint="rankings"} 1' in text
+    assert 'endpoint="metrics"' not in text # scrapes aren't counted
+    assert text.count('# TYPE') == 8
+
+
+def test_repeated_statement_flagged(app_db, caplog):
+    app_db.session.add_all(Entity(name=f'Entity {n}', status='live') for n in range(12))
+    app_db.session.commit()
+    with caplog.at_level(logging.WARNING), instrument('per-row lookups') as scope:
+        for entity_id in range(1, 13): # one query per row - what a lazy load in a loop does
+            app_db.session.execute(sa.select(Entity.name).where(Entity.id == entity_id)).scalar()
+
+    assert scope.queries == 12
+    assert scope.repeated() == [(statement_shape('SELECT entity.name FROM entity WHERE entity.id = 5'), 12)]
+    assert 'possible N+1 in per-row lookups: same query 12 times' in caplog.text
+
+
+def test_statement_shape_folds_literals():
+    assert statement_shape("SELECT * FROM news WHERE id IN (1, 2, 3) AND text = 'a'") == statement_shape("SELECT * FROM news WHERE id IN (7) AND text = 'bb'")
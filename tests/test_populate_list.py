@@ -0,0 +1,25 @@
+import os
+import sys
+import sqlalchemy as sa
+from app.models import Entity, cache_version
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend', 'utilities'))
+import populate_list
+
+
+def test_import_skips_existing_and_bumps_entity_version(app_db, tmp_path):
+    app_db.session.add(Entity(name='Old Co', status='live'))
+    app_db.session.commit()
+    version = cache_version('entity')
+    csv_file = tmp_path / 'entities.csv'
+    csv_file.write_text('name,category\nOld Co,B2B\nNew Co,social\nNew Co,cloud\n')
+    txt_file = tmp_path / 'names.txt'
+    txt_file.write_text('# comment\nOther Co\n\n')
+
+    read, added = populate_list.import_entities([str(csv_file), str(txt_file)])
+
+    assert (read, sorted(added)) == (3, ['New Co', 'Other Co'])
+    assert cache_version('entity') > version
+    entities = {entity.name: entity for entity in app_db.session.scalars(sa.select(Entity))}
+    assert entities['Old Co'].status == 'live' # left alone
+    assert (entities['New Co'].status, entities['New Co'].category) == ('potential', 'social')
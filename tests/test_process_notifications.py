@@ -0,0 +1,107 @@
+import smtplib
+from datetime import datetime
+import sqlalchemy as sa
+import process_notifications
+from app.metrics import instrument
+from app.models import Entity, News, Art, User
+
+
+def add_users(db, count):
+    users = [User(username=f'user{n}', email=f'user{n}@example.com', last_sent=datetime(2024, 6, 1 + n),
+                  alert_on_art_item=True, alert_on_news_item=True, alert_on_stage_change=True,
+                  entities_following=['Acme'], categories_following=['cloud'])
+             for n in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    return db.session.scalars(sa.select(User).order_by(User.id)).all()
+
+
+def test_reports_cut_from_one_shared_load(app_db):
+    news = [News(text=f'Acme story {day}', url=f'https://example.com/{day}', date_pub=f'2024-06-{day:02d}', stage_int_value=3) for day in (2, 5, 9)]
+    app_db.session.add_all(news)
+    app_db.session.add_all(Art(text=f'Art {day}', url='https://example.com/art', date_pub=f'2024-06-{day:02d}') for day in (3, 8))
+    app_db.session.flush()
+    app_db.session.add(Entity(name='Acme', status='live', stage_current=3, category='social',
+                              stage_history=[[f'2024-06-{day:02d}', 3, item.id] for day, item in zip((2, 5, 9), news)]))
+    app_db.session.add(Entity(name='Beta Cloud', status='live', stage_current=2, category='cloud',
+                              stage_history=[['2024-06-07', 1], ['2024-06-08', 2]]))
+    users = add_users(app_db, 6)
+
+    shared = process_notifications.load_report_data(users)
+    for user in users: # same report as loading for that user alone
+        assert process_notifications.create_report(user, shared) == process_notifications.create_report(user)
+
+    report = process_notifications.create_report(users[3], shared) # last_sent June 4
+    assert 'Acme story 2' not in report and 'Acme story 5' in report and 'Acme story 9' in report
+    assert 'Art 3' not in report and 'Art 8' in report
+    assert 'Beta Cloud crossed stages' in report
+
+
+def test_report_data_queries_do_not_grow_with_users(app_db):
+    app_db.session.add(Entity(name='Acme', status='live', stage_current=2))
+    users = add_users(app_db, 8)
+    with instrument('two users') as two:
+        process_notifications.load_report_data(users[:2])
+    with instrument('eight users') as eight:
+        process_notifications.load_report_data(users)
+    assert eight.queries == two.queries
+
+
+class FakeSMTP:
+    """ stands in for mail.connect(); refuse - recipient: times to reject, down_after - sends before the server goes away for good """
+
+    def __init__(self, refuse=None, down_after=None):
+        self.refuse = dict(refuse or {})
+        self.down_after = down_after
+        self.connections = 0
+        self.delivered = []
+
+    def connect(self):
+        if self.down_after is not None and len(self.delivered) >= self.down_after and self.connections:
+            raise ConnectionRefusedError('server down')
+        self.connections += 1
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def send(self, msg):
+        recipient = msg.recipients[0]
+        if self.down_after is not None and len(self.delivered) >= self.down_after:
+            raise smtplib.SMTPServerDisconnected('connection lost')
+        if self.refuse.get(recipient):
+            self.refuse[recipient] -= 1
+            raise smtplib.SMTPRecipientsRefused({recipient: (550, b'mailbox busy')})
+        self.delivered.append(recipient)
+
+
+def batch_for(users):
+    now = datetime(2024, 7, 1)
+    return [(user, now, f'report for {user.username}') for user in users]
+
+
+def test_reports_share_one_connection_and_retry_rejects(app_db, monkeypatch):
+    users = add_users(app_db, 4)
+    smtp = FakeSMTP(refuse={'user1@example.com': 1, 'user2@example.com': process_notifications.send_attempts})
+    monkeypatch.setattr(process_notifications.mail, 'connect', smtp.connect)
+
+    assert process_notifications.deliver_reports(batch_for(users)) == 3
+
+    assert smtp.connections == 1
+    assert smtp.delivered == ['user0@example.com', 'user1@example.com', 'user3@example.com']
+    assert [user.last_sent == datetime(2024, 7, 1) for user in users] == [True, True, False, True]
+
+
+def test_server_down_leaves_the_rest_for_next_run(app_db, monkeypatch):
+    users = add_users(app_db, 4)
+    smtp = FakeSMTP(down_after=1)
+    monkeypatch.setattr(process_notifications.mail, 'connect', smtp.connect)
+    monkeypatch.setattr(process_notifications.time, 'sleep', lambda seconds: None)
+
+    assert process_notifications.deliver_reports(batch_for(users)) == 1
+
+    app_db.session.expire_all()
+    assert [user.last_sent == datetime(2024, 7, 1) for user in users] == [True, False, False, False]
@@ -0,0 +1,33 @@
+import pytest
+from app import app, routes
+from app.models import Entity, User
+
+
+@pytest.fixture
+def reader(app_db, monkeypatch):
+    """ logged-in regular user's client, with an empty rankings cache and build_rankings calls counted """
+    monkeypatch.setattr(routes, 'rankings_cache', {'version': None, 'entries': {}})
+    builds = []
+    build_rankings = routes.build_rankings
+    monkeypatch.setattr(routes, 'build_rankings', lambda: builds.append(1) or build_rankings())
+    app_db.session.add(User(username='reader', email='reader@example.com'))
+    app_db.session.add(Entity(name='Acme', status='live', stage_current=2, stage_EM4view=2))
+    app_db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+    client.builds = builds
+    return client
+
+
+def test_rankings_built_once_until_an_entity_changes(reader, app_db):
+    first = reader.get('/rankings').get_data(as_text=True)
+    assert reader.get('/rankings').status_code == 200 # served from the cache
+    assert len(reader.builds) == 1
+    assert 'Acme' in first and 'Beta' not in first
+
+    app_db.session.add(Entity(name='Beta', status='live', stage_current=3, stage_EM4view=3)) # bumps CacheVersion 'entity'
+    app_db.session.commit()
+
+    assert 'Beta' in reader.get('/rankings').get_data(as_text=True)
+    assert len(reader.builds) == 2
@@ -0,0 +1,53 @@
+import time
+import pytest
+import search_cache
+from search_cache import AdaptiveLimiter, SearchCache
+
+
+class RatelimitException(Exception):
+    pass
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setitem(search_cache.limiters, 'ddg', AdaptiveLimiter('ddg', min_interval=1))
+    monkeypatch.setattr(search_cache.time, 'sleep', lambda seconds: None) # waits and cooldowns pass instantly
+    return SearchCache(str(tmp_path / 'search.db'))
+
+
+def age(cache, days):
+    with cache.lock:
+        cache.conn.execute('UPDATE results SET fetched = ?', (time.time() - days * 86400,))
+        cache.conn.commit()
+
+
+def test_fresh_result_reused(cache):
+    calls = []
+    run = lambda query: calls.append(query) or f'results for {query}'
+    assert cache.search('ddg', 'about Acme corp', run) == 'results for about Acme corp'
+    assert cache.search('ddg', 'about Acme corp', run) == 'results for about Acme corp'
+    assert calls == ['about Acme corp']
+    assert cache.stats['fresh'] == 1 and cache.stats['fetched'] == 1
+
+
+def test_rate_limit_serves_stale_copy_and_backs_off(cache):
+    cache.search('ddg', 'about Acme corp', lambda query: 'last week')
+    age(cache, 30)
+    def limited(query):
+        raise RatelimitException('https://duckduckgo.com/ 202 Ratelimit')
+
+    assert cache.search('ddg', 'about Acme corp', limited) == 'last week'
+    limiter = search_cache.limiters['ddg']
+    assert limiter.cooling_down()
+    assert cache.stats['rate_limited'] == 1 and cache.stats['stale'] == 1
+
+
+def test_nothing_cached_retries_then_gives_up(cache):
+    calls = []
+    def limited(query):
+        calls.append(query)
+        raise RatelimitException('202 Ratelimit')
+
+    assert cache.search('ddg', 'timeline about Acme corp', limited) == ''
+    assert len(calls) == search_cache.ratelimit_retries + 1
+    assert cache.stats_report().startswith('Search cache this run: 0 lookups') # gave up, nothing served
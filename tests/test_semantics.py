@@ -0,0 +1,76 @@
+import asyncio
+import math
+import random
+from datetime import date
+from types import SimpleNamespace
+import pytest
+import semantics
+from app.models import Entity
+
+
+def run_post(title):
+    return asyncio.run(semantics.semantic_processing_async(title, 'https://example.com/post', None, 'post body', asyncio.Semaphore(2)))
+
+
+def test_irrelevant_judgment_cancels_summary(app_db, monkeypatch):
+    app_db.session.add(Entity(name='Acme', status='live'))
+    app_db.session.commit()
+    summaries = []
+    async def judgment(enshit_hit, text, entities):
+        await asyncio.sleep(0)
+        return 'None - nothing to do with enshittification'
+    async def summary(text):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            summaries.append('cancelled')
+            raise
+    monkeypatch.setattr(semantics, 'semantic_judgment_async', judgment)
+    monkeypatch.setattr(semantics, 'write_summary_async', summary)
+
+    judgment_note, results = run_post('Acme ships an update')
+
+    assert results['entities'] == ['Acme'] and results['summary'] is None
+    assert summaries == ['cancelled']
+    assert semantics.record_judgment(judgment_note, 'Acme ships an update', 'https://example.com/post', None, **results).endswith(
+        'Judged irrelevant to enshittification: None - nothing to do with enshittification. ')
+
+
+def test_relevant_judgment_keeps_summary(app_db):
+    app_db.session.add(Entity(name='Acme', status='live'))
+    app_db.session.commit()
+
+    judgment_note, results = run_post('Acme enshittification: new ads everywhere')
+
+    assert semantics.judged_stage(results['stage'])
+    assert results['summary']
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Meta buys a metadata startup', ['Meta']),
+    ('X, formerly Twitter, and Xbox', ['X', 'Twitter']),
+    ('New Amazon Prime tiers; amazon again', ['Amazon', 'Amazon Prime', 'Amazon']),
+    ('Microsoft_Teams is one token', []),
+    ('"Ring" doorbells, bring it', ['Ring']),
+])
+def test_entity_names_match_on_word_boundaries(text, expected):
+    automaton = semantics.build_entity_matcher(['Meta', 'X', 'Twitter', 'Amazon', 'Amazon Prime', 'Microsoft', 'Ring'])
+    assert semantics.match_entities(automaton, text) == expected
+
+
+def test_running_stage_matches_full_recompute():
+    rng = random.Random(5)
+    history = [['2024-AUG-17', 2], ['2024-SEP-06', 'Stage 3']] # older formats: parsed date, str stage
+    record = SimpleNamespace(name='Acme', stage_history=history, stage_anchor_day=None, stage_weight_sum=None, stage_weighted_sum=None)
+    semantics.recompute_stage_current(record)
+    start = date(2024, 9, 10).toordinal()
+    for step in range(60):
+        day = start + step if step % 3 else start + step - rng.randint(1, 40) # every third back-dated
+        value = rng.randint(1, 4)
+        history.append([date.fromordinal(day).isoformat(), value, step, day])
+        running = semantics.add_stage_point(record, day, value)
+
+        full = SimpleNamespace(name='Acme', stage_history=list(history))
+        assert running == semantics.recompute_stage_current(full)
+        assert math.isclose(record.stage_weighted_sum / record.stage_weight_sum, full.stage_weighted_sum / full.stage_weight_sum)
+        assert record.stage_anchor_day == full.stage_anchor_day
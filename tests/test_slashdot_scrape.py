@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import sqlalchemy as sa
+import slashdot_scrape
+from app.models import SlashdotPost
+
+
+front_page = """
+<html><body>
+<div id="nav">not a story</div>
+<article>
+  <h2 class="story-title" id="title-101"><a href="/story/101">Acme adds ads</a> <a class="story-sourcelnk" href="https://acme.example">(acme.example)</a></h2>
+  <time id="fhtime-101">on Saturday June 29, 2024 @11:34PM</time>
+  <div id="text-101">Acme now shows ads to paying users.</div>
+</article>
+<article>
+  <h2 class="story-title" id="title-102"><a href="/story/102">No body here</a></h2>
+</article>
+</body></html>
+"""
+
+
+def test_front_page_fetched_once_and_parsed(monkeypatch):
+    fetched = []
+    def get(url):
+        fetched.append(url)
+        return SimpleNamespace(status_code=200, text=front_page)
+    monkeypatch.setattr(slashdot_scrape.requests, 'get', get)
+
+    note, stories = slashdot_scrape.fetch_slashdot_stories()
+
+    assert fetched == [slashdot_scrape.site_url]
+    assert list(stories) == ['title-101', 'title-102']
+    title, source_url, fhtime, text = stories['title-101']
+    assert source_url == 'https://acme.example'
+    assert fhtime == 'on Saturday June 29, 2024 @11:34PM'
+    assert text == 'Acme now shows ads to paying users.'
+    assert stories['title-102'][1:] == (None, None, None)
+    assert 'Found 2 stories' in note
+
+
+def test_unreachable_front_page(monkeypatch):
+    monkeypatch.setattr(slashdot_scrape.requests, 'get', lambda url: SimpleNamespace(status_code=503, text=''))
+    assert slashdot_scrape.fetch_slashdot_stories()[1] is None
+
+
+def tracked(db):
+    return {post.title_id: post for post in db.session.scalars(sa.select(SlashdotPost))}
+
+
+def test_claims_new_and_stale_posts_only(app_db, monkeypatch):
+    now = datetime.now()
+    app_db.session.add_all([SlashdotPost(title_id='title-1', status='new', first_seen=now, attempts=0),
+                            SlashdotPost(title_id='title-2', status='processing', first_seen=now, attempts=1, last_attempt=now), # another run has it
+                            SlashdotPost(title_id='title-3', status='processing', first_seen=now, attempts=1, last_attempt=now - timedelta(hours=3)), # crashed run
+                            SlashdotPost(title_id='title-4', status='new', first_seen=now, attempts=slashdot_scrape.max_attempts),
+                            SlashdotPost(title_id='title-5', status='processed', first_seen=now, attempts=1)])
+    app_db.session.commit()
+    stories = {f'title-{n}': (f'Post {n}', 'https://example.com', None, f'Body {n}') for n in range(1, 6)}
+    processed = []
+    monkeypatch.setattr(slashdot_scrape, 'process_mode', 'sync')
+    monkeypatch.setattr(slashdot_scrape, 'semantic_processing', lambda title, url, date, content: processed.append(title) or 'No relevant entity listed. ')
+
+    slashdot_scrape.parse_slashdot_posts(stories)
+
+    assert sorted(processed) == ['Post 1', 'Post 3']
+    app_db.session.expire_all()
+    statuses = {title_id: post.status for title_id, post in tracked(app_db).items()}
+    assert statuses == {'title-1': 'processed', 'title-2': 'processing', 'title-3': 'processed', 'title-4': 'error', 'title-5': 'processed'}
+
+
+def test_retention_keeps_newest(app_db, monkeypatch, tmp_path):
+    monkeypatch.setattr(slashdot_scrape, 'max_size', 3)
+    monkeypatch.chdir(tmp_path) # no slashdot_data.txt to import
+    first_seen = datetime.now() - timedelta(days=1)
+    app_db.session.add_all(SlashdotPost(title_id=f'title-{n}', status='processed', first_seen=first_seen, attempts=1) for n in range(1, 4))
+    app_db.session.commit()
+
+    slashdot_scrape.process_slashdot_site({'title-3': None, 'title-4': None, 'title-5': None})
+
+    app_db.session.expire_all()
+    assert set(tracked(app_db)) == {'title-3', 'title-4', 'title-5'}
+    assert tracked(app_db)['title-3'].status == 'processed' # already tracked, left as is
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+import timeline_worker
+import populate_blanks
+from app.models import Entity, TimelineRefresh
+
+
+def add_queued(db, names):
+    """ entities with a summary, each with a rebuild already due """
+    ids = {}
+    for name in names:
+        entity = Entity(name=name, status='live', summary=f'{name} summary')
+        db.session.add(entity)
+        db.session.flush()
+        ids[name] = entity.id
+        timeline_worker.queue_timeline_refresh(entity.id, now=datetime.now() - timedelta(days=1))
+    db.session.commit()
+    return ids
+
+
+def queued(db):
+    return {row.entity_id: row for row in db.session.scalars(sa.select(TimelineRefresh))}
+
+
+def test_failed_rebuild_is_retried_later(app_db, monkeypatch):
+    ids = add_queued(app_db, ['Broken', 'Fine'])
+    def timeline(entity):
+        if entity.name == 'Broken':
+            raise RuntimeError('LLM down')
+        return f'* 2020-JAN-01 - {entity.name} event'
+    monkeypatch.setattr(timeline_worker, 'create_timeline_content', timeline)
+
+    assert timeline_worker.run_pass() == (1, 1)
+
+    rows = queued(app_db)
+    assert list(rows) == [ids['Broken']]
+    assert rows[ids['Broken']].attempts == 1
+    assert rows[ids['Broken']].due > datetime.now()
+    assert app_db.session.get(Entity, ids['Fine']).timeline == '* 2020-JAN-01 - Fine event'
+
+
+def test_unexpected_error_does_not_stop_pass(app_db, monkeypatch):
+    ids = add_queued(app_db, ['Broken', 'Fine'])
+    monkeypatch.setattr(timeline_worker, 'create_timeline_content', lambda entity: f'* 2020-JAN-01 - {entity.name} event')
+    data_map = populate_blanks.create_data_map_content
+    def map_content(entity):
+        if entity.name == 'Broken':
+            raise ValueError('bad data map')
+        return data_map(entity)
+    monkeypatch.setattr(populate_blanks, 'create_data_map_content', map_content)
+
+    assert timeline_worker.run_pass() == (1, 1)
+
+    rows = queued(app_db)
+    assert list(rows) == [ids['Broken']] # left as it was, for the next pass
+    assert rows[ids['Broken']].attempts == 0
+    assert app_db.session.get(Entity, ids['Broken']).timeline is None
+    assert app_db.session.get(Entity, ids['Fine']).timeline == '* 2020-JAN-01 - Fine event'
+
+
+def test_entity_changed_during_rebuild(app_db, monkeypatch):
+    ids = add_queued(app_db, ['Busy'])
+    def timeline(entity):
+        with app_db.engine.begin() as other: # a news judgment landing while the LLM calls run
+            other.execute(sa.update(Entity).where(Entity.id == entity.id).values(stage_current=4, row_version=Entity.row_version + 1))
+        return '* 2020-JAN-01 - Busy event'
+    monkeypatch.setattr(timeline_worker, 'create_timeline_content', timeline)
+
+    assert timeline_worker.run_pass() == (1, 0)
+
+    app_db.session.expire_all()
+    entity = app_db.session.get(Entity, ids['Busy'])
+    assert entity.timeline == '* 2020-JAN-01 - Busy event'
+    assert entity.stage_current == 4 # the judgment's change kept
+    assert 'Stage 4' in entity.data_map
+    assert queued(app_db) == {}
+
+
+def test_new_hits_keep_retry_backoff(app_db, monkeypatch):
+    ids = add_queued(app_db, ['Broken'])
+    monkeypatch.setattr(timeline_worker, 'create_timeline_content', lambda entity: 1 / 0)
+    timeline_worker.run_pass()
+    backoff_due = queued(app_db)[ids['Broken']].due
+
+    timeline_worker.queue_timeline_refresh(ids['Broken'])
+    app_db.session.commit()
+
+    row = queued(app_db)[ids['Broken']]
+    assert row.due == backoff_due
+    assert row.hits == 2
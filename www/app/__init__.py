@@ -10,8 +10,10 @@ from flask_login import LoginManager
 
 app = Flask(__name__)
 script_directory = os.path.dirname(os.path.abspath(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(script_directory, 'instance', 'em.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('EM_DATABASE_URI', 'sqlite:///' + os.path.join(script_directory, 'instance', 'em.db')) # override for tests
 load_dotenv(os.path.join(script_directory, '..', '.env')) # Load the .env file located one directory up
+from app.db_engine import engine_options # after .env; also sets WAL / busy_timeout / cache pragmas on every SQLite connection
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY')
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
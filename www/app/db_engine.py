@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+"""
+SQLite connection settings for instance/em.db, shared by the web app (mod_wsgi) and every backend script
+(slashdot_scrape, populate_blanks, process_notifications, email_automation, ... all come in through app/__init__.py).
+- WAL journal - readers (page loads) no longer wait on a cron script's write, and vice versa
+- synchronous NORMAL - safe with WAL, fsync at checkpoints rather than every commit
+- busy_timeout - a writer waits for the lock (SQLITE_BUSY_TIMEOUT_MS, default 30s) instead of failing with "database is locked"
+- bigger page cache, and mmap for reads
+WAL leaves em.db-wal / em.db-shm next to em.db; the instance directory needs the same group write rights as em.db.
+"""
+
+import os
+import sqlite3
+import sqlalchemy as sa
+
+
+busy_timeout_ms = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '30000'))
+sqlite_pragmas = {'journal_mode': 'WAL',
+                  'synchronous': 'NORMAL',
+                  'busy_timeout': busy_timeout_ms,
+                  'cache_size': -20000, # KiB, so ~20MB per connection
+                  'mmap_size': 268435456, # 256MB
+                  'temp_store': 'MEMORY'}
+
+# Flask-SQLAlchemy SQLALCHEMY_ENGINE_OPTIONS; pysqlite's own lock wait matches busy_timeout
+engine_options = {'connect_args': {'timeout': busy_timeout_ms / 1000}}
+
+
+@sa.event.listens_for(sa.engine.Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """ every new SQLite connection - web app, scripts, alembic """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in sqlite_pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
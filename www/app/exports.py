@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""
+Streaming admin exports of the entity, news, art and references tables, as CSV or NDJSON (one JSON object per line).
+Rows are plain column tuples (no ORM objects), fetched yield_per at a time off one cursor, and each line is sent
+as it's produced (stream_with_context keeps the request - and its session - open until the last row), so dumping
+the whole News table runs in constant memory, unlike the report_* pages which load everything and render one page.
+"""
+
+import sqlalchemy as sa
+from flask import Response, stream_with_context
+from app import db
+from app.models import Entity, News, Art, References
+from datetime import datetime, date
+import csv
+import json
+
+
+export_tables = {'entities': Entity, 'news': News, 'art': Art, 'references': References}
+export_formats = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+yield_per = 500
+
+
+class LineBuffer:
+    """ csv.writer target that just hands back what was written, so each row can be yielded """
+    def write(self, value):
+        return value
+
+
+def plain(value):
+    """ JSON-able value - PickleType columns (stage_history, ent_names) hold lists that may contain dates / datetimes """
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, date): # datetime too
+        return str(value)
+    return value
+
+
+def table_rows(model):
+    """ (column names, row tuples) for the whole table in id order, streamed off the cursor yield_per rows at a time """
+    columns = list(model.__table__.columns)
+    result = db.session.execute(sa.select(*columns).order_by(model.id).execution_options(yield_per=yield_per))
+    return [column.name for column in columns], result
+
+
+def csv_lines(model):
+    writer = csv.writer(LineBuffer())
+    names, rows = table_rows(model)
+    yield writer.writerow(names)
+    for row in rows:
+        yield writer.writerow([json.dumps(plain(value), default=str) if isinstance(value, (list, tuple)) else value for value in row])
+
+
+def ndjson_lines(model):
+    names, rows = table_rows(model)
+    for row in rows:
+        yield json.dumps(dict(zip(names, (plain(value) for value in row))), default=str) + '\n'
+
+
+def export_response(table, fmt):
+    """ streamed download of table ('entities', 'news', 'art', 'references') in fmt ('csv', 'ndjson'); None if unknown """
+    model = export_tables.get(table)
+    if model is None or fmt not in export_formats:
+        return None
+    lines = csv_lines(model) if fmt == 'csv' else ndjson_lines(model)
+    filename = f'em_{table}_{datetime.now():%Y%m%d}.{fmt}'
+    return Response(stream_with_context(lines),
+                    mimetype = export_formats[fmt],
+                    headers = {'Content-Disposition': f'attachment; filename={filename}'})
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""
+Materialized giant map - live entities with their stage, categories, corp family, and linked news items - stored as
+one pre-serialized Cytoscape element per GraphElement row, and kept current from every ORM flush (update_graph):
+- entity added / deleted, or its name, status, stage_current, category or corp_fam changed - only that entity's elements rewritten
+- EntityNews row with a news id added / deleted (models.sync_link_tables, as stage_history changes) - news node plus its
+  stage and entity edges added / that entity edge dropped
+- News text or stage_int_value changed - its elements rewritten; News deleted - its elements dropped
+Serving (giant_map_json) just joins the stored JSON strings, once per 'graph' version per process, so news edges are affordable.
+Core / bulk statements (ex: utilities/populate_list.py inserts) skip the flush events; backend/make_giant_map.py rebuilds it all.
+"""
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from app.models import Entity, News, EntityNews, GraphElement, cache_version, bump_cache_version
+import json
+
+
+stage_ids = ('stage 1', 'stage 2', 'stage 3', 'stage 4')
+category_ids = ('social', 'cloud', 'B2B', 'B2C', 'C2C', 'tech platform', 'P2P')
+watched = ('name', 'stage_current', 'category', 'corp_fam') # changes to these rewrite an entity's own elements
+news_watched = ('text', 'stage_int_value') # and these a news item's
+news_label_max = 80
+graph_cache = {'version': None, 'json': None}
+
+
+def element(element_id, owner, entity_id=None, label=None, source=None, target=None):
+    """ GraphElement row values for a node (label) or edge (source, target) """
+    if source is None:
+        data = {"data": {"id": element_id, "label": label}}
+    else:
+        data = {"data": {"id": element_id, "source": source, "target": target}}
+    return {'id': element_id, 'kind': 'node' if source is None else 'edge', 'owner': owner, 'entity_id': entity_id, 'data': json.dumps(data)}
+
+
+def split_values(value):
+    """ 'B2C, social' -> ['B2C', 'social']; None / 'None' / 'UNK' -> [] """
+    if not value or value in ('None', 'UNK'):
+        return []
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def write(connection, rows, keep_existing=False):
+    """ insert rows, replacing same-id elements - or leaving them, for nodes several owners share (categories, corp families) """
+    if rows:
+        connection.execute(sqlite_insert(GraphElement).prefix_with('OR IGNORE' if keep_existing else 'OR REPLACE'), rows)
+
+
+def base_rows():
+    return [element(stage, 'base', label=stage) for stage in stage_ids] + [element(cat, 'base', label=cat) for cat in category_ids]
+
+
+def write_entity(connection, entity_id, with_news=False):
+    """ rewrite entity's own elements (node, stage / category / corp family edges); drops everything hanging off it if not live """
+    connection.execute(sa.delete(GraphElement).where(GraphElement.owner == f'ent#{entity_id}'))
+    entity = connection.execute(sa.select(Entity.name, Entity.status, Entity.stage_current, Entity.category, Entity.corp_fam)
+                                  .where(Entity.id == entity_id)).first()
+    if entity is None or entity.status != 'live':
+        connection.execute(sa.delete(GraphElement).where(GraphElement.entity_id == entity_id))
+        return
+    node_id = f'ent#{entity_id}'
+    owned = [element(node_id, node_id, entity_id, label=entity.name),
+             element(f'{node_id}-stage{entity.stage_current}', node_id, entity_id, source=node_id, target=f'stage {entity.stage_current}')]
+    shared = []
+    for cat in split_values(entity.category):
+        shared.append(element(cat, 'shared', label=cat))
+        owned.append(element(f'{node_id}-{cat}', node_id, entity_id, source=node_id, target=cat))
+    for fam in split_values(entity.corp_fam):
+        shared.append(element(f'fam:{fam}', 'shared', label=fam))
+        owned.append(element(f'{node_id}-fam:{fam}', node_id, entity_id, source=node_id, target=f'fam:{fam}'))
+    write(connection, shared, keep_existing=True)
+    write(connection, owned)
+    if with_news:
+        news_ids = connection.execute(sa.select(EntityNews.news_id).where(EntityNews.entity_id == entity_id, EntityNews.news_id.is_not(None))).scalars()
+        write_news(connection, [(news_id, entity_id) for news_id in news_ids])
+
+
+def write_news(connection, links):
+    """ links - (news id, entity id) pairs; news node and stage edge, plus an edge to each linked entity that is live """
+    if not links:
+        return
+    news_ids = {news_id for news_id, entity_id in links}
+    entity_ids = {entity_id for news_id, entity_id in links}
+    live = set(connection.execute(sa.select(Entity.id).where(Entity.id.in_(entity_ids), Entity.status == 'live')).scalars())
+    news = {row.id: row for row in connection.execute(sa.select(News.id, News.text, News.stage_int_value).where(News.id.in_(news_ids)))}
+    rows = []
+    for news_id in news_ids & set(news):
+        node_id = f'news#{news_id}'
+        rows.append(element(node_id, node_id, label=(news[news_id].text or '')[:news_label_max]))
+        if news[news_id].stage_int_value: # some are None and can't edge to a "stageNone"
+            rows.append(element(f'{node_id}-stage{news[news_id].stage_int_value}', node_id,
+                                source=node_id, target=f'stage {news[news_id].stage_int_value}'))
+    for news_id, entity_id in links:
+        if news_id in news and entity_id in live:
+            rows.append(element(f'news#{news_id}-ent#{entity_id}', f'news#{news_id}', entity_id, source=f'news#{news_id}', target=f'ent#{entity_id}'))
+    write(connection, rows)
+
+
+def rebuild_graph(connection):
+    """ whole map from scratch - first fill after the migration, or to clean up after bulk edits """
+    connection.execute(sa.delete(GraphElement))
+    write(connection, base_rows())
+    for entity_id in connection.execute(sa.select(Entity.id).where(Entity.status == 'live')).scalars():
+        write_entity(connection, entity_id)
+    links = connection.execute(sa.select(EntityNews.news_id, EntityNews.entity_id).where(EntityNews.news_id.is_not(None))).all()
+    write_news(connection, [tuple(link) for link in links])
+    bump_cache_version(connection, 'graph')
+
+
+@sa.event.listens_for(so.Session, 'after_flush')
+def update_graph(session, flush_context):
+    """ same transaction as the change; ids of new rows are known by now, and attribute history is still there """
+    entities = {} # entity id -> also (re)link its news (newly live)
+    links = []
+    dropped_news = [] # owners
+    dropped_links = [] # (news id, entity id)
+    changed_news = []
+    for obj in session.new:
+        if isinstance(obj, Entity):
+            entities[obj.id] = True
+        elif isinstance(obj, EntityNews) and obj.news_id:
+            links.append((obj.news_id, obj.entity_id))
+    for obj in session.dirty:
+        if isinstance(obj, Entity):
+            attrs = sa.inspect(obj).attrs
+            if attrs.status.history.has_changes():
+                entities[obj.id] = True
+            elif any(attrs[name].history.has_changes() for name in watched):
+                entities.setdefault(obj.id, False)
+        elif isinstance(obj, News):
+            attrs = sa.inspect(obj).attrs
+            if any(attrs[name].history.has_changes() for name in news_watched):
+                changed_news.append(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Entity):
+            entities[obj.id] = False # gone, so write_entity just drops its elements
+        elif isinstance(obj, News):
+            dropped_news.append(f'news#{obj.id}')
+        elif isinstance(obj, EntityNews) and obj.news_id:
+            dropped_links.append((obj.news_id, obj.entity_id))
+    if not (entities or links or dropped_news or dropped_links or changed_news):
+        return
+    connection = session.connection()
+    if changed_news: # old label / stage edge go, then node and all its links written fresh
+        dropped_news.extend(f'news#{news_id}' for news_id in changed_news)
+        links.extend(tuple(link) for link in connection.execute(sa.select(EntityNews.news_id, EntityNews.entity_id)
+                                                                  .where(EntityNews.news_id.in_(changed_news))))
+    if dropped_news:
+        connection.execute(sa.delete(GraphElement).where(GraphElement.owner.in_(dropped_news)))
+    if dropped_links: # edge goes unless another stage_history item still links the pair
+        connection.execute(sa.delete(GraphElement).where(GraphElement.id.in_([f'news#{news_id}-ent#{entity_id}' for news_id, entity_id in dropped_links])))
+        kept = connection.execute(sa.select(EntityNews.news_id, EntityNews.entity_id)
+                                    .where(EntityNews.news_id.in_([news_id for news_id, entity_id in dropped_links]),
+                                           EntityNews.entity_id.in_([entity_id for news_id, entity_id in dropped_links])))
+        links.extend(tuple(link) for link in kept if tuple(link) in dropped_links)
+    for entity_id, with_news in entities.items():
+        write_entity(connection, entity_id, with_news)
+    write_news(connection, links)
+    bump_cache_version(connection, 'graph')
+
+
+def giant_map_json():
+    """ {"edges": [...], "nodes": [...]} as a JSON string, joined from the stored elements """
+    version = cache_version('graph')
+    if graph_cache['version'] != version or graph_cache['json'] is None:
+        rows = db.session.execute(sa.select(GraphElement.kind, GraphElement.data).order_by(GraphElement.id)).all()
+        edges = ', '.join(data for kind, data in rows if kind == 'edge')
+        nodes = ', '.join(data for kind, data in rows if kind == 'node')
+        graph_cache['json'] = '{"edges": [' + edges + '], "nodes": [' + nodes + ']}'
+        graph_cache['version'] = version
+    return graph_cache['json']
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""
+Lightweight request / SQL / template instrumentation, served as Prometheus text by the admin-only /metrics route.
+- request latency histogram per endpoint (before_request -> after_request, so a streamed response counts until it starts)
+- SQL statements and SQL time per endpoint (Engine before/after_cursor_execute), plus a per-request statement count histogram
+- template render time per template (Flask before_render_template / template_rendered signals)
+- N+1 flag: the same SQL statement run n_plus_one_threshold or more times in one request (or instrument() scope) -
+  logged with the statement, and counted per endpoint
+Numbers are per process (mod_wsgi daemon process), since each keeps its own; restarted processes start again at zero.
+Backend scripts get the N+1 / SQL logging for a block of work with: with instrument('create_report'): ...
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from contextvars import ContextVar
+from collections import Counter
+import sqlalchemy as sa
+from flask import g, request, before_render_template, template_rendered
+from app import app
+
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # seconds
+query_buckets = (1, 2, 5, 10, 25, 50, 100, 250) # statements per request
+n_plus_one_threshold = int(os.getenv('METRICS_N_PLUS_ONE', '10'))
+current_scope = ContextVar('metrics_scope', default=None)
+lock = threading.Lock()
+
+
+class Histogram:
+    """ cumulative bucket counts, sum and count, per label value """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {} # label -> [bucket counts, sum, count]
+
+    def observe(self, label, value):
+        series = self.series.setdefault(label, [[0] * len(self.buckets), 0.0, 0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def lines(self, name, label_name):
+        for label, (counts, total, count) in sorted(self.series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f'{name}_bucket{{{label_name}="{label}",le="{bound}"}} {bucket_count}'
+            yield f'{name}_bucket{{{label_name}="{label}",le="+Inf"}} {count}'
+            yield f'{name}_sum{{{label_name}="{label}"}} {total:.6f}'
+            yield f'{name}_count{{{label_name}="{label}"}} {count}'
+
+
+request_seconds = Histogram(latency_buckets)
+request_queries = Histogram(query_buckets)
+requests_total = Counter() # (endpoint, status)
+sql_queries_total = Counter() # endpoint
+sql_seconds_total = Counter()
+template_seconds_total = Counter() # template
+template_renders_total = Counter()
+n_plus_one_total = Counter() # endpoint
+
+
+class Scope:
+    """ one request (or instrument() block): its SQL statements and time """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+
+    def repeated(self):
+        """ (statement, times) run n_plus_one_threshold or more times """
+        return [(statement, times) for statement, times in self.statements.most_common() if times >= n_plus_one_threshold]
+
+
+def statement_shape(statement):
+    """ statement with literals folded, so 'WHERE id = 5' and 'WHERE id = 6' (and IN lists of any length) count as the same """
+    shape = re.sub(r"'[^']*'|\b\d+\b", '?', statement)
+    shape = re.sub(r'\((?:\s*\?\s*,)+\s*\?\s*\)', '(?)', shape)
+    return ' '.join(shape.split())
+
+
+def flag_n_plus_one(scope):
+    repeated = scope.repeated()
+    for statement, times in repeated:
+        logging.warning(f'==> possible N+1 in {scope.name}: same query {times} times ({scope.queries} total): {statement[:200]}')
+    return len(repeated)
+
+
+@sa.event.listens_for(sa.engine.Engine, 'before_cursor_execute')
+def sql_started(conn, cursor, statement, parameters, context, executemany):
+    """ start time rides on the statement's own execution context - nothing left behind if it raises """
+    if context is not None and current_scope.get() is not None:
+        context._metrics_start = time.perf_counter()
+
+
+@sa.event.listens_for(sa.engine.Engine, 'after_cursor_execute')
+def sql_finished(conn, cursor, statement, parameters, context, executemany):
+    scope = current_scope.get()
+    started = getattr(context, '_metrics_start', None)
+    if scope is None or started is None:
+        return
+    scope.queries += 1
+    scope.sql_seconds += time.perf_counter() - started
+    scope.statements[statement_shape(statement)] += 1
+
+
+@app.before_request
+def start_request():
+    g.metrics_scope = Scope(request.endpoint or 'unmatched')
+    g.metrics_token = current_scope.set(g.metrics_scope)
+
+
+@app.after_request
+def finish_request(response):
+    scope = g.get('metrics_scope')
+    if scope is None or scope.name == 'metrics': # scrapes aren't traffic
+        return response
+    flagged = flag_n_plus_one(scope)
+    with lock:
+        request_seconds.observe(scope.name, time.perf_counter() - scope.start)
+        request_queries.observe(scope.name, scope.queries)
+        requests_total[(scope.name, response.status_code)] += 1
+        sql_queries_total[scope.name] += scope.queries
+        sql_seconds_total[scope.name] += scope.sql_seconds
+        n_plus_one_total[scope.name] += flagged
+    return response
+
+
+@app.teardown_request
+def end_request(exc):
+    """ also runs when the view raised (no after_request then) """
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        try:
+            current_scope.reset(token)
+        except ValueError: # streamed response finished in another context; nothing of ours left set there
+            pass
+
+
+@before_render_template.connect_via(app)
+def template_started(sender, template, context, **extra):
+    g.setdefault('metrics_renders', []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def template_finished(sender, template, context, **extra):
+    renders = g.get('metrics_renders')
+    if not renders:
+        return
+    with lock:
+        template_seconds_total[template.name] += time.perf_counter() - renders.pop()
+        template_renders_total[template.name] += 1
+
+
+class instrument:
+    """ with instrument('create_report'): ... - SQL count / time logged at the end, N+1 flagged (scripts, outside requests) """
+
+    def __init__(self, name):
+        self.scope = Scope(name)
+
+    def __enter__(self):
+        self.token = current_scope.set(self.scope)
+        return self.scope
+
+    def __exit__(self, *exc):
+        current_scope.reset(self.token)
+        flag_n_plus_one(self.scope)
+        logging.info(f'==> {self.scope.name}: {self.scope.queries} SQL statements, {self.scope.sql_seconds:.3f}s SQL, '
+                     f'{time.perf_counter() - self.scope.start:.3f}s total')
+        return False
+
+
+def counter_lines(name, kind, help_text, counter, label_names):
+    yield f'# HELP {name} {help_text}'
+    yield f'# TYPE {name} {kind}'
+    for labels, value in sorted(counter.items(), key=lambda item: str(item[0])):
+        labels = labels if isinstance(labels, tuple) else (labels,)
+        label_text = ','.join(f'{label_name}="{label}"' for label_name, label in zip(label_names, labels))
+        yield f'{name}{{{label_text}}} {value:.6f}' if isinstance(value, float) else f'{name}{{{label_text}}} {value}'
+
+
+def metrics_text():
+    """ everything above, Prometheus text exposition format (0.0.4) """
+    with lock:
+        lines = ['# HELP em_request_duration_seconds Request latency, before_request to after_request.',
+                 '# TYPE em_request_duration_seconds histogram',
+                 *request_seconds.lines('em_request_duration_seconds', 'endpoint'),
+                 '# HELP em_request_sql_queries SQL statements per request.',
+                 '# TYPE em_request_sql_queries histogram',
+                 *request_queries.lines('em_request_sql_queries', 'endpoint'),
+                 *counter_lines('em_requests_total', 'counter', 'Requests by endpoint and status.', requests_total, ('endpoint', 'status')),
+                 *counter_lines('em_sql_queries_total', 'counter', 'SQL statements run, by endpoint.', sql_queries_total, ('endpoint',)),
+                 *counter_lines('em_sql_seconds_total', 'counter', 'Time in SQL statements, by endpoint.', sql_seconds_total, ('endpoint',)),
+                 *counter_lines('em_template_render_seconds_total', 'counter', 'Template render time.', template_seconds_total, ('template',)),
+                 *counter_lines('em_template_renders_total', 'counter', 'Template renders.', template_renders_total, ('template',)),
+                 *counter_lines('em_n_plus_one_total', 'counter', f'Statements repeated {n_plus_one_threshold}+ times in one request.', n_plus_one_total, ('endpoint',))]
+    return '\n'.join(lines) + '\n'
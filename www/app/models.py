@@ -6,7 +6,17 @@ from app import db, login
 from sqlalchemy.ext.mutable import MutableList
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import Text
-from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, date
+from collections import Counter
+import dateparser
+
+
+# entities needing enrichment, per field (backend/populate_blanks.py); literal SQL so queries using these match the partial indexes on Entity
+entity_blank_sql = {'summary':  "status != 'disabled' AND (summary IS NULL OR summary = '')",
+                    'timeline': "status != 'disabled' AND (timeline IS NULL OR timeline = '')",
+                    'data_map': "status != 'disabled' AND (data_map IS NULL OR data_map = '')",
+                    'ent_url':  "status != 'disabled' AND (ent_url IS NULL OR ent_url = '' OR ent_url = 'UNK')"}
 
 
 class Entity(UserMixin, db.Model):
@@ -14,17 +24,26 @@ class Entity(UserMixin, db.Model):
     status:        so.Mapped[str] = so.mapped_column(sa.String(10), default='potential') # live, potential, disabled
     name:          so.Mapped[str] = so.mapped_column(sa.String(64), index=True, unique=True)
     ent_url:       so.Mapped[str] = so.mapped_column(sa.String(70), nullable=True)
-    seed:          so.Mapped[str] = so.mapped_column(sa.Text, nullable=True)
+    seed:          so.Mapped[str] = so.mapped_column(sa.Text, nullable=True, deferred=True, deferred_group='text')
     stage_current: so.Mapped[int] = so.mapped_column(default='1')
-    stage_history: so.Mapped[Optional[list]] = so.mapped_column(MutableList.as_mutable(sa.PickleType), default=[]) # each list item should be date and stage value, with hopefully a third, news item id
+    stage_history: so.Mapped[Optional[list]] = so.mapped_column(MutableList.as_mutable(sa.PickleType), default=[], deferred=True, deferred_group='history') # each list item should be date and stage value, with hopefully a third, news item id
     stage_EM4view: so.Mapped[int] = so.mapped_column(default='2')
     date_started:  so.Mapped[str] = so.mapped_column(sa.String(10), default='')
     date_ended:    so.Mapped[str] = so.mapped_column(sa.String(10), default='current')
-    summary:       so.Mapped[str] = so.mapped_column(sa.String(1024), nullable=True)
+    summary:       so.Mapped[str] = so.mapped_column(sa.String(1024), nullable=True, deferred=True, deferred_group='text')
     corp_fam:      so.Mapped[str] = so.mapped_column(sa.String(64), nullable=True)
     category:      so.Mapped[str] = so.mapped_column(sa.String(64), nullable=True) # Social, Cloud, B2B, B2C, C2C, tech platform, P2P
-    timeline:      so.Mapped[str] = so.mapped_column(sa.String(4096), nullable=True)
-    data_map:      so.Mapped[str] = so.mapped_column(sa.Text, nullable=True)
+    timeline:      so.Mapped[str] = so.mapped_column(sa.String(4096), nullable=True, deferred=True, deferred_group='text')
+    data_map:      so.Mapped[str] = so.mapped_column(sa.Text, nullable=True, deferred=True, deferred_group='text')
+    stage_anchor_day:   so.Mapped[Optional[int]]   = so.mapped_column(nullable=True) # running exponential-decay sums for stage_current, relative to this day (date.toordinal)
+    stage_weight_sum:   so.Mapped[Optional[float]] = so.mapped_column(nullable=True) # None if stage_history was edited by hand, recomputed on next news item
+    stage_weighted_sum: so.Mapped[Optional[float]] = so.mapped_column(nullable=True)
+    row_version:   so.Mapped[int] = so.mapped_column(default=1, server_default='1') # bumped by every ORM update; a stale one (row changed since loaded) raises StaleDataError
+    __mapper_args__ = {'version_id_col': row_version}
+    __table_args__ = (sa.Index('ix_entity_blank_summary', 'id', sqlite_where=sa.text(entity_blank_sql['summary'])), # partial: only rows needing work
+                      sa.Index('ix_entity_blank_timeline', 'id', sqlite_where=sa.text(entity_blank_sql['timeline'])),
+                      sa.Index('ix_entity_blank_data_map', 'id', sqlite_where=sa.text(entity_blank_sql['data_map'])),
+                      sa.Index('ix_entity_blank_ent_url', 'id', sqlite_where=sa.text(entity_blank_sql['ent_url'])))
 
     def __repr__(self):
         return '<Entity {}>'.format(self.name)
@@ -39,6 +58,9 @@ class News(UserMixin, db.Model):
     ent_names:     so.Mapped[Optional[list]] = so.mapped_column(MutableList.as_mutable(sa.PickleType), default=[])
     judgment:      so.Mapped[str] = so.mapped_column(sa.String(1024), nullable=True)
     stage_int_value: so.Mapped[int] = so.mapped_column(nullable=True)
+    __table_args__ = (sa.Index('ix_news_date_pub_id', 'date_pub', 'id'), # keyset pagination, one per sort choice
+                      sa.Index('ix_news_stage_int_value_id', 'stage_int_value', 'id'),
+                      sa.Index('ix_news_text_id', 'text', 'id'))
 
     def __repr__(self):
         return '<News {}>'.format(self.text)
@@ -51,6 +73,8 @@ class Art(UserMixin, db.Model):
     text:          so.Mapped[str] = so.mapped_column(sa.String(128), nullable=True)
     summary:       so.Mapped[str] = so.mapped_column(sa.String(1024), nullable=True)
     ent_names:     so.Mapped[Optional[list]] = so.mapped_column(MutableList.as_mutable(sa.PickleType), default=[])
+    __table_args__ = (sa.Index('ix_art_date_pub_id', 'date_pub', 'id'), # keyset pagination, one per sort choice
+                      sa.Index('ix_art_text_id', 'text', 'id'))
 
     def __repr__(self):
         return '<Art {}>'.format(self.text)
@@ -62,6 +86,7 @@ class References(UserMixin, db.Model):
     url:           so.Mapped[str] = so.mapped_column(sa.String(64), nullable=True)
     text:          so.Mapped[str] = so.mapped_column(sa.String(128), nullable=True)
     summary:       so.Mapped[str] = so.mapped_column(sa.String(1024), nullable=True)
+    __table_args__ = (sa.Index('ix_references_date_pub_id', 'date_pub', 'id'),) # keyset pagination
 
     def __repr__(self):
         return '<References {}>'.format(self.text)
@@ -136,6 +161,197 @@ class SurveyNewUser(UserMixin, db.Model):
     def __repr__(self):
         return '<SurveyNewUser {}>'.format(self.text)
 
+class SlashdotPost(UserMixin, db.Model):
+    id:            so.Mapped[int] = so.mapped_column(primary_key=True)
+    title_id:      so.Mapped[str] = so.mapped_column(sa.String(32), index=True, unique=True) # slashdot story-title id, ex: "title-235123"
+    status:        so.Mapped[str] = so.mapped_column(sa.Enum('new', 'processing', 'processed', 'error', name='post_status', native_enum=False), default='new', index=True)
+    #              new - seen on front page, not yet processed; processing - claimed by a scrape run
+    first_seen:    so.Mapped[datetime] = so.mapped_column(sa.DateTime, index=True)
+    last_attempt:  so.Mapped[Optional[datetime]] = so.mapped_column(sa.DateTime, nullable=True)
+    attempts:      so.Mapped[int] = so.mapped_column(default=0)
+
+    def __repr__(self):
+        return '<SlashdotPost {}>'.format(self.title_id)
+
+
+class EntityNews(UserMixin, db.Model):
+    """ one row per Entity.stage_history item, so per-entity and date-range lookups are indexed SQL instead of unpickling every entity; written only by sync_link_tables """
+    __tablename__ = 'entity_news'
+    id:            so.Mapped[int] = so.mapped_column(primary_key=True)
+    entity_id:     so.Mapped[int] = so.mapped_column(sa.ForeignKey('entity.id'), index=True)
+    news_id:       so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey('news.id'), nullable=True, index=True) # None for hand-entered / foundational stage points
+    date_pub:      so.Mapped[Optional[date]] = so.mapped_column(sa.Date, nullable=True, index=True)
+    stage_value:   so.Mapped[Optional[int]] = so.mapped_column(nullable=True)
+    __table_args__ = (sa.Index('ix_entity_news_entity_id_date_pub', 'entity_id', 'date_pub'),)
+    entity:        so.Mapped['Entity'] = so.relationship() # so rows for a not yet flushed entity get its id
+
+    def __repr__(self):
+        return '<EntityNews {} {}>'.format(self.entity_id, self.news_id)
+
+
+class UserFollow(UserMixin, db.Model):
+    """ User.entities_following as rows; user_id + entity_id; written only by sync_link_tables """
+    __tablename__ = 'user_follow'
+    user_id:       so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), primary_key=True)
+    entity_id:     so.Mapped[int] = so.mapped_column(sa.ForeignKey('entity.id'), primary_key=True, index=True)
+    user:          so.Mapped['User'] = so.relationship()
+    entity:        so.Mapped['Entity'] = so.relationship()
+
+    def __repr__(self):
+        return '<UserFollow {} {}>'.format(self.user_id, self.entity_id)
+
+
+class CacheVersion(UserMixin, db.Model):
+    """ bumped on every flush that touches the named table, so per-process caches (ex: rankings) know when to rebuild """
+    name:          so.Mapped[str] = so.mapped_column(sa.String(32), primary_key=True) # ex: 'entity'
+    version:       so.Mapped[int] = so.mapped_column(default=0)
+
+    def __repr__(self):
+        return '<CacheVersion {} {}>'.format(self.name, self.version)
+
+
+class TimelineRefresh(UserMixin, db.Model):
+    """ pending timeline rebuild, one row per entity so repeat news hits coalesce; filled by semantics.py, drained by backend/timeline_worker.py """
+    __tablename__ = 'timeline_refresh'
+    entity_id:       so.Mapped[int] = so.mapped_column(sa.ForeignKey('entity.id'), primary_key=True)
+    hits:            so.Mapped[int] = so.mapped_column(default=1) # news hits coalesced into this rebuild; also how the worker spots hits that landed mid-rebuild
+    first_requested: so.Mapped[datetime] = so.mapped_column(sa.DateTime)
+    due:             so.Mapped[datetime] = so.mapped_column(sa.DateTime, index=True) # pushed back by each new hit (debounce), never past deadline
+    deadline:        so.Mapped[datetime] = so.mapped_column(sa.DateTime)
+    attempts:        so.Mapped[int] = so.mapped_column(default=0)
+    last_error:      so.Mapped[Optional[str]] = so.mapped_column(sa.String(256), nullable=True)
+
+    def __repr__(self):
+        return '<TimelineRefresh {} {}>'.format(self.entity_id, self.due)
+
+
+class GraphElement(UserMixin, db.Model):
+    """ one pre-serialized Cytoscape node / edge of the giant map, kept current by app/graph.py """
+    __tablename__ = 'graph_element'
+    id:            so.Mapped[str] = so.mapped_column(sa.String(160), primary_key=True) # Cytoscape element id, ex: 'ent#12', 'news#40-ent#12'
+    kind:          so.Mapped[str] = so.mapped_column(sa.String(4)) # node, edge
+    owner:         so.Mapped[str] = so.mapped_column(sa.String(32), index=True) # base, shared, ent#<id>, news#<id> - what rewrites / drops it
+    entity_id:     so.Mapped[Optional[int]] = so.mapped_column(nullable=True, index=True) # entity it hangs off, to drop with the entity
+    data:          so.Mapped[str] = so.mapped_column(sa.Text) # json
+
+    def __repr__(self):
+        return '<GraphElement {}>'.format(self.id)
+
+
+# heavy Entity columns are deferred - 'text' group (seed, summary, timeline, data_map) and 'history' group (pickled stage_history) -
+# each group loads in one query on first touch; list views use entity_list, whole-row views / scripts entity_full
+entity_list_columns = ('id', 'name', 'status', 'category', 'stage_current', 'stage_EM4view')
+
+
+def entity_list(*columns):
+    """ select(Entity) loading just columns (default entity_list_columns) plus row_version; add .where / .order_by as usual """
+    return sa.select(Entity).options(so.load_only(Entity.row_version, *(getattr(Entity, column) for column in columns or entity_list_columns)))
+
+
+def entity_full():
+    """ select(Entity) with the deferred groups loaded up front, for pages / scripts that use every column of many rows """
+    return sa.select(Entity).options(so.undefer_group('text'), so.undefer_group('history'))
+
+
+def cache_version(name):
+    return db.session.scalar(sa.select(CacheVersion.version).where(CacheVersion.name == name)) or 0
+
+
+def bump_cache_version(connection, name):
+    upsert = sqlite_insert(CacheVersion).values(name=name, version=1)
+    upsert = upsert.on_conflict_do_update(index_elements=['name'], set_={'version': CacheVersion.version + 1})
+    connection.execute(upsert)
+
+
+@sa.event.listens_for(so.Session, 'before_flush')
+def bump_entity_version(session, flush_context, instances):
+    """ any Entity added / changed / deleted - web routes, semantics.py, populate_blanks.py, ... - bumps 'entity' in the same transaction """
+    if any(isinstance(obj, Entity) for obj in (*session.new, *session.dirty, *session.deleted)):
+        bump_cache_version(session.connection(), 'entity')
+
+
+def stage_hist_date(value):
+    """ stage_history dates are free-form strings ('2024-05-01', 'YYYY MMM DD', ...); None if unparseable """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        parsed = dateparser.parse(str(value))
+        return parsed.date() if parsed else None
+
+
+def entity_news_key(item):
+    """ stage_history item (date, stage value, news item id, ...) to the (news id, date, stage value) of its EntityNews row """
+    if isinstance(item, dict): # as saved by the manual entity forms (HistItemForm)
+        item = [item.get('date'), item.get('stage')]
+    try:
+        stage_value = int(item[1])
+    except (IndexError, TypeError, ValueError):
+        stage_value = None
+    news_id = item[2] if len(item) > 2 and isinstance(item[2], int) else None
+    return news_id, stage_hist_date(item[0]), stage_value
+
+
+def list_changed(obj, name):
+    """ list column reassigned, appended to (MutableList), or flag_modified; False if never loaded """
+    return sa.inspect(obj).attrs[name].history.has_changes()
+
+
+def sync_entity_news(session, entities):
+    """ bring each entity's EntityNews rows in line with its stage_history; rows still matching an item are kept, so a judgment appended is one INSERT """
+    existing = {}
+    ids = [entity.id for entity in entities if entity.id is not None]
+    if ids:
+        for row in session.scalars(sa.select(EntityNews).where(EntityNews.entity_id.in_(ids))):
+            existing.setdefault(row.entity_id, []).append(row)
+    for entity in entities:
+        wanted = Counter(entity_news_key(item) for item in entity.stage_history or [] if item)
+        for row in existing.get(entity.id, []):
+            key = (row.news_id, row.date_pub, row.stage_value)
+            if wanted[key]:
+                wanted[key] -= 1
+            else:
+                session.delete(row)
+        for (news_id, date_pub, stage_value), count in wanted.items():
+            session.add_all(EntityNews(entity=entity, news_id=news_id, date_pub=date_pub, stage_value=stage_value) for _ in range(count))
+
+
+def sync_user_follows(session, users):
+    """ bring each user's UserFollow rows in line with its entities_following list (entity names) """
+    existing = {}
+    ids = [user.id for user in users if user.id is not None]
+    if ids:
+        for row in session.scalars(sa.select(UserFollow).where(UserFollow.user_id.in_(ids))):
+            existing.setdefault(row.user_id, {})[row.entity_id] = row
+    names = {name for user in users for name in user.entities_following or []}
+    entity_ids = dict(session.execute(sa.select(Entity.name, Entity.id).where(Entity.name.in_(names))).all()) if names else {}
+    pending = {obj.name: obj for obj in session.new if isinstance(obj, Entity) and obj.name in names} # added in this same flush, no id yet
+    for user in users:
+        wanted = {entity_ids[name] for name in user.entities_following or [] if name in entity_ids}
+        rows = existing.get(user.id, {})
+        for entity_id in rows.keys() - wanted:
+            session.delete(rows[entity_id])
+        session.add_all(UserFollow(user=user, entity_id=entity_id) for entity_id in wanted - rows.keys())
+        session.add_all(UserFollow(user=user, entity=pending[name]) for name in set(user.entities_following or []) if name in pending and name not in entity_ids)
+
+
+@sa.event.listens_for(so.Session, 'before_flush')
+def sync_link_tables(session, flush_context, instances):
+    """
+    EntityNews / UserFollow are derived from Entity.stage_history / User.entities_following, here and nowhere else -
+    whatever changed the list (judgment, web form, fix script, backfill), the rows follow in the same flush.
+    In-place edits of items inside stage_history need flag_modified(entity, 'stage_history') to be seen (and saved).
+    """
+    entities = [obj for obj in (*session.new, *session.dirty) if isinstance(obj, Entity) and list_changed(obj, 'stage_history')]
+    users = [obj for obj in (*session.new, *session.dirty) if isinstance(obj, User) and list_changed(obj, 'entities_following')]
+    if entities:
+        sync_entity_news(session, entities)
+    if users:
+        sync_user_follows(session, users)
+
 """
 References:
 
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+Keyset (seek) pagination for the list pages - news, art, references.
+Pages are fetched with WHERE (sort_col, id) > (last seen sort value, last seen id) ... LIMIT per_page,
+rather than OFFSET, so deep pages cost the same as the first one (given an index on sort_col, id).
+Cursors are the last/first row's (sort value, id), json then urlsafe base64 so they ride along as a query arg.
+"""
+
+import sqlalchemy as sa
+import base64
+import json
+
+
+default_per_page = 20
+max_per_page = 200
+
+
+def page_size(user):
+    """ User.per_page, clamped; anonymous visitors get the default """
+    per_page = getattr(user, 'per_page', None) or default_per_page
+    return max(1, min(int(per_page), max_per_page))
+
+
+def encode_cursor(sort_value, row_id):
+    return base64.urlsafe_b64encode(json.dumps([sort_value, row_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """ (sort value, id) or None if missing / garbled (then just serve first page) """
+    if not cursor:
+        return None
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def seek_filter(sort_col, id_col, cursor, descending):
+    """
+    Rows strictly after cursor in (sort_col, id_col) order.
+    SQLite sorts NULL lowest - first ascending, last descending - so NULL sort values get their own branches.
+    """
+    sort_value, row_id = cursor
+    if not descending:
+        if sort_value is None:
+            return sa.or_(sa.and_(sort_col.is_(None), id_col > row_id), sort_col.is_not(None))
+        return sa.or_(sort_col > sort_value, sa.and_(sort_col == sort_value, id_col > row_id))
+    if sort_value is None:
+        return sa.and_(sort_col.is_(None), id_col < row_id)
+    return sa.or_(sort_col < sort_value, sa.and_(sort_col == sort_value, id_col < row_id), sort_col.is_(None))
+
+
+def keyset_page(query, sort_col, id_col, descending, per_page, after=None, before=None):
+    """
+    One page of query ordered by (sort_col, id_col).
+    after - cursor to page forward from; before - cursor to page back from (walks the order reversed, then flips the rows).
+    Returns (items, next cursor, previous cursor); a cursor is None when there is nothing further that way.
+    """
+    backward = bool(before)
+    cursor = decode_cursor(before if backward else after)
+    step_descending = descending != backward
+    if cursor:
+        query = query.filter(seek_filter(sort_col, id_col, cursor, step_descending))
+    direction = sa.desc if step_descending else sa.asc
+    rows = query.order_by(direction(sort_col), direction(id_col)).limit(per_page + 1).all() # one extra tells whether there is more
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+    has_next = True if backward else more
+    has_prev = more if backward else cursor is not None
+    next_cursor = prev_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(getattr(rows[-1], sort_col.key), getattr(rows[-1], id_col.key))
+    if rows and has_prev:
+        prev_cursor = encode_cursor(getattr(rows[0], sort_col.key), getattr(rows[0], id_col.key))
+    return rows, next_cursor, prev_cursor
@@ -19,9 +19,14 @@ from app import app, db
 from app.forms import EntityAddForm, EntityEditForm, NewsForm, ArtForm, ReferencesForm, SelectForm, SelectAddForm
 from app.forms import LoginForm, RegistrationForm, EditProfileForm, ChangePasswordForm, OtpcodeForm, SurveyNewUserForm, PasswordCheckForm
 from app.forms import NotificationSettingsForm
-from app.models import Entity, News, Art, References, User, SurveyNewUser
+from app.models import Entity, News, Art, References, User, SurveyNewUser, EntityNews, UserFollow, TimelineRefresh, cache_version
+from app.models import entity_list, entity_full
+from app.graph import giant_map_json
 from app.banners import banner_ads
-from flask import render_template, redirect, url_for, flash, request, session, send_from_directory, jsonify
+from app.pagination import keyset_page, page_size
+from app.exports import export_response
+from app.metrics import metrics_text
+from flask import render_template, redirect, url_for, flash, request, session, send_from_directory, jsonify, abort
 from flask_login import login_user, logout_user, current_user, login_required, user_loaded_from_cookie
 # https://flask-login.readthedocs.io/en/latest/#
 from flask_simple_captcha import CAPTCHA
@@ -29,6 +34,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import sqlalchemy as sa
 from sqlalchemy import or_, asc, desc, func
 from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
 import socket
 # pipenv install Flask pyotp Flask-Mail
 import pyotp
@@ -48,6 +54,11 @@ hostn = socket.gethostname()
 ntfypost = True
 alert_title = f'EM on {hostn} user activity'
 
+# rankings result set and graph, per (ranking_stat, ranking_cats, ranking_sort, display_order, stage 4 view);
+# whole cache dropped when CacheVersion 'entity' moves (any Entity write, from here or the backend scripts)
+rankings_cache = {'version': None, 'entries': {}}
+rankings_cache_max = 64
+
 # TOTP controls
 validity_period = 90 # default 30 (seconds); validity period for TOTP object
 interval_grace_period = 1 # default 0; flexibility, how many previous or future intervals (time steps) are allowed during verification
@@ -109,19 +120,42 @@ def rankings():
         flash('Must be logged in to access page...')
         return render_template('anonymous.html',
                                 then_next = 'rankings')
-    # entities = Entity.query.all() # initial old "query"
-    # SQLAlchemy queries are chained, each filter() adds to the query without overwriting it.
+    selected_ad = random.choice(banner_ads)
+    version = cache_version('entity')
+    if rankings_cache['version'] != version:
+        rankings_cache['version'] = version
+        rankings_cache['entries'] = {}
+    key = (current_user.ranking_stat.lower(), current_user.ranking_cats.lower(), current_user.ranking_sort.lower(),
+           current_user.display_order.lower(), current_user.func_stage == 4)
+    cached = rankings_cache['entries'].get(key)
+    if cached:
+        entities, ranking_map = cached
+    else:
+        entities, ranking_map = build_rankings()
+        if len(rankings_cache['entries']) >= rankings_cache_max:
+            rankings_cache['entries'].pop(next(iter(rankings_cache['entries']))) # drop oldest entry
+        rankings_cache['entries'][key] = (entities, ranking_map)
+    return render_template('rankings.html', 
+                           entities = entities, 
+                           banner = selected_ad,
+                           ranking_map = ranking_map)
+
+
+def build_rankings():
+    """ current_user's filtered, sorted entity rows (just the columns rankings.html shows) and the Cytoscape ranking_map """
+    # SQLAlchemy queries are chained, each where() adds to the query without overwriting it.
     # Initialize the query
-    query = Entity.query
+    query = sa.select(Entity.name, Entity.status, Entity.stage_current, Entity.stage_EM4view, Entity.date_started, 
+                      Entity.date_ended, Entity.corp_fam, Entity.category, Entity.summary)
     # current_user.ranking_stat - filter - Live, Potential, Not Disabled, Disabled
     if current_user.ranking_stat.lower() == 'not disabled':
-        query = query.filter(Entity.status != 'disabled')
+        query = query.where(Entity.status != 'disabled')
     else:
-        query = query.filter(Entity.status == current_user.ranking_stat.lower())
+        query = query.where(Entity.status == current_user.ranking_stat.lower())
 
     # current_user.ranking_cats - filter - All, Social, Cloud, B2B, B2C, C2C, tech platform, P2P
     if current_user.ranking_cats.lower() != 'all':
-        query = query.filter(or_(Entity.category.like(f"%{cat.strip()}%") for cat in current_user.ranking_cats.split(',')))
+        query = query.where(or_(Entity.category.like(f"%{cat.strip()}%") for cat in current_user.ranking_cats.split(',')))
 
     # current_user.display_order - sort by recent first, oldest first
     if current_user.display_order.lower() == "oldest first":
@@ -142,10 +176,10 @@ def rankings():
         query = query.order_by(sorting_order(Entity.date_started))
 
     # Get the final results
-    entities = query.all()
-    selected_ad = random.choice(banner_ads)
+    entities = db.session.execute(query).all() # Row tuples, safe to keep across requests
     
     """ Build ranking_map with nodes for all shown in table """
+    ranking_map = None
     try:
         edge_data = []
         node_data = []
@@ -168,34 +202,22 @@ def rankings():
             """ node for each category (if any) """
             node_data.append( {"data": {"id": cat, "label": cat }})
         """ put it all together """
-        graph_data = {"edges": edge_data, "nodes": node_data}
-        map = json.dumps(graph_data, indent=4)
-        ranking_map = json.loads(map)
+        ranking_map = {"edges": edge_data, "nodes": node_data}
     except Exception as e:
         logging.error(f'In attempting to make ranking_map, get error: {e}')
     if not ranking_map:
         edge_data = [{"data": {"id": "01", "source": "0", "target": "1"}}]
         node_data = [{"data": {"id": "0", "label": "Rankings" }}, {"data": {"id": "1", "label": "No map data" }}]
-        graph_data = {"edges": edge_data, "nodes": node_data}
-        map = json.dumps(graph_data, indent=4)
-        ranking_map = json.loads(map)
-    
-    return render_template('rankings.html', 
-                           entities = entities, 
-                           banner = selected_ad,
-                           ranking_map = ranking_map)
+        ranking_map = {"edges": edge_data, "nodes": node_data}
+    return entities, ranking_map
 
 
 @app.route('/entity_detail/<entname>')
 @login_required
 def entity_detail(entname):
-    entity = db.session.scalar(sa.select(Entity).where(Entity.name == entname))
-    news_ids = []
-    if entity.stage_history:
-        for news_item in entity.stage_history:
-            if len(news_item) > 2 :
-                news_ids.append(news_item[2])
-    news = News.query.filter(News.id.in_(news_ids)).all()
+    entity = db.session.scalar(entity_full().where(Entity.name == entname))
+    news_ids = sa.select(EntityNews.news_id).where(EntityNews.entity_id == entity.id)
+    news = db.session.scalars(sa.select(News).where(News.id.in_(news_ids))).all()
     selected_ad = random.choice(banner_ads)
     if entity.data_map:
         data_map = json.loads(entity.data_map) # json.loads to de-serialize from storage as text in SQLite
@@ -212,6 +234,13 @@ def entity_detail(entname):
                            data_map = data_map)
 
 
+@app.route('/giant_map')
+@login_required
+def giant_map():
+    """ whole giant map (live entities, stages, categories, corp families, news items) as Cytoscape JSON, pre-serialized in app/graph.py """
+    return app.response_class(giant_map_json(), mimetype='application/json')
+
+
 @app.route('/update-filtersort', methods=['POST'])
 @login_required
 def update_filtersort():
@@ -267,24 +296,24 @@ def news():
     ###     query = query.filter(or_(Entity.category.like(f"%{cat.strip()}%") for cat in current_user.ranking_cats.split(',')))
 
     # current_user.display_order - sort by recent first, oldest first
-    if current_user.display_order.lower() == "oldest first":
-        sorting_order = desc # no quotes as this is a callable
-    else: # == recent first (default)
-        sorting_order = asc 
+    descending = current_user.display_order.lower() == "oldest first"
 
     # current_user.ranking_sort - sort by Name ~ by Stage* ~ by Age
     if current_user.ranking_sort.lower() == "name":
-        query = query.order_by(sorting_order(News.text))
+        sort_col = News.text
     elif current_user.ranking_sort.lower() == "stage":
-        query = query.order_by(sorting_order(News.stage_int_value))
-    elif current_user.ranking_sort.lower() == "age":
-        query = query.order_by(sorting_order(News.date_pub))
+        sort_col = News.stage_int_value
+    else: # age
+        sort_col = News.date_pub
 
-    # Get the final results
-    news = query.all()
+    # Get one page (keyset on sort column then id, so deep pages stay cheap)
+    news, next_cursor, prev_cursor = keyset_page(query, sort_col, News.id, descending, page_size(current_user),
+                                                 after = request.args.get('after'), before = request.args.get('before'))
     selected_ad = random.choice(banner_ads)
     return render_template('news.html', 
                            news = news, 
+                           next_cursor = next_cursor, 
+                           prev_cursor = prev_cursor, 
                            banner = selected_ad)
 
 
@@ -296,18 +325,18 @@ def art():
                                 then_next = 'art')
     # art = Art.query.all()
     query = Art.query
-    if current_user.display_order.lower() == "oldest first":
-        sorting_order = desc # no quotes as this is a callable
-    else: # == recent first (default)
-        sorting_order = asc 
+    descending = current_user.display_order.lower() == "oldest first"
     if current_user.ranking_sort.lower() == "name":
-        query = query.order_by(sorting_order(Art.text))
-    elif current_user.ranking_sort.lower() == "age":
-        query = query.order_by(sorting_order(Art.date_pub))
-    art = query.all()
+        sort_col = Art.text
+    else: # age
+        sort_col = Art.date_pub
+    art, next_cursor, prev_cursor = keyset_page(query, sort_col, Art.id, descending, page_size(current_user),
+                                                after = request.args.get('after'), before = request.args.get('before'))
     selected_ad = random.choice(banner_ads)
     return render_template('art.html', 
                            art = art, 
+                           next_cursor = next_cursor, 
+                           prev_cursor = prev_cursor, 
                            banner = selected_ad)
 
 
@@ -318,11 +347,14 @@ def references():
         if temp_value:
             if my_name not in temp_value:
                 session['user_referrer'] = temp_value
-    references = References.query.all()
-    random.shuffle(references) # shuffle the list in place
+    references, next_cursor, prev_cursor = keyset_page(References.query, References.date_pub, References.id, True, page_size(current_user),
+                                                       after = request.args.get('after'), before = request.args.get('before'))
+    random.shuffle(references) # shuffle just this page in place; pages themselves stay stable for the cursors
     selected_ad = random.choice(banner_ads)
     return render_template('references.html', 
                            references = references, 
+                           next_cursor = next_cursor, 
+                           prev_cursor = prev_cursor, 
                            banner = selected_ad)
 
 
@@ -494,10 +526,10 @@ def alerts():
         ("tech platform", "tech platform"),
         ("P2P", "P2P")]
     """ Generate a list of entities as tuples """
-    query = Entity.query
-    query = query.filter(Entity.status != 'disabled') # live and potential; (Entity.status == 'live') would be live only
+    query = entity_list('id', 'name')
+    query = query.where(Entity.status != 'disabled') # live and potential; (Entity.status == 'live') would be live only
     query = query.order_by(asc(Entity.name))
-    entities_objs = query.all()
+    entities_objs = db.session.scalars(query).all()
     entities = [] # append to list of tuples # sample: entities = [("entity1", "Entity 1")] 
     for index, ent in enumerate(entities_objs):
         entities.append((ent.name, ent.name)) # was using index, but that saved wrong name
@@ -864,6 +896,7 @@ def deleteaccount():
                 logout_user() # clears session data
                 user = User.query.get(user_id)
                 if user:
+                    db.session.execute(sa.delete(UserFollow).where(UserFollow.user_id == user.id))
                     db.session.delete(user) # current_user might still exist after logout due to lazy load, but just in case...
                     db.session.commit()
                     flash(f'Deleted {del_name} account.')
@@ -1018,6 +1051,17 @@ def missnewsid(dryorwet):
     return render_template('force_utilities.html', display = 'not yet implemented')
 
 
+def commit_entity_fixes():
+    """ commit a fix utility's entity changes; if a scrape / judgment changed one of them meanwhile (row_version), none are saved """
+    try:
+        db.session.commit()
+        return 'Commited Entities\n'
+    except StaleDataError:
+        db.session.rollback()
+        logging.warning('Entity fix not saved, an entity was changed by another process meanwhile')
+        return 'NOT commited - an entity was changed by another process (scrape / judgment) meanwhile, run it again.\n'
+
+
 @app.route('/statusfix/<dryorwet>')
 @login_required
 def statusfix(dryorwet):
@@ -1026,9 +1070,9 @@ def statusfix(dryorwet):
         return render_template('index.html')
     display = ''
     commit = False
-    query = Entity.query
-    query = query.filter(Entity.status != 'disabled')
-    entities = query.all()
+    query = entity_list('id', 'status', 'stage_history')
+    query = query.where(Entity.status != 'disabled')
+    entities = db.session.scalars(query).all()
     for ent in entities:
         if not ent.status:
             display += f'Entity ID #{ent.id} has NO stage_current value!\n'
@@ -1059,8 +1103,7 @@ def statusfix(dryorwet):
                 else:
                     logging.error(f"dryorwet value of {dryorwet} sent to datefix, which doesn't work...")
     if commit:
-        db.session.commit()
-        display += f'Commited Entities'
+        display += commit_entity_fixes()
     if not display:
         display = f'Nothing to display...'
     return render_template('force_utilities.html', display = display)
@@ -1076,9 +1119,9 @@ def stagefix(dryorwet):
     commit = False
     """ check Entity.stage_current """
     """ prob never does anything as Entity.stage_current is of type int """
-    query = Entity.query
-    query = query.filter(Entity.status != 'disabled')
-    entities = query.all()
+    query = entity_list('id', 'stage_current')
+    query = query.where(Entity.status != 'disabled')
+    entities = db.session.scalars(query).all()
     for ent in entities:
         if not ent.stage_current:
             display += f'Entity ID #{ent.id} has NO stage_current value!\n'
@@ -1095,13 +1138,12 @@ def stagefix(dryorwet):
         else:
             logging.error(f"dryorwet value of {dryorwet} sent to datefix, which doesn't work...")
     if commit:
-        db.session.commit()
-        display += f'Commited Entities'
+        display += commit_entity_fixes()
     """ check Entity.stage_history[i][1] """
     """ should be int; may be str like 'Stage 3' or '3' """
-    query = Entity.query
-    query = query.filter(Entity.status != 'disabled')
-    entities = query.all()
+    query = entity_list('id', 'stage_history')
+    query = query.where(Entity.status != 'disabled')
+    entities = db.session.scalars(query).all()
     for ent in entities:
         for count, item in enumerate(ent.stage_history, start=1): # stage_history is a mutable list
             stage_value = ent.stage_history[count-1][1]
@@ -1121,12 +1163,12 @@ def stagefix(dryorwet):
                 logging.info(f'Entity ID #{ent.id} had in stage_history item #{count} a date of "{stage_value}" which was changed to "{fix}"')
                 ent.stage_history[count-1][1] = fix # Modify the list in place (not a reference like item[1] = fix )
                 flag_modified(ent, "stage_history") # (model instance, column name storing the mutable list) call once per entity (inside the loop)
+                ent.stage_anchor_day = None # running stage sums no longer match history, recomputed on next news item
                 commit = True
             else:
                 logging.error(f"dryorwet value of {dryorwet} sent to datefix, which doesn't work...")
     if commit:
-        db.session.commit() # Call only once at the end to save all changes at once.
-        display += f'Flaged (mutable list) and commited Entities'
+        display += commit_entity_fixes() # Call only once at the end to save all changes at once.
     if not display:
         display = f'Nothing to display...'
     return render_template('force_utilities.html', display = display)
@@ -1210,9 +1252,9 @@ def datefix(dryorwet):
         display += f'Commited News'
     commit = False
     """ check Entity.stage_history --> list where item[0] is date, [1] is stage value, [2] is news item id """
-    query = Entity.query
-    query = query.filter(Entity.status != 'disabled')
-    entities = query.all()
+    query = entity_list('id', 'stage_history')
+    query = query.where(Entity.status != 'disabled')
+    entities = db.session.scalars(query).all()
     for ent in entities:
         for count, item in enumerate(ent.stage_history, start=1): # stage_history is a mutable list
             dt_value = ent.stage_history[count-1][0]
@@ -1230,12 +1272,12 @@ def datefix(dryorwet):
                 logging.info(f'Entity ID #{ent.id} had in stage_history item #{count} a date of "{dt_value}" which was changed to "{fix}"')
                 ent.stage_history[count-1][0] = str(fix) # Modify the list in place (not a reference like item[0] = str(fix) )
                 flag_modified(ent, "stage_history") # (model instance, column name storing the mutable list) call once per entity (inside the loop)
+                ent.stage_anchor_day = None # running stage sums no longer match history, recomputed on next news item
                 commit = True
             else:
                 logging.error(f"dryorwet value of {dryorwet} sent to datefix, which doesn't work...")
     if commit:
-        db.session.commit() # Call only once at the end to save all changes at once.
-        display += f'Flaged (mutable list) and commited Entities'
+        display += commit_entity_fixes() # Call only once at the end to save all changes at once.
     if not display:
         display = f'Nothing to display...'
     return render_template('force_utilities.html', display = display)
@@ -1313,7 +1355,7 @@ def show_values():
 def report_all():
     if current_user.role != 'administrator':
         return render_template('index.html')
-    entities = Entity.query.all()
+    entities = db.session.scalars(entity_full()).all()
     news = News.query.all()
     art = Art.query.all()
     references = References.query.all()
@@ -1329,7 +1371,7 @@ def report_all():
 def report_entities():
     if current_user.role != 'administrator':
         return render_template('index.html')
-    entities = Entity.query.all()
+    entities = db.session.scalars(entity_full()).all()
     return render_template('report.html', 
                            entities = entities, 
                            news = None, 
@@ -1342,7 +1384,7 @@ def report_entities():
 def report_entids():
     if current_user.role != 'administrator':
         return render_template('index.html')
-    entities = Entity.query.all()
+    entities = db.session.scalars(entity_full()).all()
     return render_template('report_entids.html', 
                            entities = entities)
 
@@ -1386,6 +1428,27 @@ def report_references():
                            references = references)
 
 
+@app.route('/metrics')
+@login_required
+def metrics():
+    """ per-endpoint latency, SQL and template timings, N+1 flags, in Prometheus text format - see app/metrics.py """
+    if current_user.role != 'administrator':
+        return render_template('index.html')
+    return app.response_class(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/export/<table>.<fmt>')
+@login_required
+def export_table(table, fmt):
+    """ streamed CSV / NDJSON dump of entities, news, art or references - see app/exports.py """
+    if current_user.role != 'administrator':
+        return render_template('index.html')
+    response = export_response(table, fmt)
+    if response is None:
+        abort(404)
+    return response
+
+
 @app.route('/manual_add', methods=['GET', 'POST'])
 @login_required
 def manual_add():
@@ -1451,6 +1514,9 @@ def manual_delete():
             case "Entity":
                 delete_record = Entity.query.get_or_404(form.target_id.data)
                 logging.info(f'Deleting {delete_record.name} (Entity ID #{form.target_id.data})')
+                db.session.execute(sa.delete(EntityNews).where(EntityNews.entity_id == delete_record.id))
+                db.session.execute(sa.delete(UserFollow).where(UserFollow.entity_id == delete_record.id))
+                db.session.execute(sa.delete(TimelineRefresh).where(TimelineRefresh.entity_id == delete_record.id))
                 db.session.delete(delete_record)
                 db.session.commit()
                 flash(f'Deleted entity ID #{form.target_id.data}')
@@ -1458,6 +1524,7 @@ def manual_delete():
             case "News":
                 delete_record = News.query.get_or_404(form.target_id.data)
                 logging.info(f'Deleting {delete_record.text} (News ID #{form.target_id.data})')
+                db.session.execute(sa.update(EntityNews).where(EntityNews.news_id == delete_record.id).values(news_id=None))
                 db.session.delete(delete_record)
                 db.session.commit()
                 flash(f'Deleted news ID #{form.target_id.data}')
@@ -1641,6 +1708,7 @@ def manual_entity_edit(id):
         entity.seed          = form.seed.data
         entity.stage_current = form.stage_current.data
         entity.stage_history = form.stage_history.data
+        entity.stage_anchor_day = None # running stage sums no longer match history, recomputed on next news item
         entity.stage_EM4view = form.stage_EM4view.data
         entity.date_started  = form.date_started.data
         entity.date_ended    = form.date_ended.data